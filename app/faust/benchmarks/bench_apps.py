@@ -0,0 +1,198 @@
+# End-to-end benchmark of the bundled Faust Apps, without Kafka or InfluxDB.
+# Each App runs in its own process: its agent is fed the dataset lines through Faust's in-memory test context,
+# InfluxDB writes go to the local FakeInfluxDB and output files to a temporary folder. For every App it reports
+# events/s, p50/p99 per-event latency (from the put of an event until Faust marks it processed), peak RSS and CPU time.
+# Results are saved as JSON; with --compare, slower events/s or higher p99 than a previous run are flagged.
+#
+# Usage: python benchmarks/bench_apps.py [--apps iqr,mmd] [--rows 2000] [--save bench_apps.json] [--compare previous.json]
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+CODE = os.path.join(BENCHMARKS, '..', 'code')
+DATASETS = os.path.join(BENCHMARKS, '..', '..', '..', 'datasets')
+
+# App name: (module, agent, dataset, environment); Chronos runs with a reduced window and horizon
+APPS = {
+    'iqr': ('OutlierDetection_DynamicIQRMethod', 'outlier_detection_agent', 'Labeled_Expanded.csv', {}),
+    'ocsvm': ('OutlierDetection_OneClassSVM', 'outlier_detection_agent', 'Labeled_Expanded.csv', {}),
+    'isolation_forest': ('AnomalyDetection_EnsembleIsolationForest', 'anomaly_detection_agent', 'Labeled_Expanded.csv', {}),
+    'mmd': ('CDDetection_MMD', 'drift_detection_agent', 'Labeled_Expanded.csv', {}),
+    'data_formater': ('DataFormater_For_Chronos', 'timeseries_processing_agent', 'Pressure_complete.csv', {}),
+    'chronos': ('AnomalyDetection_Chronos', 'timeseries_processing_agent', 'Pressure_1000rows.csv',
+                {'InitialTrainingBatch': '100', 'MaxWindowSize': '200', 'PredictionLength': '20', 'RetrainEveryRows': '300'}),
+    'chronos_ets': ('AnomalyDetection_Chronos', 'timeseries_processing_agent', 'Pressure_1000rows.csv',
+                    {'InitialTrainingBatch': '100', 'MaxWindowSize': '200', 'PredictionLength': '20', 'RetrainEveryRows': '300',
+                     'ForecastBackend': 'ets'}),
+    # One consumer and one parse for three detectors; compare its CPU time with the sum of iqr, ocsvm and mmd
+    # (its latency ends when the rows are handed to the pipelines)
+    'host_iqr_ocsvm_mmd': ('MultiDetector_Host', 'ingest_agent', 'Labeled_Expanded.csv',
+                           {'Pipelines': json.dumps([{'name': 'iqr', 'app': 'OutlierDetection_DynamicIQRMethod'},
+                                                     {'name': 'ocsvm', 'app': 'OutlierDetection_OneClassSVM'},
+                                                     {'name': 'mmd', 'app': 'CDDetection_MMD'}])}),
+}
+
+
+# Function to run one App in this process and return its measurements (called in the child process)
+def run_app(name, rows):
+    module_name, agent_name, dataset, _ = APPS[name]
+    sys.path.insert(0, CODE)
+    sys.path.insert(0, BENCHMARKS)
+    import builtins
+    import faust
+    from faust.sensors import Sensor
+    from fake_influxdb import FakeInfluxDB
+
+    influx = FakeInfluxDB().start()
+    os.environ['INFLUXDB_URL'] = influx.url
+
+    # Only the agent test context is used, so the App never connects to its broker; the broker URL is replaced
+    # by a plain Kafka URL because 'kafka_server://' is rejected by recent URL parsers when the topic is created
+    app_class = faust.App
+    faust.App = lambda *args, **kwargs: app_class(*args, **{**kwargs, 'broker': 'kafka://localhost:9092'})
+    quiet_print = builtins.print
+    builtins.print = lambda *args, **kwargs: None  # The Apps log every event
+    try:
+        module = __import__(module_name)
+    except ImportError as e:
+        builtins.print = quiet_print
+        return {'app': name, 'skipped': f"{e}"}
+
+    processed = {}
+
+    class ProcessedEvents(Sensor):
+        def on_stream_event_out(self, tp, offset, stream, event, state=None):
+            processed[offset] = time.perf_counter()
+
+    module.app.sensors.add(ProcessedEvents())
+    with open(os.path.join(DATASETS, dataset), encoding='utf-8-sig') as file:
+        lines = [line.strip() for line in file if line.strip()][:rows]
+
+    async def replay():
+        sent = []
+        async with getattr(module, agent_name).test_context() as agent:
+            for line in lines:
+                sent.append(time.perf_counter())
+                await agent.put({'csv_data': line})
+            await asyncio.sleep(0)
+            if hasattr(module, 'pipeline_host'):  # Let the pipelines finish and flush their sinks
+                for pipeline in list(module.pipeline_host.pipelines):
+                    await module.pipeline_host.remove(pipeline)
+        return sent
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    sent = asyncio.run(replay())
+    seconds = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    for sink in ('influx_sink', 'result_sink', 'keyed_state'):
+        if hasattr(module, sink):
+            getattr(module, sink).close()
+    influx.stop()
+    builtins.print = quiet_print
+
+    latencies = np.array([processed[offset] - sent[offset] for offset in processed if offset < len(sent)]) * 1000
+    return {
+        'app': name,
+        'dataset': dataset,
+        'events': len(sent),
+        'seconds': seconds,
+        'events_per_second': len(sent) / seconds,
+        'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+        'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+        'peak_rss_mb': after.ru_maxrss / 1024,
+        'cpu_seconds': (after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime),
+        'influx_lines': len(influx.lines),
+    }
+
+
+# Function to run one App in a fresh process (own memory peak, own output folder) and parse its result
+def run_app_process(name, rows, environment):
+    folder = tempfile.mkdtemp(prefix=f'bench_apps_{name}_')
+    env = {**os.environ, **APPS[name][3], **environment, 'OutputFileName': 'output', 'ModelStorePath': os.path.join(folder, 'models')}
+    try:
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name, '--rows', str(rows)],
+                                cwd=folder, env=env, capture_output=True, text=True)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    if result.returncode != 0 or not result.stdout.strip():
+        return {'app': name, 'failed': (result.stderr.strip().splitlines() or ['no output'])[-1]}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+# Function to compare two runs: (app, metric, previous, current) for every metric worse than its tolerance
+# (latency percentiles are noisier than throughput and memory, so they get their own tolerance)
+def regressions(previous, current, tolerance, latency_tolerance):
+    before = {result['app']: result for result in previous['results'] if 'events_per_second' in result}
+    found = []
+    for result in current['results']:
+        old = before.get(result['app'])
+        if old is None or 'events_per_second' not in result:
+            continue
+        if result['events_per_second'] < old['events_per_second'] * (1 - tolerance):
+            found.append((result['app'], 'events_per_second', old['events_per_second'], result['events_per_second']))
+        for metric, allowed in (('p99_ms', latency_tolerance), ('peak_rss_mb', tolerance)):
+            if old.get(metric) and result.get(metric) and result[metric] > old[metric] * (1 + allowed):
+                found.append((result['app'], metric, old[metric], result[metric]))
+    return found
+
+
+# Function to read the current git commit, if any
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='End-to-end benchmark of the bundled Faust Apps.')
+    parser.add_argument('--apps', default=','.join(APPS), help=f"comma-separated Apps (default: {','.join(APPS)})")
+    parser.add_argument('--rows', type=int, default=3000, help='maximum dataset rows sent to each App')
+    parser.add_argument('--env', action='append', default=[], help='extra App setting NAME=VALUE, repeatable (e.g. BatchMaxEvents=64)')
+    parser.add_argument('--save', default='bench_apps.json', help='JSON file for the results')
+    parser.add_argument('--compare', help='previous results JSON; metrics worse than --tolerance are flagged')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative drop of events/s and rise of RSS (default 0.1 = 10%%)')
+    parser.add_argument('--latency-tolerance', type=float, default=0.5, help='allowed relative rise of the p99 latency (default 0.5)')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.stdout.write(json.dumps(run_app(args.child, args.rows)) + '\n')
+        sys.exit(0)
+
+    environment = dict(setting.split('=', 1) for setting in args.env)
+    run = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': git_commit(), 'python': platform.python_version(),
+           'machine': platform.machine(), 'rows': args.rows, 'env': environment, 'results': []}
+    print(f"{'app':>17} {'events':>7} {'events/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'RSS MB':>7} {'CPU s':>6}")
+    for name in args.apps.split(','):
+        result = run_app_process(name, args.rows, environment)
+        run['results'].append(result)
+        if 'events_per_second' in result:
+            print(f"{name:>17} {result['events']:7d} {result['events_per_second']:9.0f} {result['p50_ms']:8.2f} "
+                  f"{result['p99_ms']:8.2f} {result['peak_rss_mb']:7.0f} {result['cpu_seconds']:6.2f}")
+        else:
+            print(f"{name:>17} {'skipped: ' + result['skipped'] if 'skipped' in result else 'failed: ' + result['failed']}")
+
+    with open(args.save, 'w') as file:
+        json.dump(run, file, indent=2)
+    print(f"Results saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            found = regressions(json.load(file), run, args.tolerance, args.latency_tolerance)
+        for app, metric, old, new in found:
+            print(f"REGRESSION {app}: {metric} {old:.2f} -> {new:.2f}")
+        if found:
+            sys.exit(1)
+        print(f"No regression against {args.compare}")
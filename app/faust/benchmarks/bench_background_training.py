@@ -0,0 +1,60 @@
+# Benchmark: refitting inside the agent vs. in the background (TrainingMode) while events keep being scored.
+# Replays the rows one at a time through an Isolation Forest that is refitted every `UpdateInterval` rows and
+# reports throughput and per-event latency; with synchronous refits every update shows up as a latency spike.
+#
+# Usage: python benchmarks/bench_background_training.py [dataset.csv] [rows] [update_interval]
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import IsolationForest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+from multiflow import BackgroundTrainer, RingBuffer
+
+DEFAULT_DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'datasets', 'Labeled_Expanded.csv')
+WINDOW = 100
+
+
+# Function to fit the same model as the Isolation Forest App
+def train_isolation_forest(data):
+    return IsolationForest(n_estimators=100, contamination=0.1, random_state=42).fit(data)
+
+
+# Function to score all rows one at a time, requesting a refit every `update_interval` rows
+def replay(rows, mode, update_interval):
+    trainer = BackgroundTrainer(train_isolation_forest, mode=mode)
+    window = RingBuffer(WINDOW)
+    trainer.fit_now(rows[:WINDOW], 0)
+    latencies = np.empty(len(rows))
+    start = time.perf_counter()
+    for i, row in enumerate(rows):
+        event_start = time.perf_counter()
+        trainer.model.predict(row.reshape(1, -1))
+        window.append(row)
+        if (i + 1) % update_interval == 0:
+            trainer.submit(window.last(), i + 1)
+        latencies[i] = time.perf_counter() - event_start
+    elapsed = time.perf_counter() - start
+    trainer.wait()
+    metrics = trainer.metrics(len(rows))
+    trainer.close()
+    return len(rows) / elapsed, latencies * 1000, metrics
+
+
+if __name__ == '__main__':
+    dataset = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DATASET
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    update_interval = int(sys.argv[3]) if len(sys.argv) > 3 else 25
+    data = pd.read_csv(dataset, header=None, encoding='utf-8-sig').select_dtypes(include='number').dropna().to_numpy(dtype=np.float64)
+    while len(data) < count:
+        data = np.concatenate([data, data])
+    rows = data[:count]
+    print(f"Dataset: {os.path.basename(dataset)} ({count} rows, {rows.shape[1]} columns), refit every {update_interval} rows")
+
+    print(f"{'mode':>8} {'rows/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'fits':>5} {'coalesced':>10} {'fit s':>7}")
+    for mode in ['sync', 'thread', 'process']:
+        rate, latencies, metrics = replay(rows, mode, update_interval)
+        print(f"{mode:>8} {rate:9.0f} {np.percentile(latencies, 50):8.2f} {np.percentile(latencies, 99):8.2f} {latencies.max():8.2f} "
+              f"{metrics['fits']:5d} {metrics['coalesced']:10d} {metrics['mean_fit_seconds']:7.3f}")
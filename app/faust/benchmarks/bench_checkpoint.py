@@ -0,0 +1,125 @@
+# Benchmark: cost of checkpointing the keyed state of the bundled Apps (see multiflow/checkpoint.py), without Kafka.
+# Each App runs in its own process and is fed --rows dataset rows per key through Faust's in-memory test context;
+# then one checkpoint of all keys is taken (the time it holds the event loop and the bytes written are reported)
+# and every key is restored into a new state, as a restarted instance would do on its first event.
+# Every App is measured twice: with keyless messages (the single state of key None, the default) and with --keys keys.
+# The event loop time of one checkpoint divided by CheckpointEverySeconds is the share of the loop it costs.
+#
+# Usage: python benchmarks/bench_checkpoint.py [--apps iqr,mmd] [--keys 4] [--rows 1000]
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_apps import APPS, CODE, DATASETS
+
+KEYED_APPS = ('iqr', 'ocsvm', 'isolation_forest', 'mmd', 'data_formater', 'chronos')
+
+
+# Function to run one App in this process and return its checkpoint measurements (called in the child process);
+# `keys` 0 sends the events without a key
+def run_app(name, keys, rows):
+    module_name, agent_name, dataset, _ = APPS[name]
+    sys.path.insert(0, CODE)
+    import builtins
+    import faust
+    from fake_influxdb import FakeInfluxDB
+
+    influx = FakeInfluxDB().start()
+    os.environ['INFLUXDB_URL'] = influx.url
+
+    # Only the agent test context is used (see bench_apps.py for the broker URL)
+    app_class = faust.App
+    faust.App = lambda *args, **kwargs: app_class(*args, **{**kwargs, 'broker': 'kafka://localhost:9092'})
+    quiet_print = builtins.print
+    builtins.print = lambda *args, **kwargs: None  # The Apps log every event
+    try:
+        module = __import__(module_name)
+    except ImportError as e:
+        builtins.print = quiet_print
+        return {'app': name, 'skipped': f"{e}"}
+    with open(os.path.join(DATASETS, dataset), encoding='utf-8-sig') as file:
+        lines = [line.strip() for line in file if line.strip()][:rows]
+
+    async def replay():
+        async with getattr(module, agent_name).test_context() as agent:
+            for line in lines:
+                if not keys:
+                    await agent.put({'csv_data': line})
+                for key in range(keys):
+                    await agent.put({'csv_data': line, 'key': f'sensor-{key}'})
+
+    asyncio.run(replay())
+    keyed_state = module.keyed_state
+    keyed_state.checkpoint()
+    begin = time.perf_counter()
+    keyed_state.checkpoints.close()  # Waits for the background writes
+    write_seconds = time.perf_counter() - begin
+
+    restored = module.KeyedState(keyed_state.factory, checkpoints=keyed_state.checkpoints)
+    for key in list(keyed_state.states):
+        restored.get(key)
+    result = {
+        'app': name,
+        'keys': len(keyed_state),
+        'checkpoint_ms': keyed_state.last_snapshot_seconds * 1000,
+        'write_ms': write_seconds * 1000,
+        'checkpoint_kb': keyed_state.last_snapshot_bytes / 1024,
+        'restore_ms': restored.restore_seconds * 1000,
+        'restored_keys': restored.restored_keys,
+    }
+    for states in (keyed_state, restored):
+        for state in states:
+            if hasattr(state, 'close'):
+                state.close()
+    if hasattr(module, 'influx_sink'):
+        module.influx_sink.close()
+    influx.stop()
+    builtins.print = quiet_print
+    return result
+
+
+# Function to run one App in a fresh process with checkpoints enabled and parse its result
+def run_app_process(name, keys, rows, every_seconds):
+    folder = tempfile.mkdtemp(prefix=f'bench_checkpoint_{name}_')
+    env = {**os.environ, **APPS[name][3], 'OutputFileName': 'output', 'ModelStorePath': os.path.join(folder, 'models'),
+           'CheckpointPath': os.path.join(folder, 'checkpoints'), 'CheckpointEverySeconds': str(every_seconds)}
+    try:
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name, '--keys', str(keys), '--rows', str(rows)],
+                                cwd=folder, env=env, capture_output=True, text=True)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    if result.returncode != 0 or not result.stdout.strip():
+        return {'app': name, 'failed': (result.stderr.strip().splitlines() or ['no output'])[-1]}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Checkpoint and restore cost of the keyed state of the bundled Apps.')
+    parser.add_argument('--apps', default=','.join(KEYED_APPS), help=f"comma-separated Apps (default: {','.join(KEYED_APPS)})")
+    parser.add_argument('--keys', type=int, default=4, help='stream keys (the dataset is replayed once per key)')
+    parser.add_argument('--rows', type=int, default=1000, help='dataset rows per key')
+    parser.add_argument('--every', type=float, default=30.0, help='CheckpointEverySeconds used for the loop share')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.stdout.write(json.dumps(run_app(args.child, args.keys, args.rows)) + '\n')
+        sys.exit(0)
+
+    print(f"{'app':>17} {'keys':>5} {'snapshot ms':>11} {'write ms':>9} {'KB':>8} {'restore ms':>10} {'loop share':>10}")
+    runs = [(name, keys) for name in args.apps.split(',') for keys in (0, args.keys)]
+    for name, keys in runs:
+        result = run_app_process(name, keys, args.rows, args.every)
+        if 'checkpoint_ms' in result and result['restored_keys'] < result['keys']:
+            result = {'app': name, 'failed': f"{result['keys'] - result['restored_keys']} of {result['keys']} keys not restored"}
+        if 'checkpoint_ms' in result:
+            print(f"{name:>17} {keys or 'none':>5} {result['checkpoint_ms']:11.2f} {result['write_ms']:9.2f} {result['checkpoint_kb']:8.0f} "
+                  f"{result['restore_ms']:10.2f} {result['checkpoint_ms'] / 1000 / args.every:10.4%}")
+        else:
+            print(f"{name:>17} {keys or 'none':>5} {'skipped: ' + result['skipped'] if 'skipped' in result else 'failed: ' + result['failed']}")
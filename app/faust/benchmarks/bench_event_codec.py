@@ -0,0 +1,48 @@
+# Benchmark: decode + parse cost per row of the legacy JSON csv_data events vs. the binary 'rows' and 'arrow' messages.
+# Each format is measured with one row per message and with several rows per message, as the Apps consume them:
+# the codec decodes the message bytes, then `event_rows` turns a micro-batch of events into one 2-D array.
+#
+# Usage: python benchmarks/bench_event_codec.py [dataset.csv] [rows_per_message]
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+from multiflow import encode_rows, decode_event, event_rows
+
+DEFAULT_DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'datasets', 'Muvu_Streaming_Nov.csv')
+BATCH_EVENTS = 64  # Events per micro-batch, as with BatchMaxEvents
+
+
+# Function to encode the rows as messages of `per_message` rows each
+def encode_all(rows, format, per_message):
+    return [encode_rows(rows[start:start + per_message], format) for start in range(0, len(rows), per_message)]
+
+
+# Function to decode all messages and parse them micro-batch by micro-batch, returning microseconds per row
+def decode_all(messages, total_rows):
+    start = time.perf_counter()
+    parsed = 0
+    for first in range(0, len(messages), BATCH_EVENTS):
+        rows, _ = event_rows([decode_event(message) for message in messages[first:first + BATCH_EVENTS]])
+        parsed += len(rows)
+    elapsed = time.perf_counter() - start
+    assert parsed == total_rows
+    return elapsed * 1e6 / total_rows
+
+
+if __name__ == '__main__':
+    dataset = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DATASET
+    per_message = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    rows = pd.read_csv(dataset, header=None, encoding='utf-8-sig').select_dtypes(include='number').dropna().to_numpy(dtype=np.float64)
+    print(f"Dataset: {os.path.basename(dataset)} ({len(rows)} rows x {rows.shape[1]} columns)")
+
+    print(f"{'format':>8} {'rows/msg':>9} {'bytes/row':>10} {'us/row':>8} {'speed-up':>9}")
+    base = None
+    for format, count in [('csv', 1), ('rows', 1), ('arrow', 1), ('rows', per_message), ('arrow', per_message)]:
+        messages = encode_all(rows, format, count)
+        us = decode_all(messages, len(rows))
+        base = base or us
+        print(f"{format:>8} {count:9d} {sum(map(len, messages)) / len(rows):10.1f} {us:8.2f} {base / us:8.1f}x")
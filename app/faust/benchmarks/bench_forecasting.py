@@ -0,0 +1,111 @@
+# Benchmark: forecasting backends of the Chronos App (ForecastBackend), without Kafka.
+# The dataset rows are scored as the App does it: a predictor is fitted on the training window (again every
+# --retrain rows) and every --horizon new rows are scored with detect_anomalies_streaming_with_dataframe.
+# For each backend it reports the fit and scoring times, the rows scored per second of compute, the share of horizon
+# cells with a forecast and the anomaly rate; when AutoGluon is installed, the labels of every NumPy backend are
+# compared with those of the autogluon backend (agreement on the cells both forecast, precision and recall).
+#
+# Usage: python benchmarks/bench_forecasting.py [--dataset Labeled_Expanded.csv] [--rows 3000] [--backends autogluon,ets,ar]
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from bench_apps import CODE, DATASETS
+
+BACKENDS = ('autogluon', 'seasonal_naive', 'ets', 'ar')
+
+
+# Function to import the Chronos App (its settings come from the environment) without starting it
+def load_app():
+    os.environ.setdefault('ForecastBackend', 'ets')  # AutoGluon is imported below, only when it is benchmarked
+    sys.path.insert(0, CODE)
+    import faust
+    app_class = faust.App
+    faust.App = lambda *args, **kwargs: app_class(*args, **{**kwargs, 'broker': 'kafka://localhost:9092'})
+    import AnomalyDetection_Chronos
+    return AnomalyDetection_Chronos
+
+
+# Function to score the rows with one backend as the App does; returns (labels frame, fits, fit s, horizons, score s)
+def run_backend(chronos, backend, rows, train_rows, window_rows, horizon, retrain_rows):
+    from multiflow import LongFormatWindow, ModelStore
+    chronos.ForecastBackend = backend
+    if backend == 'autogluon':
+        from autogluon.timeseries import TimeSeriesPredictor
+        chronos.TimeSeriesPredictor = TimeSeriesPredictor
+    folder = tempfile.mkdtemp(prefix=f'bench_forecasting_{backend}_')
+    model_store = ModelStore(2, root=folder)
+    window = LongFormatWindow(window_rows + horizon, datetime(2024, 1, 1))
+    window.append(rows[:train_rows])
+    labels, fits, fit_seconds, horizons, score_seconds = [], 0, 0.0, 0, 0.0
+    predictor, last_fit = None, None
+    for scored in range(train_rows, len(rows) - horizon + 1, horizon):
+        window.append(rows[scored:scored + horizon])
+        context = min(window_rows, scored)
+        data = window.to_frame(context + horizon)
+        if last_fit is None or scored + horizon - last_fit >= retrain_rows:
+            began = time.perf_counter()
+            predictor = chronos.fit_predictor(data.iloc[:context * rows.shape[1]], scored + horizon, model_store, horizon)
+            fit_seconds += time.perf_counter() - began
+            fits, last_fit = fits + 1, scored + horizon
+        began = time.perf_counter()
+        labels.append(chronos.detect_anomalies_streaming_with_dataframe(data, predictor, prediction_length=horizon))
+        score_seconds += time.perf_counter() - began
+        horizons += 1
+    model_store.clear()
+    shutil.rmtree(folder, ignore_errors=True)
+    return pd.concat(labels, ignore_index=True).set_index(['item_id', 'timestamp']), fits, fit_seconds, horizons, score_seconds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Speed and anomaly agreement of the Chronos forecasting backends.')
+    parser.add_argument('--dataset', default='Labeled_Expanded.csv', help='CSV file in datasets/ (numeric columns are used)')
+    parser.add_argument('--rows', type=int, default=3000)
+    parser.add_argument('--backends', default=','.join(BACKENDS), help=f"comma-separated backends ({','.join(BACKENDS)})")
+    parser.add_argument('--train', type=int, default=250, help='InitialTrainingBatch')
+    parser.add_argument('--window', type=int, default=500, help='MaxWindowSize')
+    parser.add_argument('--horizon', type=int, default=50, help='PredictionLength')
+    parser.add_argument('--retrain', type=int, default=250, help='RetrainEveryRows')
+    args = parser.parse_args()
+
+    data = pd.read_csv(os.path.join(DATASETS, args.dataset), header=None, encoding='utf-8-sig')
+    data = data.apply(pd.to_numeric, errors='coerce').dropna(axis=1, how='all').dropna()
+    rows = data.to_numpy(dtype=np.float64)[:args.rows]
+    chronos = load_app()
+    print(f"{args.dataset}: {len(rows)} rows x {rows.shape[1]} columns, window {args.window}, horizon {args.horizon}, "
+          f"refit every {args.retrain} rows")
+
+    import builtins
+    quiet_print = builtins.print
+    results = {}
+    for backend in args.backends.split(','):
+        builtins.print = lambda *args, **kwargs: None  # The App logs every fit and horizon
+        try:
+            results[backend] = run_backend(chronos, backend, rows, args.train, args.window, args.horizon, args.retrain)
+        except ImportError as e:
+            quiet_print(f"{backend}: skipped ({e})")
+        finally:
+            builtins.print = quiet_print
+
+    reference = results.get('autogluon', (None,))[0]
+    print(f"{'backend':>15} {'fits':>5} {'fit ms':>9} {'score ms':>9} {'rows/s':>9} {'forecast':>9} {'anomalies':>9} "
+          f"{'agreement':>9} {'precision':>9} {'recall':>7}")
+    for backend, (labels, fits, fit_seconds, horizons, score_seconds) in results.items():
+        forecast = labels['predicted_mean'].notna()
+        line = (f"{backend:>15} {fits:5d} {fit_seconds / max(fits, 1) * 1000:9.1f} {score_seconds / horizons * 1000:9.2f} "
+                f"{horizons * args.horizon / (fit_seconds + score_seconds):9.0f} {forecast.mean():9.1%} {labels['is_anomaly'].mean():9.2%}")
+        if reference is not None and backend != 'autogluon':
+            both = forecast & reference['predicted_mean'].reindex(labels.index).notna()
+            ours, theirs = labels['is_anomaly'][both], reference['is_anomaly'].reindex(labels.index)[both].astype(bool)
+            agreement = (ours == theirs).mean() if both.any() else float('nan')
+            precision = (ours & theirs).sum() / max(ours.sum(), 1)
+            recall = (ours & theirs).sum() / max(theirs.sum(), 1)
+            line += f" {agreement:9.1%} {precision:9.1%} {recall:7.1%}"
+        print(line)
@@ -0,0 +1,58 @@
+# Benchmark: one blocking write per point (what the Apps used to do) vs. the batching InfluxSink.
+# Both run against the local FakeInfluxDB stand-in with a simulated round-trip latency, so no
+# InfluxDB is needed. It also checks that every point arrives, including when the first writes fail.
+#
+# Usage: python benchmarks/bench_influx_sink.py [rows] [latency_ms]
+import os
+import sys
+import time
+import numpy as np
+from influxdb_client import InfluxDBClient, Point
+from influxdb_client.client.write_api import SYNCHRONOUS
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+from multiflow import InfluxSink, column_names_for
+from fake_influxdb import FakeInfluxDB
+
+
+# Write path used by the Apps before the InfluxSink: one Point and one HTTP request per row
+def write_per_point(url, rows, column_names, labels):
+    client = InfluxDBClient(url=url, token='admin', org='multiflow')
+    write_api = client.write_api(write_options=SYNCHRONOUS)
+    start = time.perf_counter()
+    for row_values, label in zip(rows, labels):
+        point = Point('per_point').tag('outliers', label)
+        for column, value in zip(column_names, row_values):
+            point = point.field(column, float(value))
+        write_api.write(bucket='faust_app', record=point)
+    elapsed = time.perf_counter() - start
+    client.close()
+    return elapsed, elapsed
+
+
+# Write path used by the Apps now: rows are queued in chunks (like a micro-batch) and sent by a background thread
+def write_with_sink(url, rows, column_names, labels, chunk_size=10):
+    sink = InfluxSink(url=url, token='admin', org='multiflow', bucket='faust_app', flush_interval_ms=50)
+    start = time.perf_counter()
+    for i in range(0, len(rows), chunk_size):
+        sink.write_rows('sink', rows[i:i + chunk_size], column_names, tags={'outliers': labels[i:i + chunk_size]})
+    enqueue_time = time.perf_counter() - start
+    sink.close()
+    return enqueue_time, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+    rows = np.random.default_rng(0).normal(size=(n, 5))
+    column_names = column_names_for(rows.shape[1])
+    labels = np.where(np.abs(rows).max(axis=1) > 2.5, 'yes', 'no')
+
+    with FakeInfluxDB(latency_ms=latency_ms) as fake:
+        per_point_blocked, per_point_total = write_per_point(fake.url, rows, column_names, labels)
+        fake.fail_first = 2  # Only the sink retries, so the failures are injected for its run
+        sink_blocked, sink_total = write_with_sink(fake.url, rows, column_names, labels)
+        print(f"{n} rows, {latency_ms} ms simulated write latency, first 2 sink writes fail with HTTP 503")
+        print(f"{'writer':>10} {'agent blocked (s)':>18} {'total (s)':>10} {'points received':>16}")
+        print(f"{'per-point':>10} {per_point_blocked:>18.3f} {per_point_total:>10.3f} {len(fake.lines_for('per_point')):>16}")
+        print(f"{'InfluxSink':>10} {sink_blocked:>18.3f} {sink_total:>10.3f} {len(fake.lines_for('sink')):>16}")
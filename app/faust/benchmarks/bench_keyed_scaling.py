@@ -0,0 +1,140 @@
+# Benchmark: throughput of 1 to 4 workers of an App sharing the partitions of a keyed topic, without Kafka.
+# The dataset is replayed once per stream key (sensor-0, sensor-1, ...), the keys interleaved; every key is hashed to
+# one of --partitions partitions and each worker gets every W-th partition, as a Kafka consumer group would assign
+# them. Every worker is a separate process feeding its partitions (with their Kafka keys) through Faust's in-memory
+# test context; the workers start together once all are imported, and the throughput is the total events over the
+# time of the slowest worker. The state of a key lives in the worker of its partition (multiflow.KeyedState), so the
+# workers share nothing and scale with the number of cores (the machine's core count is printed with the results).
+#
+# Usage: python benchmarks/bench_keyed_scaling.py [--app iqr] [--keys 16] [--rows 500] [--workers 1,2,3,4]
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+from bench_apps import APPS, CODE, DATASETS
+
+
+# Function to pick the partition of a key (a stable hash, like the Kafka default partitioner)
+def partition_of(key, partitions):
+    return zlib.crc32(key.encode('utf-8')) % partitions
+
+
+# Function to list the (key, partition, line) events of the worker owning `owned` partitions, keys interleaved
+def worker_events(dataset, keys, rows, partitions, owned):
+    with open(os.path.join(DATASETS, dataset), encoding='utf-8-sig') as file:
+        lines = [line.strip() for line in file if line.strip()][:rows]
+    names = [f'sensor-{i}' for i in range(keys)]
+    return [(key, partition_of(key, partitions), line) for line in lines for key in names
+            if partition_of(key, partitions) in owned]
+
+
+# Function to run one worker in this process (called in the child process): imports the App, waits for the go
+# line on stdin, then replays its events and returns its measurements
+def run_worker(name, keys, rows, partitions, owned):
+    module_name, agent_name, dataset, _ = APPS[name]
+    sys.path.insert(0, CODE)
+    import builtins
+    import faust
+    from fake_influxdb import FakeInfluxDB
+
+    influx = FakeInfluxDB().start()
+    os.environ['INFLUXDB_URL'] = influx.url
+
+    # Only the agent test context is used (see bench_apps.py for the broker URL)
+    app_class = faust.App
+    faust.App = lambda *args, **kwargs: app_class(*args, **{**kwargs, 'broker': 'kafka://localhost:9092'})
+    quiet_print = builtins.print
+    builtins.print = lambda *args, **kwargs: None  # The Apps log every event
+    module = __import__(module_name)
+    events = worker_events(dataset, keys, rows, partitions, owned)
+
+    async def replay():
+        async with getattr(module, agent_name).test_context() as agent:
+            for key, partition, line in events:
+                await agent.put({'csv_data': line}, key=key.encode('utf-8'), partition=partition)
+
+    quiet_print('ready', flush=True)
+    sys.stdin.readline()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    asyncio.run(replay())
+    seconds = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    for sink in ('influx_sink', 'result_sink', 'keyed_state'):
+        if hasattr(module, sink):
+            getattr(module, sink).close()
+    influx.stop()
+    builtins.print = quiet_print
+    return {'events': len(events), 'keys': len({key for key, _, _ in events}), 'seconds': seconds,
+            'cpu_seconds': (after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime)}
+
+
+# Function to run `workers` worker processes together and return their measurements
+def run_workers(name, keys, rows, partitions, workers, environment):
+    folder = tempfile.mkdtemp(prefix=f'bench_keyed_{name}_')
+    env = {**os.environ, **APPS[name][3], **environment, 'OutputFileName': 'output', 'ModelStorePath': os.path.join(folder, 'models')}
+    processes = []
+    try:
+        for worker in range(workers):
+            owned = ','.join(str(partition) for partition in range(partitions) if partition % workers == worker)
+            processes.append(subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), '--child', name, '--keys', str(keys), '--rows', str(rows),
+                 '--partitions', str(partitions), '--owned', owned],
+                cwd=folder, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True))
+        for process in processes:  # Imports done
+            if process.stdout.readline().strip() != 'ready':
+                raise RuntimeError(f"A worker of {name} failed to start")
+        for process in processes:
+            process.stdin.write('go\n')
+            process.stdin.flush()
+        results = []
+        for process in processes:
+            output, _ = process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError(f"A worker of {name} failed")
+            results.append(json.loads(output.strip().splitlines()[-1]))
+        return results
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput of 1 to N workers sharing the partitions of a keyed topic.')
+    parser.add_argument('--app', default='iqr', help=f"App of bench_apps.py ({','.join(APPS)})")
+    parser.add_argument('--keys', type=int, default=16, help='stream keys (the dataset is replayed once per key)')
+    parser.add_argument('--rows', type=int, default=500, help='dataset rows per key')
+    parser.add_argument('--partitions', type=int, default=4)
+    parser.add_argument('--workers', default='1,2,3,4', help='comma-separated worker counts')
+    parser.add_argument('--env', action='append', default=[], help='extra App setting NAME=VALUE, repeatable')
+    parser.add_argument('--owned', help=argparse.SUPPRESS)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        owned = {int(partition) for partition in args.owned.split(',') if partition}
+        sys.stdout.write(json.dumps(run_worker(args.child, args.keys, args.rows, args.partitions, owned)) + '\n')
+        sys.exit(0)
+
+    environment = dict(setting.split('=', 1) for setting in args.env)
+    print(f"{args.app}: {args.keys} keys x {args.rows} rows on {args.partitions} partitions, {os.cpu_count()} cores")
+    print(f"{'workers':>7} {'events':>7} {'slowest s':>9} {'events/s':>9} {'speed-up':>8} {'CPU s/worker':>12}")
+    single = None
+    for workers in (int(count) for count in args.workers.split(',')):
+        results = run_workers(args.app, args.keys, args.rows, args.partitions, workers, environment)
+        events = sum(result['events'] for result in results)
+        throughput = events / max(result['seconds'] for result in results)
+        single = single or throughput / workers
+        cpu = sum(result['cpu_seconds'] for result in results) / workers
+        print(f"{workers:7d} {events:7d} {max(result['seconds'] for result in results):9.2f} {throughput:9.0f} "
+              f"{throughput / single:7.2f}x {cpu:12.2f}")
@@ -0,0 +1,62 @@
+# Benchmark: starting Faust instances with a new shell and interpreter each (what server.py used to do) vs. forking
+# them from the warm zygote of app/faust/server/zygote.py. Every instance runs `faust -A <App> agents`, which imports
+# the App (and all of its libraries) and exits, so the time measured is the start-up cost without Kafka
+# (both include the second or so the Faust worker takes to shut down).
+#
+# Usage: python benchmarks/bench_launcher.py [--app AnomalyDetection_Chronos] [--instances 10]
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+CODE = os.path.join(BENCHMARKS, '..', 'code')
+sys.path.insert(0, os.path.join(BENCHMARKS, '..', 'server'))
+from zygote import Zygote, ZygotePreload
+
+
+# Function to start the instances one after the other with a shell each; returns the start-up time of each
+def cold_starts(app, instances, code):
+    times = []
+    for i in range(instances):
+        begin = time.perf_counter()
+        subprocess.run(f'Name=bench{i} faust -A {app} agents', shell=True, cwd=code, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - begin)
+    return times
+
+
+# Function to fork the instances from the zygote; returns the start-up time of each
+def warm_starts(zygote, app, instances, code):
+    times = []
+    for i in range(instances):
+        begin = time.perf_counter()
+        pid, _ = zygote.spawn(['faust', '-A', app, 'agents'], {'Name': f'bench{i}'}, os.path.abspath(code))
+        if zygote.wait(pid, timeout=600) != 0:
+            raise RuntimeError(f"Instance {i} of {app} failed")
+        times.append(time.perf_counter() - begin)
+    return times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Instance start-up time: cold shell vs. warm zygote.')
+    parser.add_argument('--app', default='OutlierDetection_DynamicIQRMethod', help='App module in app/faust/code')
+    parser.add_argument('--instances', type=int, default=10)
+    parser.add_argument('--code', default=CODE, help='folder of the App modules')
+    parser.add_argument('--preload', default=ZygotePreload, help='modules preloaded by the zygote')
+    args = parser.parse_args()
+
+    begin = time.perf_counter()
+    zygote = Zygote(preload=args.preload).start()
+    preload_seconds = time.perf_counter() - begin
+    try:
+        warm = warm_starts(zygote, args.app, args.instances, args.code)
+    finally:
+        zygote.stop()
+    cold = cold_starts(args.app, args.instances, args.code)
+
+    print(f"{args.instances} instances of {args.app} (zygote preload: {preload_seconds:.1f} s, once)")
+    print(f"{'launcher':>9} {'first s':>8} {'mean s':>7} {'total s':>8}")
+    for launcher, times in (('shell', cold), ('zygote', warm)):
+        print(f"{launcher:>9} {times[0]:8.2f} {sum(times) / len(times):7.2f} {sum(times):8.2f}")
+    print(f"Speed-up: {sum(cold) / sum(warm):.1f}x")
@@ -0,0 +1,63 @@
+# Benchmark: per-event scoring vs. micro-batched, vectorized scoring.
+# Scores the same rows with IsolationForest and One-Class SVM at several batch sizes
+# (the BatchMaxEvents setting of the Apps) and reports rows/sec for each.
+#
+# Usage: python benchmarks/bench_micro_batch.py [dataset.csv] [rows]
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import OneClassSVM
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+from multiflow import parse_csv_rows
+
+DEFAULT_DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'datasets', 'Labeled_Expanded.csv')
+BATCH_SIZES = [1, 16, 64, 256]
+
+
+# Function to load the dataset rows as the comma-joined strings sent by the stream
+def load_lines(path, rows):
+    data = pd.read_csv(path, header=None, encoding='utf-8-sig').select_dtypes(include='number').dropna()
+    lines = [','.join(map(str, values)) for values in data.to_numpy().tolist()]
+    while len(lines) < rows:
+        lines = lines + lines
+    return lines[:rows]
+
+
+# Function to score all lines in batches of `batch_size` (parse + predict), returning rows/sec and the labels
+def score_in_batches(lines, batch_size, score):
+    labels = []
+    start = time.perf_counter()
+    for i in range(0, len(lines), batch_size):
+        rows, _ = parse_csv_rows(lines[i:i + batch_size])
+        labels.append(score(rows))
+    elapsed = time.perf_counter() - start
+    return len(lines) / elapsed, np.concatenate(labels)
+
+
+if __name__ == '__main__':
+    dataset = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DATASET
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    lines = load_lines(dataset, rows)
+    training_rows, _ = parse_csv_rows(lines[:100])
+    print(f"Dataset: {os.path.basename(dataset)} ({rows} rows, {training_rows.shape[1]} columns)")
+
+    isolation_forest = IsolationForest(n_estimators=100, contamination=0.1, random_state=42).fit(training_rows)
+    scaler = StandardScaler().fit(training_rows)
+    one_class_svm = OneClassSVM(gamma='auto', kernel='rbf', nu=0.05).fit(scaler.transform(training_rows))
+
+    models = {
+        'IsolationForest': lambda batch: (isolation_forest.decision_function(batch), isolation_forest.predict(batch))[1],
+        'OneClassSVM': lambda batch: one_class_svm.predict(scaler.transform(batch)),
+    }
+
+    print(f"{'model':>16} {'batch':>6} {'rows/s':>10} {'speed-up':>9} {'same labels':>12}")
+    for name, score in models.items():
+        base_rate, base_labels = score_in_batches(lines, 1, score)
+        for batch_size in BATCH_SIZES:
+            rate, labels = score_in_batches(lines, batch_size, score) if batch_size > 1 else (base_rate, base_labels)
+            print(f"{name:>16} {batch_size:>6} {rate:>10.0f} {rate / base_rate:>8.1f}x {str(np.array_equal(labels, base_labels)):>12}")
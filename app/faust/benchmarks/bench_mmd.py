@@ -0,0 +1,62 @@
+# Benchmark: frouros MMD.compare vs. StreamingMMD (exact, rff and linear estimators) for growing reference windows.
+# Reports the time to compare one batch and the MMD^2 of each estimator on the same batches (all dataset columns,
+# standardized), plus the cost of sliding the reference by one batch (a refit for frouros, incremental updates otherwise).
+#
+# Usage: python benchmarks/bench_mmd.py [dataset.csv] [batch_size]
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+from multiflow import StreamingMMD
+
+try:
+    from frouros.detectors.data_drift import MMD
+except ImportError:
+    MMD = None
+
+DEFAULT_DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'datasets', 'Muvu_Streaming_Nov.csv')
+REFERENCE_SIZES = [100, 1000, 5000]
+BATCHES = 20
+
+
+# Function to time `compare(batch)` over the batches, returning ms per batch and the mean distance
+def time_batches(compare, batches):
+    start = time.perf_counter()
+    distances = [compare(batch) for batch in batches]
+    return (time.perf_counter() - start) * 1000 / len(batches), float(np.mean(distances))
+
+
+if __name__ == '__main__':
+    dataset = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DATASET
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    data = pd.read_csv(dataset, header=None, encoding='utf-8-sig').select_dtypes(include='number').dropna().to_numpy(dtype=np.float64)
+    data = (data - data.mean(axis=0)) / np.where(data.std(axis=0) > 0, data.std(axis=0), 1.0)
+    while len(data) < max(REFERENCE_SIZES) + BATCHES * batch_size:
+        data = np.concatenate([data, data + np.random.default_rng(len(data)).normal(scale=0.01, size=data.shape)])
+    print(f"Dataset: {os.path.basename(dataset)} ({data.shape[1]} columns), batches of {batch_size} rows")
+
+    print(f"{'reference':>10} {'method':>10} {'ms/batch':>10} {'speed-up':>9} {'mean MMD^2':>12} {'slide ms':>9}")
+    for size in REFERENCE_SIZES:
+        reference = data[:size]
+        batches = [data[size + i * batch_size:size + (i + 1) * batch_size] for i in range(BATCHES)]
+        base_ms = None
+        if MMD is not None:
+            detector = MMD()
+            detector.fit(X=reference)
+            base_ms, distance = time_batches(lambda batch: detector.compare(X=batch)[0].distance, batches)
+            start = time.perf_counter()
+            detector.fit(X=np.concatenate([reference[batch_size:], batches[0]]))  # Sliding the reference means refitting
+            slide_ms = (time.perf_counter() - start) * 1000
+            print(f"{size:10d} {'frouros':>10} {base_ms:10.2f} {1.0:8.1f}x {distance:12.5f} {slide_ms:9.2f}")
+        for estimator in ['exact', 'rff', 'linear']:
+            detector = StreamingMMD(estimator).fit(reference)
+            ms, distance = time_batches(detector.distance, batches)
+            start = time.perf_counter()
+            for batch in batches:
+                detector.add_reference(batch, evict=len(batch))
+            slide_ms = (time.perf_counter() - start) * 1000 / len(batches)
+            speed_up = f"{base_ms / ms:8.1f}x" if base_ms else f"{'n/a':>9}"
+            print(f"{size:10d} {estimator:>10} {ms:10.2f} {speed_up} {distance:12.5f} {slide_ms:9.2f}")
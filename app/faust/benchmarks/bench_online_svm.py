@@ -0,0 +1,70 @@
+# Benchmark: batch One-Class SVM (refit every UpdateInterval rows) vs. the online mode (SVMMode=online).
+# Replays each dataset one event at a time as the One-Class SVM App does and reports rows/sec, the outlier
+# rate of each mode and how often both modes agree, for several training window sizes (InitialBlockSize).
+#
+# Usage: python benchmarks/bench_online_svm.py [dataset.csv ...] [--rows N]
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import OneClassSVM
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+from multiflow import OnlineOneClassSVM, RingBuffer
+
+DATASETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'datasets')
+DEFAULT_DATASETS = ['Labeled_Expanded.csv', 'Muvu_Janeiro.csv', 'Pressure_complete.csv', 'Steel_Industry.csv']
+WINDOW_SIZES = [100, 1000]
+UPDATE_INTERVAL = 25
+
+
+# Function to replay the rows with the batch model of the App: refit on the last `window` rows every UPDATE_INTERVAL rows
+def replay_batch(rows, window):
+    received_data = RingBuffer(window)
+    model = make_pipeline(StandardScaler(), OneClassSVM(gamma='auto', kernel='rbf', nu=0.05)).fit(rows[:1])
+    labels = np.empty(len(rows), dtype=np.int64)
+    start = time.perf_counter()
+    for i, row in enumerate(rows):
+        labels[i] = model.predict(row.reshape(1, -1))[0]
+        received_data.append(row)
+        if (i + 1) % UPDATE_INTERVAL == 0:
+            model = make_pipeline(StandardScaler(), OneClassSVM(gamma='auto', kernel='rbf', nu=0.05)).fit(received_data.last())
+    return len(rows) / (time.perf_counter() - start), labels
+
+
+# Function to replay the rows with the online model: score each row, then update the model with it
+def replay_online(rows):
+    model = OnlineOneClassSVM(n_components=200, nu=0.05).partial_fit(rows[:1])
+    labels = np.empty(len(rows), dtype=np.int64)
+    start = time.perf_counter()
+    for i, row in enumerate(rows):
+        row = row.reshape(1, -1)
+        labels[i] = model.predict(row)[0]
+        if i > 0:
+            model.partial_fit(row)
+    return len(rows) / (time.perf_counter() - start), labels
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    count = 2000
+    if '--rows' in args:
+        position = args.index('--rows')
+        count = int(args[position + 1])
+        del args[position:position + 2]
+    datasets = args or [os.path.join(DATASETS_DIR, name) for name in DEFAULT_DATASETS]
+
+    print(f"{'dataset':>22} {'window':>7} {'batch rows/s':>13} {'online rows/s':>14} {'speed-up':>9} "
+          f"{'batch out %':>12} {'online out %':>13} {'agreement %':>12}")
+    for dataset in datasets:
+        data = pd.read_csv(dataset, header=None, encoding='utf-8-sig').select_dtypes(include='number').dropna()
+        rows = data.to_numpy(dtype=np.float64)[:count]
+        online_rate, online_labels = replay_online(rows)
+        for window in WINDOW_SIZES:
+            batch_rate, batch_labels = replay_batch(rows, window)
+            print(f"{os.path.basename(dataset):>22} {window:7d} {batch_rate:13.0f} {online_rate:14.0f} {online_rate / batch_rate:8.1f}x "
+                  f"{100 * (batch_labels == -1).mean():12.1f} {100 * (online_labels == -1).mean():13.1f} "
+                  f"{100 * (batch_labels == online_labels).mean():12.1f}")
@@ -0,0 +1,46 @@
+# Benchmark: recomputing IQR thresholds over the whole history (what the IQR App used to do)
+# vs. the streaming quantile estimators, updating the thresholds after every row.
+# Reports the per-row cost as the stream grows and the rank error of Q1/Q3 at the end.
+#
+# Usage: python benchmarks/bench_quantiles.py [rows] [columns]
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+from multiflow import make_quantile_estimator
+
+CHECKPOINTS = 5
+
+
+# Function to measure the cost per row of "update + read Q1/Q3" over consecutive chunks of the stream
+def run(rows, update_and_read):
+    chunk = len(rows) // CHECKPOINTS
+    costs = []
+    for start in range(0, chunk * CHECKPOINTS, chunk):
+        began = time.perf_counter()
+        for i in range(start, start + chunk):
+            quartiles = update_and_read(i, rows[i])
+        costs.append((time.perf_counter() - began) / chunk * 1e6)
+    return costs, quartiles
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    num_columns = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    rows = np.random.default_rng(0).lognormal(size=(n, num_columns))
+
+    runs = {'recompute (old)': lambda i, row: np.quantile(rows[:i + 1], [0.25, 0.75], axis=0)}
+    for mode in ['full', 'window', 'decay']:
+        estimator = make_quantile_estimator(mode, num_columns)
+        runs[mode] = lambda i, row, estimator=estimator: (estimator.update(row), estimator.quantiles([0.25, 0.75]))[1]
+
+    header = ' '.join(f"{f'{(i + 1) * (n // CHECKPOINTS)} rows':>12}" for i in range(CHECKPOINTS))
+    print(f"us per row (update + read Q1/Q3), {num_columns} columns")
+    print(f"{'estimator':>16} {header} {'Q1/Q3 rank error':>17}")
+    for name, update_and_read in runs.items():
+        costs, (q1, q3) = run(rows, update_and_read)
+        reference = rows[-1000:] if name == 'window' else rows
+        error = max(np.abs((reference < q1).mean(axis=0) - 0.25).max(), np.abs((reference < q3).mean(axis=0) - 0.75).max())
+        print(f"{name:>16} {' '.join(f'{cost:>12.1f}' for cost in costs)} {error:>17.4f}")
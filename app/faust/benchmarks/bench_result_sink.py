@@ -0,0 +1,71 @@
+# Benchmark: rewriting the whole result CSV every 100 rows vs. the append-only ResultSink (csv, parquet, arrow).
+# Writes the same labeled rows in steps of 100 and reports the total write time, the time of the last write
+# (which keeps growing when the whole history is rewritten) and the size of the output on disk.
+#
+# Usage: python benchmarks/bench_result_sink.py [rows] [columns]
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+from multiflow import ResultSink, read_results
+import multiflow.results
+
+STEP = 100
+multiflow.results.print = lambda *args, **kwargs: None  # Silence the per-write log lines
+
+
+# Function to measure the size of a file or folder in bytes
+def disk_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+# Function to rewrite the whole history every STEP rows (what the Apps used to do)
+def rewrite_all(rows, labels, columns, name):
+    history = pd.DataFrame(columns=columns + ['outliers'])
+    times = []
+    for start in range(0, len(rows), STEP):
+        new = pd.DataFrame(rows[start:start + STEP], columns=columns)
+        new['outliers'] = labels[start:start + STEP]
+        begin = time.perf_counter()
+        history = pd.concat([history, new], ignore_index=True) if len(history) else new
+        history.to_csv(name + '.csv', index=False)
+        times.append(time.perf_counter() - begin)
+    return times, name + '.csv'
+
+
+# Function to write the same rows through a ResultSink
+def sink_all(rows, labels, columns, name, format):
+    sink = ResultSink(name, format=format, flush_rows=STEP)
+    times = []
+    for start in range(0, len(rows), STEP):
+        begin = time.perf_counter()
+        sink.append(rows[start:start + STEP], columns, {'outliers': labels[start:start + STEP]})
+        times.append(time.perf_counter() - begin)
+    sink.close()
+    return times, sink.path
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    num_columns = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    rng = np.random.default_rng(42)
+    rows = rng.normal(size=(count, num_columns)).round(3)
+    labels = np.where(rng.random(count) < 0.05, 'yes', 'no')
+    columns = [f'col{i + 1}' for i in range(num_columns)]
+    folder = tempfile.mkdtemp(prefix='bench_result_sink_')
+    print(f"{count} rows x {num_columns} columns, written every {STEP} rows")
+
+    print(f"{'method':>14} {'total s':>9} {'last write ms':>14} {'size KB':>9} {'rows read back':>15}")
+    runs = [('rewrite csv', lambda name: rewrite_all(rows, labels, columns, name))]
+    runs += [(f'sink {format}', lambda name, format=format: sink_all(rows, labels, columns, name, format)) for format in ['csv', 'parquet', 'arrow']]
+    for method, run in runs:
+        times, path = run(os.path.join(folder, method.replace(' ', '_')))
+        print(f"{method:>14} {sum(times):9.2f} {times[-1] * 1000:14.2f} {disk_size(path) / 1024:9.0f} {len(read_results(path)):15d}")
+    shutil.rmtree(folder)
@@ -0,0 +1,69 @@
+# Benchmark: per-event DataFrame + pd.concat ingest vs. the preallocated RingBuffer.
+# Reports events/sec for consecutive chunks of the stream, so it is easy to see the
+# concat path slowing down as the history grows while the RingBuffer stays flat.
+#
+# Usage: python benchmarks/bench_ring_buffer.py [dataset.csv] [rows]
+import os
+import sys
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+from multiflow import RingBuffer
+
+DEFAULT_DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'datasets', 'Muvu_Streaming_Nov.csv')
+CHUNK_SIZE = 2000
+
+
+# Function to load the dataset rows as the comma-joined strings sent by the stream
+def load_lines(path, rows):
+    data = pd.read_csv(path, header=None, encoding='utf-8-sig').select_dtypes(include='number').dropna()
+    lines = [','.join(map(str, values)) for values in data.to_numpy().tolist()]
+    while len(lines) < rows:
+        lines = lines + lines
+    return lines[:rows]
+
+
+# Ingest path used by the Apps before the RingBuffer
+def ingest_concat(lines):
+    received_data = pd.DataFrame()
+    rates = []
+    start = time.perf_counter()
+    for i, csv_data in enumerate(lines, 1):
+        row_values = list(map(float, csv_data.split(',')))
+        column_names = [f'col{j+1}' for j in range(len(row_values))]
+        row_df = pd.DataFrame([row_values], columns=column_names)
+        received_data = pd.concat([received_data, row_df], ignore_index=True)
+        if i % CHUNK_SIZE == 0:
+            now = time.perf_counter()
+            rates.append(CHUNK_SIZE / (now - start))
+            start = now
+    return rates
+
+
+# Ingest path used by the Apps now (full history kept, as in the IQR App)
+def ingest_ring_buffer(lines):
+    received_data = RingBuffer(CHUNK_SIZE, growable=True)
+    rates = []
+    start = time.perf_counter()
+    for i, csv_data in enumerate(lines, 1):
+        received_data.append_csv(csv_data)
+        if i % CHUNK_SIZE == 0:
+            now = time.perf_counter()
+            rates.append(CHUNK_SIZE / (now - start))
+            start = now
+    return rates
+
+
+if __name__ == '__main__':
+    dataset = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DATASET
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    lines = load_lines(dataset, rows)
+    print(f"Dataset: {os.path.basename(dataset)} ({rows} rows, {lines[0].count(',') + 1} columns)")
+
+    concat_rates = ingest_concat(lines)
+    buffer_rates = ingest_ring_buffer(lines)
+
+    print(f"{'rows seen':>10} {'concat ev/s':>14} {'RingBuffer ev/s':>16}")
+    for i, (concat_rate, buffer_rate) in enumerate(zip(concat_rates, buffer_rates), 1):
+        print(f"{i * CHUNK_SIZE:>10} {concat_rate:>14.0f} {buffer_rate:>16.0f}")
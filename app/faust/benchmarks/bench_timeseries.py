@@ -0,0 +1,75 @@
+# Benchmark: wide-to-long time-series conversion used by the Chronos Apps.
+# Compares the previous iterrows-based `process_to_timeseries` with the vectorized `wide_to_long`
+# (one window) and with the incremental `LongFormatWindow` (one new row per event), and checks
+# that they produce the same frame.
+#
+# Usage: python benchmarks/bench_timeseries.py [dataset.csv] [window_rows] [events]
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+from multiflow import LongFormatWindow, wide_to_long
+
+DEFAULT_DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'datasets', 'Steel_Industry.csv')
+start_time = datetime.now()
+
+
+# Previous conversion from AnomalyDetection_Chronos.py, kept here as the reference
+def process_to_timeseries(dataframe, start_row_index):
+    timeseries_data = []
+    for idx, row in dataframe.iterrows():
+        for col in dataframe.columns:
+            timestamp = (start_time + timedelta(minutes=start_row_index + len(timeseries_data))).strftime('%Y-%m-%d %H:%M:%S')
+            timeseries_data.append({"item_id": col, "timestamp": timestamp, "target": row[col]})
+    timeseries_df = pd.DataFrame(timeseries_data)
+    timeseries_df["timestamp"] = pd.to_datetime(timeseries_df["timestamp"])
+    timeseries_df.set_index(["item_id", "timestamp"], inplace=True)
+    return timeseries_df
+
+
+# Function to compare two long frames by value (index labels, timestamps and targets)
+def same_frame(a, b):
+    return (len(a) == len(b)
+            and list(a.index.get_level_values(0)) == list(b.index.get_level_values(0))
+            and (a.index.get_level_values(1).values.astype('datetime64[ns]') == b.index.get_level_values(1).values.astype('datetime64[ns]')).all()
+            and (a["target"].values == b["target"].values).all())
+
+
+if __name__ == '__main__':
+    dataset = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DATASET
+    window_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    events = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    data = pd.read_csv(dataset, header=None, encoding='utf-8-sig').select_dtypes(include='number').dropna()
+    data.columns = [f'col{i+1}' for i in range(data.shape[1])]
+    rows = data.to_numpy()[:window_rows + events]
+    print(f"Dataset: {os.path.basename(dataset)} ({rows.shape[1]} columns), window of {window_rows} rows, {events} events")
+
+    # One window conversion
+    window = data.iloc[:window_rows]
+    began = time.perf_counter()
+    reference = process_to_timeseries(window, 0)
+    old_time = time.perf_counter() - began
+    began = time.perf_counter()
+    converted = wide_to_long(window.to_numpy(), list(window.columns), start_time, index=True)
+    new_time = time.perf_counter() - began
+    print(f"{'one window':>22}: process_to_timeseries {old_time * 1e3:8.2f} ms | wide_to_long     {new_time * 1e3:8.2f} ms "
+          f"| {old_time / new_time:6.0f}x | same frame: {same_frame(reference, converted)}")
+
+    # Streaming: one new row per event, window of the last `window_rows` rows
+    began = time.perf_counter()
+    for i in range(window_rows, window_rows + events):
+        reference = process_to_timeseries(data.iloc[i + 1 - window_rows:i + 1], i + 1 - window_rows)
+    old_time = (time.perf_counter() - began) / events
+
+    timeseries_window = LongFormatWindow(window_rows, start_time)
+    timeseries_window.append(rows[:window_rows])
+    began = time.perf_counter()
+    for i in range(window_rows, window_rows + events):
+        timeseries_window.append(rows[i])
+        converted = timeseries_window.to_frame(window_rows)
+    new_time = (time.perf_counter() - began) / events
+    print(f"{'per event (streaming)':>22}: process_to_timeseries {old_time * 1e3:8.2f} ms | LongFormatWindow {new_time * 1e3:8.2f} ms "
+          f"| {old_time / new_time:6.0f}x | same frame: {same_frame(reference, converted) if rows.shape[1] == 1 else 'n/a (multi-column offsets differ)'}")
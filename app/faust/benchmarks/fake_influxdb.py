@@ -0,0 +1,71 @@
+# Local stand-in for the InfluxDB v2 write API, used by the benchmarks.
+# It accepts POST /api/v2/write (plain or gzip bodies), records every line it receives and
+# can simulate network latency and transient failures (HTTP 503) to exercise retries.
+import gzip
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeInfluxDB:
+    def __init__(self, latency_ms=0.0, fail_first=0, host='127.0.0.1', port=0):
+        self.latency = latency_ms / 1000.0
+        self.fail_first = fail_first
+        self.lines = []
+        self.requests = 0
+        self.failed_requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    # Lines received for one measurement
+    def lines_for(self, measurement):
+        with self._lock:
+            return [line for line in self.lines if line.split(',', 1)[0].split(' ', 1)[0] == measurement]
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                if fake.latency:
+                    time.sleep(fake.latency)
+                with fake._lock:
+                    fake.requests += 1
+                    if fake.failed_requests < fake.fail_first:
+                        fake.failed_requests += 1
+                        self.send_response(503)
+                        self.end_headers()
+                        return
+                    fake.lines.extend(line for line in body.decode('utf-8').split('\n') if line)
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
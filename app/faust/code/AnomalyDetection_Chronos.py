@@ -1,8 +1,11 @@
 import faust
 import os
+import time
 import pandas as pd
-from datetime import datetime, timedelta
-from autogluon.timeseries import TimeSeriesDataFrame, TimeSeriesPredictor
+from functools import partial
+from multiflow import RingBuffer, LongFormatWindow, Watermark, event_rows, ModelStore, RetrainScheduler, BackgroundTrainer, TrainingMode, make_training_executor, attach_training_executor, AppMetrics, KeyedState, keyed_name, trace_written
+from multiflow import NumpyForecaster, FORECAST_METHODS
+from datetime import datetime
 
 # Fetching required environment variables
 InstanceName = os.getenv('Name', 'InstanceName')
@@ -17,166 +20,246 @@ PredictionLength = int(os.getenv('PredictionLength', '50'))
 ExpansionFactorDown = float(os.getenv('ExpansionFactorDown', '0.05'))
 ExpansionFactorUp = float(os.getenv('ExpansionFactorUp', '0.05'))
 
+# Retraining policy: a new model is fitted every RetrainEveryRows rows and/or every RetrainEverySeconds seconds
+# (0 disables a rule); the ModelStoreSize most recent models are kept under ModelStorePath ('memory' for tmpfs)
+RetrainEveryRows = int(os.getenv('RetrainEveryRows', str(InitialTrainingBatch)))
+RetrainEverySeconds = float(os.getenv('RetrainEverySeconds', '0'))
+ModelStorePath = os.getenv('ModelStorePath', 'chronos_cache')
+ModelStoreSize = int(os.getenv('ModelStoreSize', '2'))
+
+# Forecasting backend: 'autogluon' (default, a SimpleFeedForward TimeSeriesPredictor) or one of the NumPy forecasters,
+# fitted for all columns at once: 'seasonal_naive' (ForecastSeason), 'ets' (exponential smoothing) or 'ar' (ForecastOrder)
+ForecastBackend = os.getenv('ForecastBackend', 'autogluon')
+if ForecastBackend == 'autogluon':
+    from autogluon.timeseries import TimeSeriesPredictor
+elif ForecastBackend not in FORECAST_METHODS:
+    raise ValueError(f"Unknown ForecastBackend '{ForecastBackend}' (expected autogluon, {', '.join(FORECAST_METHODS)})")
+
 # Setting up Faust app
 app = faust.App(InstanceName, broker='kafka_server://localhost:9092', web_port=InstancePort)
-topic = app.topic(StreamTopic)
-
-# Global variables
-received_data = pd.DataFrame()
-start_time = datetime.now()  # Snapshot of the current time
-global_row_count = 0  # Counter for total rows processed globally
-
-# Function to process and convert data into time-series format
-def process_to_timeseries(dataframe, start_row_index):
-    timeseries_data = []
-
-    # Generate timestamps by incrementing 1 minute for each row in each column
-    for idx, row in dataframe.iterrows():
-        for col in dataframe.columns:
-            timestamp = (start_time + timedelta(minutes=start_row_index + len(timeseries_data))).strftime('%Y-%m-%d %H:%M:%S')
-            timeseries_data.append({
-                "item_id": col,
-                "timestamp": timestamp,
-                "target": row[col]
-            })
-
-    # Convert the list of dictionaries into a DataFrame
-    timeseries_df = pd.DataFrame(timeseries_data)
-    timeseries_df["timestamp"] = pd.to_datetime(timeseries_df["timestamp"])
-    timeseries_df.set_index(["item_id", "timestamp"], inplace=True)
-
-    return timeseries_df
-
-# Anomaly detection function using Chronos
+topic = app.topic(StreamTopic, value_serializer='multiflow')  # Binary row messages and legacy JSON csv_data events
+
+# Function to fit a new Chronos predictor on the training window and keep it (and its folder) in the model store
+def fit_predictor(train_data, row_count, model_store, prediction_length=PredictionLength):
+    print(f"Training new model on {len(train_data)} rows...")
+    if ForecastBackend != 'autogluon':
+        return model_store.put(row_count, NumpyForecaster(ForecastBackend, prediction_length).fit(train_data))
+    model_path = model_store.new_path("chronos")
+    predictor = TimeSeriesPredictor(
+        target="target",
+        freq="min",  # Use 'min' instead of 'T'
+        prediction_length=prediction_length,
+        eval_metric="MAPE",
+        path=model_path
+    )
+    predictor.fit(train_data=train_data, hyperparameters={"SimpleFeedForward": {}}, verbosity=1)
+    return model_store.put(row_count, predictor, model_path)
+
+# Prometheus metrics on the App's web port (GET /metrics): events, stage latencies, retraining and buffers
+app_metrics = AppMetrics()
+app_metrics.attach(app)
+
+# One training thread pool (TrainingWorkers threads) for the fits of every key; the predictor and its files live in
+# this process, so the 'process' mode falls back to threads
+training_executor = make_training_executor('sync' if TrainingMode == 'sync' else 'thread')
+
+# Forecasting state of one stream key (sensor or stream ID, see KeyField; messages without a key share key None)
+class ForecastState:
+    # Saved in checkpoints (CheckpointEverySeconds) and restored when the instance restarts; the predictor is saved
+    # with the files of its folder and loaded back from them
+    checkpoint_fields = ('row_count', 'scored_rows', 'start_time', 'received_data', 'timeseries_window', 'retrain_scheduler', 'model_store',
+                         'published')
+
+    def __init__(self, key):
+        self.key = key
+        self.anomaly_output_file = f"{keyed_name(AnomalyOutputFileName, key)}.csv"
+        # The buffer holds the training window plus one prediction horizon
+        self.received_data = RingBuffer(MaxWindowSize + PredictionLength)
+        self.start_time = datetime.now()  # Snapshot of the current time
+        self.row_count = 0  # Counter for total rows processed for this key
+        self.scored_rows = InitialTrainingBatch  # Rows up to here were scored (the first InitialTrainingBatch rows only train)
+        self.published = Watermark()  # Latest timestamp written to the output file for each item (column)
+
+        # Fitted predictors (bounded, least recently used are deleted from disk) and the retraining policy.
+        # At least two are kept, so the predictor still in use is not deleted while its replacement is stored.
+        # With checkpoints, each predictor folder is copied next to the snapshots once, when it is stored.
+        checkpoints = keyed_state.checkpoints
+        self.model_store = ModelStore(max(2, ModelStoreSize), root=ModelStorePath, prefix=keyed_name(InstanceName, key),
+                                      loader=TimeSeriesPredictor.load if ForecastBackend == 'autogluon' else None,
+                                      archive=None if checkpoints is None else checkpoints.folder(keyed_name('models', key)))
+        self.retrain_scheduler = RetrainScheduler(every_rows=RetrainEveryRows, every_seconds=RetrainEverySeconds)
+
+        # Time-series (long) format of the received data: each new row is converted once, when it arrives,
+        # with timestamps incremented by 1 minute for each row in each column
+        self.timeseries_window = LongFormatWindow(self.received_data.capacity, self.start_time)
+
+        # Fits run in the training threads while the current predictor keeps scoring ('sync' fits inside the agent)
+        self.trainer = BackgroundTrainer(partial(fit_predictor, model_store=self.model_store), mode='sync' if TrainingMode == 'sync' else 'thread',
+                                         executor=training_executor, name=keyed_name("Chronos predictor", key))
+        app_metrics.track_trainer(self.trainer)
+        keyed_state.shedder.track_trainer(self.trainer)  # Retrains may wait while the App sheds load
+
+    # Score with the restored predictor right away (the retraining clock restarts with it); the rows written after
+    # the checkpoint are already in the output file, so they are not written again when their events are replayed
+    def restored(self):
+        self.published.load(self.anomaly_output_file)
+        self.trainer.model = self.model_store.latest()
+        if self.retrain_scheduler.last_fit_time is not None:
+            self.retrain_scheduler.last_fit_time = time.monotonic()
+
+    def close(self):
+        self.trainer.close()
+        self.trainer.wait()  # A running fit still adds its predictor to the model store
+        self.model_store.clear()
+
+# State of every key read by this worker (the keys of its partitions)
+keyed_state = KeyedState(ForecastState)
+keyed_state.attach(app)
+attach_training_executor(app, training_executor)  # Shut down after the key states are closed
+app_metrics.gauge('multiflow_buffer_rows', lambda: sum(len(state.received_data) for state in keyed_state), buffer='received_data')
+app_metrics.gauge('multiflow_buffer_rows', lambda: sum(len(state.timeseries_window) for state in keyed_state), buffer='timeseries_window')
+app_metrics.track_keyed_state(keyed_state)
+
+# Anomaly detection function using Chronos: scores only the prediction horizon at the end of `ts_data`
+# (the last `prediction_length` rows of every item), forecasting it from the rows before it.
+# `predictor` is any forecaster with the interface of AutoGluon's TimeSeriesPredictor (e.g. multiflow's NumpyForecaster):
+# `predict(data)` returns the steps after `data`, indexed by (item_id, timestamp), with 'mean', '0.1' and '0.9' columns
 def detect_anomalies_streaming_with_dataframe(
     ts_data,
-    initial_training_batch=InitialTrainingBatch,
-    max_window_size=MaxWindowSize,
+    predictor,
     prediction_length=PredictionLength,
     expansion_factor_down=ExpansionFactorDown,
-    expansion_factor_up=ExpansionFactorUp,
-    model_path="chronos_cache/"
+    expansion_factor_up=ExpansionFactorUp
 ):
-    if len(ts_data) < initial_training_batch + prediction_length:
-        print(f"Not enough data for anomaly detection. Required: {initial_training_batch + prediction_length} rows.")
+    horizon_cells = prediction_length * len(ts_data.index.levels[0])
+    if len(ts_data) <= horizon_cells:
+        print(f"Not enough data for anomaly detection. Required: more than {prediction_length} rows.")
         return None
 
-    print(f"Anomaly detection initialized with {len(ts_data)} rows.")
+    current_train_data = ts_data.iloc[:-horizon_cells]
+    current_predict_data = ts_data.iloc[-horizon_cells:]
 
-    # Initialize data structures
-    current_train_data = ts_data.iloc[:initial_training_batch]
-    remaining_data = ts_data.iloc[initial_training_batch:]
-    anomalies_list = []
+    # Predict the horizon for all columns with the cached predictor
+    predictions = predictor.predict(current_train_data)
 
-    while len(remaining_data) > 0:
-        print("Training new model...")
-        predictor = TimeSeriesPredictor(
-        target="target",
-        freq="min",  # Use 'min' instead of 'T'
-        prediction_length=prediction_length,
-        eval_metric="MAPE",
-        path=f"{model_path}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        )
-        predictor.fit(train_data=current_train_data, hyperparameters={"SimpleFeedForward": {}}, verbosity=1)
-
-        # Predict on the next batch for all columns
-        if len(remaining_data) < prediction_length:
-            prediction_length = len(remaining_data)  # Adjust prediction length if remaining data is less
-
-        current_predict_data = remaining_data.iloc[:prediction_length]
-        predictions = predictor.predict(current_train_data)
-
-        # Extract prediction components
-        mean_values = predictions["mean"].reindex(current_predict_data.index)
-        lower_quantile = predictions["0.1"].reindex(current_predict_data.index)
-        upper_quantile = predictions["0.9"].reindex(current_predict_data.index)
-
-        # Apply expansion factors
-        adjusted_lower = lower_quantile - (lower_quantile * expansion_factor_down)
-        adjusted_upper = upper_quantile + (upper_quantile * expansion_factor_up)
-
-        # Detect anomalies
-        anomalies = ((current_predict_data["target"] < adjusted_lower) | (current_predict_data["target"] > adjusted_upper))
-
-        # Collect data for export
-        interval_data = pd.DataFrame({
-            "item_id": current_predict_data.index.get_level_values("item_id"),
-            "timestamp": current_predict_data.index.get_level_values("timestamp"),
-            "real_value": current_predict_data["target"],
-            "predicted_mean": mean_values,
-            "lower_bound": adjusted_lower,
-            "upper_bound": adjusted_upper,
-            "is_anomaly": anomalies,
-        })
-        anomalies_list.append(interval_data)
-
-        # Update training data with sliding window
-        current_train_data = pd.concat([current_train_data, current_predict_data]).tail(max_window_size)
-        remaining_data = remaining_data.iloc[prediction_length:]
-
-    if anomalies_list:
-        anomaly_data_df = pd.concat(anomalies_list).reset_index(drop=True)
-    else:
-        print("No anomalies detected.")
-        anomaly_data_df = pd.DataFrame()
-
-    return anomaly_data_df
-
-# Faust agent to process messages and format data
+    # Extract prediction components
+    mean_values = predictions["mean"].reindex(current_predict_data.index)
+    lower_quantile = predictions["0.1"].reindex(current_predict_data.index)
+    upper_quantile = predictions["0.9"].reindex(current_predict_data.index)
+
+    # Apply expansion factors
+    adjusted_lower = lower_quantile - (lower_quantile * expansion_factor_down)
+    adjusted_upper = upper_quantile + (upper_quantile * expansion_factor_up)
+
+    # Detect anomalies
+    anomalies = ((current_predict_data["target"] < adjusted_lower) | (current_predict_data["target"] > adjusted_upper))
+
+    # Collect data for export
+    return pd.DataFrame({
+        "item_id": current_predict_data.index.get_level_values("item_id"),
+        "timestamp": current_predict_data.index.get_level_values("timestamp"),
+        "real_value": current_predict_data["target"],
+        "predicted_mean": mean_values,
+        "lower_bound": adjusted_lower,
+        "upper_bound": adjusted_upper,
+        "is_anomaly": anomalies,
+    }).reset_index(drop=True)
+
+# Faust agent to process messages and format data (event by event, each key with its own state)
 @app.agent(topic)
 async def timeseries_processing_agent(stream):
-    global received_data, start_time, global_row_count
-
-    async for event in stream:
-        csv_data = event.get('csv_data', '')
-        try:
-            row_values = list(map(float, csv_data.split(',')))
-            num_columns = len(row_values)
-            column_names = [f'col{i+1}' for i in range(num_columns)]
-            row_df = pd.DataFrame([row_values], columns=column_names)
-        except ValueError:
+    stopwatch = app_metrics.stopwatch()  # Time spent in each stage of an event
+
+    async for state, events in keyed_state.batches(stream, max_events=1):
+        stopwatch.start()
+        received_data = state.received_data
+        timeseries_window = state.timeseries_window
+        retrain_scheduler = state.retrain_scheduler
+        predictor_trainer = state.trainer
+
+        # An event carries one legacy csv_data row or a block of binary rows
+        rows, skipped = event_rows(events, received_data.num_columns)
+        for csv_data in skipped:
             print(f"Error: Skipping event due to parsing error: {csv_data}")
-            continue
-
-        # Accumulate received data
-        received_data = pd.concat([received_data, row_df], ignore_index=True)
-        global_row_count += 1
-
-        # Log the number of rows received every 50 rows
-        if global_row_count % 50 == 0:
-            print(f"Total rows received so far: {global_row_count}")
-
-        # Ensure we have enough data to process
-        min_required_rows = InitialTrainingBatch + PredictionLength
-        if len(received_data) < min_required_rows:
-            continue  # Skip processing until we have enough data
-
-        # Process accumulated data into time-series format
-        timeseries_data = process_to_timeseries(received_data.tail(MaxWindowSize), global_row_count - MaxWindowSize)
-
-        # Perform anomaly detection
-        print("Starting anomaly detection...")
-        anomalies_df = detect_anomalies_streaming_with_dataframe(
-            ts_data=timeseries_data,
-            initial_training_batch=InitialTrainingBatch,
-            max_window_size=MaxWindowSize,
-            prediction_length=PredictionLength,
-            expansion_factor_down=ExpansionFactorDown,
-            expansion_factor_up=ExpansionFactorUp,
-            model_path="chronos_cache/"
-        )
-
-        if anomalies_df is not None and not anomalies_df.empty:
-            anomalies_df.to_csv(
-                f"{AnomalyOutputFileName}.csv",
-                mode='a',
-                header=not os.path.exists(f"{AnomalyOutputFileName}.csv"),
-                index=False
+        app_metrics.inc('multiflow_rows_total', len(rows))
+        stopwatch.lap('parse')
+
+        for values in rows:
+            # Accumulate received data
+            row_values = received_data.append(values)
+
+            # Append only the new row to the time-series window
+            timeseries_window.append(row_values)
+            stopwatch.lap('buffer')
+
+            state.row_count += 1
+            row_count, scored_rows = state.row_count, state.scored_rows
+
+            # Log the number of rows received every 50 rows
+            if row_count % 50 == 0:
+                print(f"Total rows received so far: {row_count}")
+
+            # Ensure a complete prediction horizon arrived since the last scored one
+            if row_count - scored_rows < PredictionLength:
+                continue  # Skip processing until we have enough data
+
+            # Time-series format of the training window (at most MaxWindowSize rows) followed by the new horizon
+            context_rows = min(MaxWindowSize, scored_rows)
+            timeseries_data = timeseries_window.to_frame(context_rows + PredictionLength)
+            stopwatch.lap('buffer')
+
+            # Retraining when the policy says so (every RetrainEveryRows rows and/or RetrainEverySeconds seconds);
+            # in between, and while a new predictor is being fitted, the current one is reused
+            if retrain_scheduler.due(row_count):
+                train_data = timeseries_data.iloc[:context_rows * len(timeseries_window.column_names)]
+                predictor_trainer.submit(train_data, row_count, row_count)
+                retrain_scheduler.mark_fitted(row_count)
+                print(f"Chronos retraining requested after {row_count} rows: {predictor_trainer.metrics(row_count)}")
+                stopwatch.lap('retrain')
+
+            # A horizon whose rows were all written already (events replayed after a restart) is not scored again
+            horizon = timeseries_data.index[-PredictionLength * len(timeseries_window.column_names):]
+            if not state.published.mask(horizon.get_level_values("item_id"), horizon.get_level_values("timestamp")).any():
+                print(f"Rows {scored_rows + 1}-{scored_rows + PredictionLength} were already published, skipping.")
+                state.scored_rows += PredictionLength
+                continue
+
+            # Waiting (without blocking the event loop) only when there is no predictor at all yet
+            if predictor_trainer.model is None:
+                await predictor_trainer.ready()
+                if predictor_trainer.model is None:
+                    print("No Chronos predictor available, skipping anomaly detection.")
+                    state.scored_rows += PredictionLength
+                    continue
+
+            # Perform anomaly detection on the new horizon only
+            print(f"Starting anomaly detection on rows {scored_rows + 1}-{scored_rows + PredictionLength}...")
+            anomalies_df = detect_anomalies_streaming_with_dataframe(
+                ts_data=timeseries_data,
+                predictor=predictor_trainer.model,
+                prediction_length=PredictionLength,
+                expansion_factor_down=ExpansionFactorDown,
+                expansion_factor_up=ExpansionFactorUp
             )
-            print(f"Anomaly predictions saved to {AnomalyOutputFileName}.csv")
+            state.scored_rows += PredictionLength
+            stopwatch.lap('score')
 
-        # Retain only the most recent data within MaxWindowSize
-        received_data = received_data.tail(MaxWindowSize)
+            # Only the rows newer than what was already written for their item are appended
+            if anomalies_df is not None and not anomalies_df.empty:
+                new_rows = state.published.newer(anomalies_df)
+                app_metrics.inc('multiflow_duplicate_rows_total', len(anomalies_df) - len(new_rows))
+                if not new_rows.empty:
+                    new_rows.to_csv(
+                        state.anomaly_output_file,
+                        mode='a',
+                        header=not os.path.exists(state.anomaly_output_file),
+                        index=False
+                    )
+                    state.published.advance(new_rows)
+                    trace_written('csv')
+                    app_metrics.inc('multiflow_output_rows_total', len(new_rows))
+                    print(f"{len(new_rows)} anomaly predictions saved to {state.anomaly_output_file}")
+                stopwatch.lap('sink')
 
 # Entry point for the application
 if __name__ == '__main__':
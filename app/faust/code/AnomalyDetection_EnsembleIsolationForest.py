@@ -1,9 +1,8 @@
 import faust
 import os
-import pandas as pd
+import numpy as np
+from multiflow import RingBuffer, InfluxSink, column_names_for, event_rows, interval_chunks, ResultSink, BackgroundTrainer, TrainingMode, make_training_executor, attach_training_executor, AppMetrics, KeyedState, keyed_name
 from sklearn.ensemble import IsolationForest
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
 
 # Fetching environment variables and configurations
 InstanceName = os.getenv('Name', 'InstanceName')
@@ -14,11 +13,11 @@ influxdb_token = os.getenv('INFLUXDB_TOKEN', 'admin')
 influxdb_org = os.getenv('INFLUXDB_ORG', 'multiflow')
 influxdb_bucket = os.getenv('INFLUXDB_BUCKET', 'faust_app')
 
-# Setting up Faust and InfluxDB clients
+# Setting up Faust and the InfluxDB sink
 app = faust.App(InstanceName, broker='kafka_server://localhost:9092', web_port=int(InstancePort))
-topic = app.topic(StreamTopic)
-influx_client = InfluxDBClient(url=influxdb_url, token=influxdb_token, org=influxdb_org)
-write_api = influx_client.write_api(write_options=SYNCHRONOUS)
+topic = app.topic(StreamTopic, value_serializer='multiflow')  # Binary row messages and legacy JSON csv_data events
+influx_sink = InfluxSink(url=influxdb_url, token=influxdb_token, org=influxdb_org, bucket=influxdb_bucket)
+influx_sink.attach(app)
 
 # Fetching values for Custom Fields
 OutputFileName = os.getenv('OutputFileName', 'AnomalyDetection-Test')
@@ -26,10 +25,6 @@ CollectionName = os.getenv('CollectionName', 'AD-Ensemble-Method')
 initial_block_size = int(os.getenv('InitialBlockSize', '100'))
 update_interval = int(os.getenv('UpdateInterval', '25'))
 
-# Placeholder for data
-received_data = pd.DataFrame()
-isolation_forest_model = None
-
 # Function to train or update the Isolation Forest model
 def train_isolation_forest(dataframe, contamination=0.1):
     model = IsolationForest(n_estimators=100, max_samples='auto', contamination=contamination, random_state=42)
@@ -43,69 +38,98 @@ def detect_anomalies(model, data):
     predictions = model.predict(data)
     return scores, predictions
 
-# Function to send data to InfluxDB
-def send_to_influxdb(row_df, CollectionName):
-    for _, row in row_df.iterrows():
-        point = Point(CollectionName).tag("anomaly", row['anomaly'])
-        for column in row.index:
-            if column != 'anomaly':
-                point = point.field(column, float(row[column]))
-        write_api.write(bucket=influxdb_bucket, record=point)
-        print(f"Data point written to InfluxDB: {row.to_dict()}")
-
-# Faust agent to process messages and detect anomalies
+# Prometheus metrics on the App's web port (GET /metrics): events, stage latencies, retraining, buffers and sink queues
+app_metrics = AppMetrics()
+app_metrics.attach(app)
+app_metrics.track_sink('influxdb', influx_sink)
+
+# One training executor (TrainingMode, with TrainingWorkers workers) for the refits of every key
+training_executor = make_training_executor(TrainingMode)
+
+# Detection state of one stream key (sensor or stream ID, see KeyField; messages without a key share key None)
+class AnomalyState:
+    # Saved in checkpoints (CheckpointEverySeconds) and restored when the instance restarts
+    checkpoint_fields = ('row_count', 'numeric_columns', 'received_data', 'trainer', 'result_sink')
+
+    def __init__(self, key):
+        self.key = key
+        self.tags = {} if key is None else {'key': key}
+        self.row_count = 0
+        self.numeric_columns = None
+        # Placeholder for data (only the last `initial_block_size` rows are needed for retraining)
+        self.received_data = RingBuffer(initial_block_size)
+        self.result_sink = ResultSink(keyed_name(OutputFileName, key))  # Scored rows are appended every ResultFlushRows rows
+        # Periodic refits run on a snapshot of the window in the background (TrainingMode) and the new model is swapped in when ready
+        self.trainer = BackgroundTrainer(train_isolation_forest, executor=training_executor, name=keyed_name("Isolation Forest model", key))
+        app_metrics.track_trainer(self.trainer)
+        keyed_state.shedder.track_trainer(self.trainer)  # Retrains may wait while the App sheds load
+
+    def close(self):
+        self.trainer.close()
+        self.result_sink.close()
+
+# State of every key read by this worker (the keys of its partitions)
+keyed_state = KeyedState(AnomalyState)
+keyed_state.attach(app)
+attach_training_executor(app, training_executor)  # Shut down after the key states are closed
+app_metrics.gauge('multiflow_buffer_rows', lambda: sum(len(state.received_data) for state in keyed_state), buffer='received_data')
+app_metrics.gauge('multiflow_sink_queue', lambda: sum(state.result_sink.pending for state in keyed_state), sink='results')
+app_metrics.track_keyed_state(keyed_state)
+
+# Faust agent to process messages and detect anomalies (one event at a time, or in micro-batches when BatchMaxEvents > 1;
+# the events of a batch are handled key by key, each key with its own state)
 @app.agent(topic)
 async def anomaly_detection_agent(stream):
-    global received_data, isolation_forest_model
-
-    row_count = 0
-    numeric_columns = None
-
-    async for event in stream:
-        # Parsing the incoming event to create a DataFrame row
-        csv_data = event.get('csv_data', '')
-        try:
-            row_values = list(map(float, csv_data.split(',')))
-            num_columns = len(row_values)
-            column_names = [f'col{i+1}' for i in range(num_columns)]
-            row_df = pd.DataFrame([row_values], columns=column_names)
-            print("Parsed DataFrame row:", row_df)
-        except ValueError:
+    stopwatch = app_metrics.stopwatch()  # Time spent in each stage of a batch
+
+    async for state, events in keyed_state.batches(stream):
+        stopwatch.start()
+        numeric_columns = state.numeric_columns
+        received_data = state.received_data
+        isolation_forest_trainer = state.trainer
+
+        # Parsing the incoming events into one 2-D array (the column count is set by the first row)
+        rows, skipped = event_rows(events, received_data.num_columns)
+        for csv_data in skipped:
             print(f"Skipping event due to parsing error: {csv_data}")
+        if len(rows) == 0:
             continue
+        app_metrics.inc('multiflow_rows_total', len(rows))
+        stopwatch.lap('parse')
+        print("Parsed rows:", rows)
 
-        # Initializing columns and training initial Isolation Forest model
+        # Initializing columns and training initial Isolation Forest model (only the first row is available at this point)
         if numeric_columns is None:
-            numeric_columns = row_df.select_dtypes(include='number').columns.tolist()
-            initial_data = pd.concat([received_data, row_df]).head(initial_block_size)
-            isolation_forest_model = train_isolation_forest(initial_data[numeric_columns])
+            numeric_columns = state.numeric_columns = column_names_for(rows.shape[1])
+            isolation_forest_trainer.fit_now(rows[:1], 0)
             print("Initial Isolation Forest model trained.")
 
-        # Ensuring numeric column consistency
-        row_df = row_df[numeric_columns]
-
-        # Detecting anomalies
-        scores, predictions = detect_anomalies(isolation_forest_model, row_df)
-        row_df['scores'] = scores
-        row_df['anomaly'] = ['yes' if pred == -1 else 'no' for pred in predictions]
-        
-        # Appending row to received data and update row count
-        received_data = pd.concat([received_data, row_df], ignore_index=True)
-        row_count += 1
-
-        # Sending data to InfluxDB
-        send_to_influxdb(row_df, CollectionName=CollectionName)
-
-        # Periodically updating the Isolation Forest model every `update_interval` rows
-        if row_count % update_interval == 0:
-            recent_data = received_data[numeric_columns].iloc[-initial_block_size:]
-            isolation_forest_model = train_isolation_forest(recent_data)
-            print(f"Isolation Forest model updated after {row_count} rows.")
-
-        # Saving to CSV in batches of 100 rows
-        if row_count % 100 == 0:
-            received_data.to_csv(f"{OutputFileName}.csv", index=False)
-            print("CSV file updated with latest events.")
+        # Scoring the batch in chunks that end where a model update is due
+        for start, stop in interval_chunks(state.row_count, len(rows), update_interval):
+            chunk = rows[start:stop]
+
+            # Detecting anomalies for the whole chunk in one call
+            scores, predictions = detect_anomalies(isolation_forest_trainer.model, chunk)
+            labels = np.where(predictions == -1, 'yes', 'no')
+            stopwatch.lap('score')
+            
+            # Appending rows to received data and update row count
+            received_data.extend(chunk)
+            stopwatch.lap('buffer')
+            state.result_sink.append(chunk, numeric_columns, {'scores': scores, 'anomaly': labels})
+            state.row_count += len(chunk)
+
+            # Sending data to InfluxDB (the scores are written as an extra field)
+            influx_sink.write_rows(CollectionName, np.column_stack([chunk, scores]), numeric_columns + ['scores'], tags={"anomaly": labels, **state.tags})
+            print(f"{len(chunk)} data points queued for InfluxDB")
+            stopwatch.lap('sink')
+
+            # Periodically updating the Isolation Forest model every `update_interval` rows (requests made while a fit
+            # is still running are coalesced; scoring continues with the current model until the new one is ready)
+            if state.row_count % update_interval == 0:
+                isolation_forest_trainer.submit(received_data.last(initial_block_size), state.row_count)
+                print(f"Isolation Forest model update requested after {state.row_count} rows: {isolation_forest_trainer.metrics(state.row_count)}")
+                stopwatch.lap('retrain')
 
 # Entry point for the application
 if __name__ == '__main__':
@@ -1,9 +1,6 @@
 import faust
 import os
-import pandas as pd
-from frouros.detectors.data_drift import MMD
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
+from multiflow import RingBuffer, InfluxSink, StreamingMMD, event_rows, interval_chunks, ResultSink, AppMetrics, KeyedState, keyed_name
 
 # Environment variable configurations
 InstanceName = os.getenv('Name', 'InstanceName')
@@ -12,6 +9,16 @@ StreamTopic = os.getenv('StreamTopic', 'phd_kafka')
 concept_samples = int(os.getenv('ConceptSamples', '100'))
 batch_size = int(os.getenv('BatchSize', '10'))
 mmd_threshold = float(os.getenv('MMDThreshold', '0.8'))
+
+# MMD estimator: 'exact' (unbiased MMD^2, RBF kernel), 'rff' (random Fourier features, MMDFeatures of them) or 'linear'
+# (linear-time); MMDSigma is the RBF kernel width or 'median' (median pairwise distance of the reference rows)
+mmd_estimator = os.getenv('MMDEstimator', 'exact')
+mmd_sigma = os.getenv('MMDSigma', '1.0')
+mmd_sigma = mmd_sigma if mmd_sigma == 'median' else float(mmd_sigma)
+mmd_features = int(os.getenv('MMDFeatures', '256'))
+# Reference refresh policy: 'fixed' (the first ConceptSamples rows), 'sliding' (the last ConceptSamples rows before
+# each batch) or 'reset' (a new reference is accumulated, starting with the drifted batch, after every drift)
+reference_policy = os.getenv('ReferencePolicy', 'fixed')
 OutputFileName = os.getenv('OutputFileName', 'Received-Events')
 
 # InfluxDB configurations
@@ -27,118 +34,148 @@ app = faust.App(
     broker='kafka_server://localhost:9092',  
     web_port=int(InstancePort)
 )
-topic = app.topic(StreamTopic)
-
-# Data storage
-reference_data = pd.DataFrame()
-received_data = pd.DataFrame()
-
-# InfluxDB client setup
-influx_client = InfluxDBClient(url=influxdb_url, token=influxdb_token, org=influxdb_org)
-write_api = influx_client.write_api(write_options=SYNCHRONOUS)
-
-# Drift detection variables
-detector = None
-initialized = False
-num_features = None
-
-# Function to send data to InfluxDB
-def send_to_influxdb(row_df, CollectionName):
-    for _, row in row_df.iterrows():
-        point = Point(CollectionName) \
-            .tag("drift_detected", row['drift_detected'])
-        for column in row.index:
-            if column != 'drift_detected':
-                point = point.field(column, float(row[column]))
-        write_api.write(bucket=influxdb_bucket, record=point)
-        print(f"Data point written to InfluxDB: {row.to_dict()}")
-
-# Function to save data to CSV
-def save_to_csv():
-    received_data.to_csv(f"{OutputFileName}.csv", index=False)
-    print(f"Data saved to {OutputFileName}.csv")
-
-# Faust agent for processing
+topic = app.topic(StreamTopic, value_serializer='multiflow')  # Binary row messages and legacy JSON csv_data events
+
+# InfluxDB sink setup (batched writes from a background thread, flushed on shutdown)
+influx_sink = InfluxSink(url=influxdb_url, token=influxdb_token, org=influxdb_org, bucket=influxdb_bucket)
+influx_sink.attach(app)
+
+# Prometheus metrics on the App's web port (GET /metrics): events, stage latencies, buffers and sink queues
+app_metrics = AppMetrics()
+app_metrics.attach(app)
+app_metrics.track_sink('influxdb', influx_sink)
+
+# Drift detection state of one stream key (sensor or stream ID, see KeyField; messages without a key share key None)
+class DriftState:
+    # Saved in checkpoints (CheckpointEverySeconds) and restored when the instance restarts
+    checkpoint_fields = ('row_count', 'reference_data', 'received_data', 'detector', 'initialized', 'num_features', 'result_sink')
+
+    def __init__(self, key):
+        self.key = key
+        self.tags = {} if key is None else {'key': key}
+        self.row_count = 0
+        # Data storage (reference rows for the detector and the last batch of received rows)
+        self.reference_data = RingBuffer(concept_samples)
+        self.received_data = RingBuffer(batch_size)
+        self.result_sink = ResultSink(keyed_name(OutputFileName, key))  # Labeled rows are appended every ResultFlushRows rows
+        # Drift detection variables
+        self.detector = None
+        self.initialized = False
+        self.num_features = None
+
+    def close(self):
+        self.result_sink.close()
+
+# State of every key read by this worker (the keys of its partitions)
+keyed_state = KeyedState(DriftState)
+keyed_state.attach(app)
+app_metrics.gauge('multiflow_buffer_rows', lambda: sum(len(state.reference_data) for state in keyed_state), buffer='reference_data')
+app_metrics.gauge('multiflow_buffer_rows', lambda: sum(len(state.received_data) for state in keyed_state), buffer='received_data')
+app_metrics.gauge('multiflow_sink_queue', lambda: sum(state.result_sink.pending for state in keyed_state), sink='results')
+app_metrics.track_keyed_state(keyed_state)
+
+# Function to (re)initialize the detector of a key on its reference rows; the reference-reference kernel term is
+# computed once here, not on every batch
+def fit_detector(state):
+    try:
+        state.detector = StreamingMMD(mmd_estimator, sigma=mmd_sigma, n_features=mmd_features).fit(state.reference_data.last())
+        state.initialized = True
+        print(f"MMD detector initialized with reference data of shape: {state.reference_data.last().shape} (sigma={state.detector.sigma})")
+    except Exception as e:
+        print(f"Error initializing MMD detector: {e}")
+    return state.initialized
+
+# Faust agent for processing (one event at a time, or in micro-batches when BatchMaxEvents > 1;
+# the events of a batch are handled key by key, each key with its own state)
 @app.agent(topic)
 async def drift_detection_agent(stream):
-    global reference_data, received_data, detector, initialized, num_features
-    row_count = 0
-
-    async for event in stream:
-        csv_data = event.get('csv_data', '')
-        
-        # Parse incoming data row
-        try:
-            row_values = list(map(float, csv_data.split(',')))
-            
-            # Enforce single-column format in DataFrame creation
-            if len(row_values) > 1:
-                print(f"Warning: Received row with unexpected multiple features: {row_values}. Using only the first feature.")
-                row_values = [row_values[0]]  # Keep only the first value
-            
-            column_names = ['col1']  # Explicitly define a single column name
-            row_df = pd.DataFrame([row_values], columns=column_names)
-            print("Parsed DataFrame row:", row_df)
-            
-        except ValueError:
+    stopwatch = app_metrics.stopwatch()  # Time spent in each stage of a batch
+
+    async for state, events in keyed_state.batches(stream):
+        stopwatch.start()
+        reference_data = state.reference_data
+        received_data = state.received_data
+
+        # Parse incoming data rows (all columns) into one 2-D array (the column count is set by the first row)
+        rows, skipped = event_rows(events, state.num_features)
+        for csv_data in skipped:
             print(f"Skipping event due to parsing error: {csv_data}")
+        if len(rows) == 0:
             continue
+        app_metrics.inc('multiflow_rows_total', len(rows))
+        stopwatch.lap('parse')
+        print("Parsed rows:", rows)
 
-        # Check and log dimensions of the incoming row
-        if num_features is None:
-            num_features = len(row_values)
-            print(f"Set number of features to: {num_features}")
-        elif len(row_values) != num_features:
-            print(f"Skipping row due to dimension mismatch: expected {num_features} features, got {len(row_values)}")
-            continue
+        # Log dimensions of the incoming rows
+        if state.num_features is None:
+            state.num_features = rows.shape[1]
+            print(f"Set number of features to: {state.num_features}")
 
         # Accumulate data for reference if not initialized
-        if not initialized:
-            reference_data = pd.concat([reference_data, row_df], ignore_index=True)
+        if not state.initialized:
+            missing = concept_samples - len(reference_data)
+            reference_data.extend(rows[:missing])
+            rows = rows[missing:]
             print(f"Accumulating reference data: {len(reference_data)}/{concept_samples}")
-
-            if len(reference_data) >= concept_samples:
-                try:
-                    detector = MMD()
-                    detector.fit(X=reference_data.to_numpy())
-                    initialized = True
-                    print(f"MMD detector initialized with reference data of shape: {reference_data.shape}")
-                except Exception as e:
-                    print(f"Error initializing MMD detector: {e}")
-            continue
-
-        # Append data to received_data
-        received_data = pd.concat([received_data, row_df], ignore_index=True)
-        row_count += 1
-
-        # Only check for drift if we have a complete batch
-        if row_count % batch_size == 0:
+            stopwatch.lap('buffer')
+
+            if reference_data.is_full() and not fit_detector(state):
+                continue
+            if len(rows) == 0:
+                continue
+
+        # Append data to received_data, checking for drift each time a batch is complete
+        for start, stop in interval_chunks(state.row_count, len(rows), batch_size):
+            received_data.extend(rows[start:stop])
+            state.row_count += stop - start
+            row_count = state.row_count
+            stopwatch.lap('buffer')
+
+            # After a reset, the following rows make up the new reference
+            if not state.initialized:
+                reference_data.extend(rows[start:stop])
+                if reference_data.is_full():
+                    fit_detector(state)
+                stopwatch.lap('retrain')
+                continue
+
+            if row_count % batch_size != 0:
+                continue
+
+            X_batch = received_data.last(batch_size)
+            drift_label = ''
             try:
-                X_batch = received_data.iloc[-batch_size:][['col1']].to_numpy()  # Ensure only 'col1' is selected
                 print(f"Batch data shape for drift detection: {X_batch.shape}")
                 
-                # Check shape compatibility
-                if X_batch.shape[1] != reference_data.shape[1]:
-                    print(f"Skipping drift detection due to dimension mismatch: X_batch has {X_batch.shape[1]} features, reference has {reference_data.shape[1]} features.")
-                    continue
-                
-                mmd_result, _ = detector.compare(X=X_batch)
-                mmd_distance = abs(mmd_result.distance)
+                mmd_distance = abs(state.detector.distance(X_batch))
                 drift_detected = mmd_distance > mmd_threshold
                 print(f"Batch {row_count // batch_size} - MMD distance: {mmd_distance}, Drift detected: {drift_detected}")
 
-                # Append drift detection result
-                received_data.loc[received_data.index[-batch_size:], 'drift_detected'] = 'True' if drift_detected else 'No'
+                # Drift detection result for the whole batch
+                drift_label = 'True' if drift_detected else 'No'
+                stopwatch.lap('score')
 
                 # Send results to InfluxDB
-                send_to_influxdb(received_data.iloc[-batch_size:], CollectionName)
+                influx_sink.write_rows(CollectionName, X_batch, received_data.column_names, tags={"drift_detected": drift_label, **state.tags})
+                print(f"{len(X_batch)} data points queued for InfluxDB")
+                stopwatch.lap('sink')
+
+                # Refreshing the reference according to the policy
+                if reference_policy == 'sliding':
+                    reference_data.extend(X_batch)
+                    state.detector.add_reference(X_batch, evict=len(X_batch))
+                elif reference_policy == 'reset' and drift_detected:
+                    reference_data.clear()
+                    reference_data.extend(X_batch)
+                    state.initialized = False
+                    print(f"Drift detected, accumulating a new reference: {len(reference_data)}/{concept_samples}")
+                stopwatch.lap('retrain')
 
             except Exception as e:
                 print(f"Error during drift detection: {e}")
 
-        # Save to CSV every 100 rows
-        if row_count % 100 == 0:
-            save_to_csv()
+            state.result_sink.append(X_batch, received_data.column_names, {'drift_detected': drift_label})
+            stopwatch.lap('sink')
 
 # Entry point
 if __name__ == '__main__':
@@ -1,8 +1,6 @@
 import faust
 import os
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
-import pandas as pd
+from multiflow import InfluxSink, column_names_for, AppMetrics
 
 # Fetching required environment variables
 InstanceName = os.getenv('Name', 'InstanceName')
@@ -16,45 +14,56 @@ influxdb_org = os.getenv('INFLUXDB_ORG', 'multiflow')
 influxdb_bucket = os.getenv('INFLUXDB_BUCKET', 'faust_app')
 CollectionName = os.getenv('CollectionName', 'stream_data')
 
-# Setting up Faust and InfluxDB clients
+# Setting up Faust and the InfluxDB sink
 app = faust.App(InstanceName, broker='kafka_server://localhost:9092', web_port=int(InstancePort))
-topic = app.topic(StreamTopic)
-influx_client = InfluxDBClient(url=influxdb_url, token=influxdb_token, org=influxdb_org)
-write_api = influx_client.write_api(write_options=SYNCHRONOUS)
-
-# Function to send data to InfluxDB
-def send_to_influxdb(row_df, measurement_name):
-    for _, row in row_df.iterrows():
-        point = Point(measurement_name)
-        for column in row.index:
-            if pd.api.types.is_numeric_dtype(type(row[column])):
-                point = point.field(column, float(row[column]))
-            else:
-                point = point.tag(column, str(row[column]))
-        try:
-            write_api.write(bucket=influxdb_bucket, record=point)
-            print(f"Successfully written to InfluxDB: {row.to_dict()}")
-        except Exception as e:
-            print(f"Error writing to InfluxDB: {e}")
+topic = app.topic(StreamTopic, value_serializer='multiflow')  # Binary row messages and legacy JSON csv_data events
+influx_sink = InfluxSink(url=influxdb_url, token=influxdb_token, org=influxdb_org, bucket=influxdb_bucket)
+influx_sink.attach(app)
+
+# Prometheus metrics on the App's web port (GET /metrics): events, stage latencies and the InfluxDB queue
+app_metrics = AppMetrics()
+app_metrics.attach(app)
+app_metrics.track_sink('influxdb', influx_sink)
+
+# Function to send data to InfluxDB (numeric values as fields, text values as tags)
+def send_to_influxdb(row, measurement_name):
+    fields = {column: value for column, value in row.items() if isinstance(value, float)}
+    tags = {column: str(value) for column, value in row.items() if not isinstance(value, float)}
+    influx_sink.write_rows(measurement_name, [list(fields.values())], list(fields), tags=tags)
+    print(f"Queued for InfluxDB: {row}")
 
 # Faust agent to process messages and send them to InfluxDB
 @app.agent(topic)
 async def stream_to_influxdb_agent(stream):
+    stopwatch = app_metrics.stopwatch()  # Time spent in each stage of an event
+
     async for event in stream:
-        # Parsing the incoming event to create a DataFrame row
+        stopwatch.start()
+
+        # Binary row messages only carry numeric values: each row is sent as it is
+        if 'rows' in event:
+            for values in event['rows']:
+                send_to_influxdb(dict(zip(column_names_for(len(values)), values.tolist())), CollectionName)
+            app_metrics.inc('multiflow_rows_total', len(event['rows']))
+            stopwatch.lap('sink')
+            continue
+
+        # Parsing the incoming event into a row of named values
         csv_data = event.get('csv_data', '')
         try:
             # Convert numeric values to floats
             row_values = list(map(lambda x: float(x) if x.replace('.', '', 1).isdigit() else x, csv_data.split(',')))
-            column_names = [f'col{i+1}' for i in range(len(row_values))]
-            row_df = pd.DataFrame([row_values], columns=column_names)
-            print("Parsed DataFrame row:", row_df)
+            row = dict(zip(column_names_for(len(row_values)), row_values))
+            print("Parsed row:", row)
+            app_metrics.inc('multiflow_rows_total')
+            stopwatch.lap('parse')
         except ValueError:
             print(f"Skipping event due to parsing error: {csv_data}")
             continue
 
         # Sending data to InfluxDB
-        send_to_influxdb(row_df, CollectionName)
+        send_to_influxdb(row, CollectionName)
+        stopwatch.lap('sink')
 
 # Entry point for the application
 if __name__ == '__main__':
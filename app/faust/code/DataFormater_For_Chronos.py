@@ -1,7 +1,7 @@
 import faust
 import os
-import pandas as pd
-from datetime import datetime, timedelta
+from multiflow import RingBuffer, wide_to_long, event_rows, AppMetrics, KeyedState, keyed_name, trace_written
+from datetime import datetime
 
 # Fetching required environment variables
 InstanceName = os.getenv('Name', 'InstanceName')
@@ -11,76 +11,86 @@ OutputFileName = os.getenv('OutputFileName', 'timeseries_data')
 
 # Setting up Faust app
 app = faust.App(InstanceName, broker='kafka_server://localhost:9092', web_port=int(InstancePort))
-topic = app.topic(StreamTopic)
+topic = app.topic(StreamTopic, value_serializer='multiflow')  # Binary row messages and legacy JSON csv_data events
 
-# Global variables
-received_data = pd.DataFrame()
-start_time = datetime.now()  # Snapshot of the current time
-global_row_count = 0  # Counter for total rows processed globally
+ProcessingBlockSize = 100  # Number of rows accumulated before each conversion
+
+# Formatting state of one stream key (sensor or stream ID, see KeyField; messages without a key share key None)
+class FormatterState:
+    # Saved in checkpoints (CheckpointEverySeconds) and restored when the instance restarts
+    checkpoint_fields = ('row_count', 'start_time', 'received_data')
+
+    def __init__(self, key):
+        self.key = key
+        self.output_file = f"{keyed_name(OutputFileName, key)}.csv"
+        self.received_data = RingBuffer(ProcessingBlockSize)
+        self.start_time = datetime.now()  # Snapshot of the current time
+        self.row_count = 0  # Counter for total rows processed for this key
+
+# State of every key read by this worker (the keys of its partitions)
+keyed_state = KeyedState(FormatterState)
+keyed_state.attach(app)
+
+# Prometheus metrics on the App's web port (GET /metrics): events, stage latencies and buffer size
+app_metrics = AppMetrics()
+app_metrics.attach(app)
+app_metrics.gauge('multiflow_buffer_rows', lambda: sum(len(state.received_data) for state in keyed_state), buffer='received_data')
+app_metrics.track_keyed_state(keyed_state)
 
 # Function to process and convert data into time-series format
-def process_to_timeseries(dataframe, start_row_index):
-    timeseries_data = []
-
-    # Generate timestamps by incrementing 1 minute for each row in each column
-    for idx, row in dataframe.iterrows():
-        for col in dataframe.columns:
-            # Calculate the timestamp and format it to exclude milliseconds
-            timestamp = (start_time + timedelta(minutes=start_row_index + len(timeseries_data))).strftime('%Y-%m-%d %H:%M:%S')
-            timeseries_data.append({
-                "item_id": col,
-                "timestamp": timestamp,  # Use the formatted timestamp
-                "target": row[col]
-            })
-
-    # Convert the list of dictionaries into a DataFrame
-    timeseries_df = pd.DataFrame(timeseries_data)
-    
-    return timeseries_df
-
-# Faust agent to process messages and format data
+# (timestamps are incremented by 1 minute for each row in each column, continuing from the previous block)
+def process_to_timeseries(state, rows, start_row_index):
+    return wide_to_long(rows, state.received_data.column_names, state.start_time, first_cell_index=start_row_index * rows.shape[1])
+
+# Faust agent to process messages and format data (event by event, each key with its own state)
 @app.agent(topic)
 async def timeseries_processing_agent(stream):
-    global received_data, start_time, global_row_count
-    async for event in stream:
-        # Parsing the incoming event to create a DataFrame row
-        csv_data = event.get('csv_data', '')
-        try:
-            # Split the CSV data into individual values
-            row_values = list(map(float, csv_data.split(',')))
-            num_columns = len(row_values)
-            column_names = [f'col{i+1}' for i in range(num_columns)]
-            row_df = pd.DataFrame([row_values], columns=column_names)
-        except ValueError:
+    stopwatch = app_metrics.stopwatch()  # Time spent in each stage of an event
+
+    async for state, events in keyed_state.batches(stream, max_events=1):
+        stopwatch.start()
+        received_data = state.received_data
+
+        # An event carries one legacy csv_data row or a block of binary rows
+        rows, skipped = event_rows(events, received_data.num_columns)
+        for csv_data in skipped:
             print(f"Error: Skipping event due to parsing error: {csv_data}")
-            continue
-
-        # Accumulate received data
-        received_data = pd.concat([received_data, row_df], ignore_index=True)
-        global_row_count += 1
-
-        # Log the number of rows received every 50 rows
-        if global_row_count % 100 == 0:
-            print(f"Total rows received so far: {global_row_count}")
-
-        # Process accumulated data into time-series format when sufficient data is available
-        if len(received_data) >= 100:  # Example threshold for processing
-            timeseries_data = process_to_timeseries(received_data, global_row_count - len(received_data))
-
-            # Log relevant information
-            print(f"Processed {len(timeseries_data)} rows of time-series data.")
-
-            # Export to CSV
-            timeseries_data.to_csv(
-                f"{OutputFileName}.csv",
-                mode='a',
-                header=not os.path.exists(f"{OutputFileName}.csv"),
-                index=False
-            )
-            print(f"Time-series data saved to {OutputFileName}.csv")
-
-            # Reset accumulated data after processing
-            received_data = pd.DataFrame()
+        app_metrics.inc('multiflow_rows_total', len(rows))
+        stopwatch.lap('parse')
+
+        for values in rows:
+            # Accumulate the values in the received data buffer
+            received_data.append(values)
+            stopwatch.lap('buffer')
+
+            state.row_count += 1
+
+            # Log the number of rows received every 50 rows
+            if state.row_count % 100 == 0:
+                print(f"Total rows received so far: {state.row_count}")
+
+            # Process accumulated data into time-series format when sufficient data is available
+            if received_data.is_full():  # Example threshold for processing
+                timeseries_data = process_to_timeseries(state, received_data.last(), state.row_count - len(received_data))
+
+                # Log relevant information
+                print(f"Processed {len(timeseries_data)} rows of time-series data.")
+                stopwatch.lap('score')
+
+                # Export to CSV
+                timeseries_data.to_csv(
+                    state.output_file,
+                    mode='a',
+                    header=not os.path.exists(state.output_file),
+                    index=False,
+                    date_format='%Y-%m-%d %H:%M:%S'  # Format timestamps to exclude milliseconds
+                )
+                trace_written('csv')
+                print(f"Time-series data saved to {state.output_file}")
+                stopwatch.lap('sink')
+
+                # Reset accumulated data after processing (the column count is kept)
+                received_data.clear()
 
 # Entry point for the application
 if __name__ == '__main__':
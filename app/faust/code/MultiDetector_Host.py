@@ -0,0 +1,59 @@
+import faust
+import os
+from multiflow import event_rows, keyed_batches, AppMetrics, PipelineHost
+
+# Fetch required fields from environment variables
+InstanceName = os.getenv('Name', 'InstanceName')
+InstancePort = os.getenv('Port', '6066')
+StreamTopic = os.getenv('StreamTopic', 'phd_kafka')
+
+# Detector pipelines to start with: a JSON list of {"name", "app", "env"} specs, or the path of a file holding it, e.g.
+# [{"name": "iqr", "app": "OutlierDetection_DynamicIQRMethod"}, {"name": "svm", "app": "OutlierDetection_OneClassSVM", "env": {"UpdateInterval": "50"}}]
+Pipelines = os.getenv('Pipelines', '[]')
+
+# Initializing Faust application with the specified instance name and Kafka broker
+app = faust.App(
+    InstanceName,
+    broker='kafka_server://localhost:9092',
+    web_port=int(InstancePort)
+)
+
+# Defining a Kafka topic to which this Faust app will subscribe
+topic = app.topic(StreamTopic, value_serializer='multiflow')  # Binary row messages and legacy JSON csv_data events
+
+# Pipelines fed by this App (added or removed at runtime on GET/POST /pipelines/, DELETE /pipelines/<name>/)
+pipeline_host = PipelineHost()
+pipeline_host.attach(app)
+pipeline_host.add_from(Pipelines)
+
+# Prometheus metrics on the App's web port (GET /metrics): ingest of the host plus the metrics of every pipeline
+app_metrics = AppMetrics()
+app_metrics.attach(app, include=pipeline_host.metrics)
+
+# Defining an agent that parses every event once and hands the rows to all pipelines, with their stream key
+@app.agent(topic)
+async def ingest_agent(stream):
+    num_columns = {}  # Column count of each key
+
+    stopwatch = app_metrics.stopwatch()  # Time spent in each stage of a batch
+
+    async for key, tp, events in keyed_batches(stream):
+        stopwatch.start()
+
+        # Parsing the incoming events into one 2-D array (the column count is set by the first row)
+        rows, skipped = event_rows(events, num_columns.get(key))
+        for csv_data in skipped:
+            print(f"Skipping event due to parsing error: {csv_data}")
+        if len(rows) == 0:
+            continue
+        num_columns[key] = rows.shape[1]
+        app_metrics.inc('multiflow_rows_total', len(rows))
+        stopwatch.lap('parse')
+
+        # Fanning the rows out (waits while a pipeline is PipelineQueueSize batches behind)
+        await pipeline_host.fan_out(rows, key, tp)
+        stopwatch.lap('fan_out')
+
+# Entry point for the application
+if __name__ == '__main__':
+    app.main()
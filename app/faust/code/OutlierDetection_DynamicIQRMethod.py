@@ -1,8 +1,7 @@
 import faust
 import os
-import pandas as pd
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
+import numpy as np
+from multiflow import InfluxSink, make_quantile_estimator, column_names_for, event_rows, interval_chunks, ResultSink, AppMetrics, KeyedState, keyed_name
 
 # Fetch required fields from environment variables
 InstanceName = os.getenv('Name', 'InstanceName')
@@ -12,6 +11,13 @@ initial_block_size = int(os.getenv('InitialBlockSize', '100'))
 update_interval = int(os.getenv('UpdateInterval', '25'))
 OutputFileName = os.getenv('OutputFileName', 'Received-Events')
 
+# Streaming quantile settings: 'full' (KLL sketch over the whole history), 'window' (exact, last QuantileWindow rows)
+# or 'decay' (exponentially decayed, time constant of about 1/QuantileDecay rows)
+QuantileMode = os.getenv('QuantileMode', 'full')
+QuantileSketchSize = int(os.getenv('QuantileSketchSize', '200'))
+QuantileWindow = int(os.getenv('QuantileWindow', '1000'))
+QuantileDecay = float(os.getenv('QuantileDecay', '0.01'))
+
 # InfluxDB configurations from environment variables
 CollectionName = os.getenv('CollectionName', 'outlier_detection')
 influxdb_url = os.getenv('INFLUXDB_URL', 'http://influxdb_server:8086')
@@ -27,104 +33,118 @@ app = faust.App(
 )
 
 # Defining a Kafka topic to which this Faust app will subscribe
-topic = app.topic(StreamTopic)
-
-# Initializing DataFrame to store received events
-received_data = pd.DataFrame()
-
-# Setting up InfluxDB client
-influx_client = InfluxDBClient(url=influxdb_url, token=influxdb_token, org=influxdb_org)
-write_api = influx_client.write_api(write_options=SYNCHRONOUS)
-
-# Function to calculate IQR thresholds for outlier detection
-def calculate_iqr_thresholds(data):
-    Q1 = data.quantile(0.25)
-    Q3 = data.quantile(0.75)
+topic = app.topic(StreamTopic, value_serializer='multiflow')  # Binary row messages and legacy JSON csv_data events
+
+# Detection state of one stream key (sensor or stream ID, see KeyField; messages without a key share key None)
+class OutlierState:
+    # Saved in checkpoints (CheckpointEverySeconds) and restored when the instance restarts
+    checkpoint_fields = ('row_count', 'numeric_columns', 'thresholds', 'quantile_estimator', 'result_sink')
+
+    def __init__(self, key):
+        self.key = key
+        self.tags = {} if key is None else {'key': key}
+        self.row_count = 0
+        self.numeric_columns = None
+        self.thresholds = None
+        # Per-column quantile estimates of the received events (created once the column count is known)
+        self.quantile_estimator = None
+        # Labeled rows are appended to the output file (ResultFormat: csv, parquet or arrow) every ResultFlushRows rows
+        self.result_sink = ResultSink(keyed_name(OutputFileName, key))
+
+    def close(self):
+        self.result_sink.close()
+
+# State of every key read by this worker (the keys of its partitions)
+keyed_state = KeyedState(OutlierState)
+keyed_state.attach(app)
+
+# Setting up the InfluxDB sink (batched writes from a background thread, flushed on shutdown)
+influx_sink = InfluxSink(url=influxdb_url, token=influxdb_token, org=influxdb_org, bucket=influxdb_bucket)
+influx_sink.attach(app)
+
+# Prometheus metrics on the App's web port (GET /metrics): events, stage latencies, sink queues and consumer lag
+app_metrics = AppMetrics()
+app_metrics.attach(app)
+app_metrics.track_sink('influxdb', influx_sink)
+app_metrics.gauge('multiflow_sink_queue', lambda: sum(state.result_sink.pending for state in keyed_state), sink='results')
+app_metrics.track_keyed_state(keyed_state)
+
+# Function to calculate IQR thresholds for outlier detection (all columns at once) from the streaming quantiles
+def calculate_iqr_thresholds(estimator):
+    Q1, Q3 = estimator.quantiles([0.25, 0.75])
     IQR = Q3 - Q1
     lower_threshold = Q1 - 1.5 * IQR
     upper_threshold = Q3 + 1.5 * IQR
     return lower_threshold, upper_threshold
 
-# Function to update IQR thresholds dynamically for numeric columns in any dataset
-def update_iqr_thresholds(dataframe, numeric_columns):
-    thresholds = {}
-    for column in numeric_columns:
-        lower_threshold, upper_threshold = calculate_iqr_thresholds(dataframe[column])
-        thresholds[column] = (lower_threshold, upper_threshold)
-    return thresholds
-
-# Function to send data to InfluxDB
-def send_to_influxdb(row_df, CollectionName):
-    for _, row in row_df.iterrows():
-        point = Point(CollectionName) \
-            .tag("outliers", row['outliers'])  # Tags for quick filtering
-        for column in row.index:
-            if column != 'outliers':
-                point = point.field(column, float(row[column]))
-        write_api.write(bucket=influxdb_bucket, record=point)
-        print(f"Data point written to InfluxDB: {row.to_dict()}")
-
-# Defining an agent to process messages from the Kafka topic
+# Function to flag the rows of a 2-D array that fall outside the thresholds in any column
+def detect_outliers(rows, thresholds):
+    lower_threshold, upper_threshold = thresholds
+    return (rows < lower_threshold) | (rows > upper_threshold)
+
+# Function to format thresholds per column for logging
+def describe_thresholds(thresholds, numeric_columns):
+    return {column: (low, high) for column, low, high in zip(numeric_columns, *thresholds)}
+
+# Defining an agent to process messages from the Kafka topic (one event at a time, or in micro-batches when BatchMaxEvents > 1;
+# the events of a batch are handled key by key, each key with its own state)
 @app.agent(topic)
 async def outlier_detection_agent(stream):
-    global received_data
-
-    row_count = 0
-    numeric_columns = None
-    thresholds = {}
-
-    async for event in stream:
-        # Parsing incoming event data to create a DataFrame row
-        csv_data = event.get('csv_data', '')
-        
-        # Spliting the csv_data string by commas to count columns and convert to floats
-        try:
-            row_values = list(map(float, csv_data.split(',')))
-            
-            # Determining the number of columns
-            num_columns = len(row_values)
-            column_names = [f'col{i+1}' for i in range(num_columns)]
-            
-            # Creating DataFrame with dynamic column names
-            row_df = pd.DataFrame([row_values], columns=column_names)
-            print("Parsed DataFrame row:", row_df)
-        except ValueError:
+    stopwatch = app_metrics.stopwatch()  # Time spent in each stage of a batch
+
+    async for state, events in keyed_state.batches(stream):
+        stopwatch.start()
+        numeric_columns = state.numeric_columns
+
+        # Parsing the incoming events into one 2-D array (the column count is set by the first row)
+        rows, skipped = event_rows(events, len(numeric_columns) if numeric_columns else None)
+        for csv_data in skipped:
             print(f"Skipping event due to parsing error: {csv_data}")
+        if len(rows) == 0:
             continue
+        app_metrics.inc('multiflow_rows_total', len(rows))
+        stopwatch.lap('parse')
+        print("Parsed rows:", rows)
 
         # Initializing numeric columns and setting IQR thresholds on the first row
         if numeric_columns is None:
-            numeric_columns = row_df.select_dtypes(include='number').columns.tolist()
-            thresholds = update_iqr_thresholds(pd.concat([received_data, row_df]).head(initial_block_size), numeric_columns)
-            print(f"Initial IQR thresholds set for numeric columns: {thresholds}")
-
-        ### Checking for outliers
-        is_outlier = False
-        for column in numeric_columns:
-            lower_threshold, upper_threshold = thresholds[column]
-            value = row_df[column].iloc[0]
-            if value < lower_threshold or value > upper_threshold:
-                is_outlier = True
-                print(f"Outlier detected in {column}: Value={value}  (Thresholds=({lower_threshold}, {upper_threshold}))")
-                break
-
-        # Labeling the row and adding it to received_data
-        row_df['outliers'] = 'yes' if is_outlier else 'no'
-        received_data = pd.concat([received_data, row_df], ignore_index=True)
-        row_count += 1
-
-        # Sending data to InfluxDB with collection name
-        send_to_influxdb(row_df, CollectionName=CollectionName)
-
-        # Updating thresholds every `update_interval` rows
-        if row_count % update_interval == 0:
-            thresholds = update_iqr_thresholds(received_data.iloc[:row_count], numeric_columns)
-            print(f"Updated IQR thresholds after {row_count} rows: {thresholds}")
-
-        # Saving to CSV in batches of 100 rows
-        if row_count % 100 == 0:
-            received_data.to_csv(str(OutputFileName) + ".csv", index=False)
-            print("CSV file updated with latest events.")
+            numeric_columns = state.numeric_columns = column_names_for(rows.shape[1])
+            state.quantile_estimator = make_quantile_estimator(QuantileMode, len(numeric_columns), k=QuantileSketchSize, window=QuantileWindow, decay=QuantileDecay)
+            state.quantile_estimator.update(rows[:1])
+            state.thresholds = calculate_iqr_thresholds(state.quantile_estimator)
+            print(f"Initial IQR thresholds set for numeric columns: {describe_thresholds(state.thresholds, numeric_columns)}")
+
+        # Scoring the batch in chunks that end where a threshold update is due
+        for start, stop in interval_chunks(state.row_count, len(rows), update_interval):
+            chunk = rows[start:stop]
+            thresholds = state.thresholds
+
+            ### Checking for outliers in all columns at once
+            outlier_mask = detect_outliers(chunk, thresholds)
+            is_outlier = outlier_mask.any(axis=1)
+            for i in np.flatnonzero(is_outlier):
+                column = int(np.argmax(outlier_mask[i]))
+                print(f"Outlier detected in {numeric_columns[column]}: Value={chunk[i, column]}  (Thresholds=({thresholds[0][column]}, {thresholds[1][column]}))")
+
+            # Labeling the rows and adding them to the quantile estimates (O(1) amortised per row;
+            # the very first row was already added when the thresholds were initialized)
+            labels = np.where(is_outlier, 'yes', 'no')
+            stopwatch.lap('score')
+            state.quantile_estimator.update(chunk[1:] if state.row_count == 0 else chunk)
+            stopwatch.lap('buffer')
+            state.result_sink.append(chunk, numeric_columns, {'outliers': labels})
+            state.row_count += len(chunk)
+
+            # Sending data to InfluxDB with collection name ("outliers" is a tag for quick filtering)
+            influx_sink.write_rows(CollectionName, chunk, numeric_columns, tags={"outliers": labels, **state.tags})
+            print(f"{len(chunk)} data points queued for InfluxDB")
+            stopwatch.lap('sink')
+
+            # Updating thresholds every `update_interval` rows
+            if state.row_count % update_interval == 0:
+                state.thresholds = calculate_iqr_thresholds(state.quantile_estimator)
+                print(f"Updated IQR thresholds after {state.row_count} rows: {describe_thresholds(state.thresholds, numeric_columns)}")
+                stopwatch.lap('score')
 
 # Entry point for the application
 if __name__ == '__main__':
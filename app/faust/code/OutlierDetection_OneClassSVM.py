@@ -1,10 +1,10 @@
 import faust
 import os
-import pandas as pd
+import numpy as np
+from multiflow import RingBuffer, InfluxSink, column_names_for, event_rows, interval_chunks, ResultSink, BackgroundTrainer, TrainingMode, make_training_executor, attach_training_executor, OnlineOneClassSVM, AppMetrics, KeyedState, keyed_name
 from sklearn.svm import OneClassSVM
+from sklearn.pipeline import make_pipeline
 from sklearn.preprocessing import StandardScaler
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
 
 # Fetching environment variables
 InstanceName = os.getenv('Name', 'InstanceName')
@@ -14,6 +14,11 @@ initial_block_size = int(os.getenv('InitialBlockSize', '100'))
 update_interval = int(os.getenv('UpdateInterval', '25'))
 OutputFileName = os.getenv('OutputFileName', 'Received-Events')
 
+# Model mode: 'batch' (refit on the last InitialBlockSize rows every UpdateInterval rows) or 'online' (incremental
+# scaler + random Fourier features + SGD One-Class SVM, updated with every row at constant cost)
+SVMMode = os.getenv('SVMMode', 'batch')
+OnlineSVMComponents = int(os.getenv('OnlineSVMComponents', '200'))
+
 # InfluxDB configuration
 CollectionName = os.getenv('CollectionName', 'outlier_detection')
 influxdb_url = os.getenv('INFLUXDB_URL', 'http://influxdb_server:8086')
@@ -21,94 +26,127 @@ influxdb_token = os.getenv('INFLUXDB_TOKEN', 'admin')
 influxdb_org = os.getenv('INFLUXDB_ORG', 'multiflow')
 influxdb_bucket = os.getenv('INFLUXDB_BUCKET', 'faust_app')
 
-# Faust and InfluxDB client initialization
+# Faust and InfluxDB sink initialization
 app = faust.App(InstanceName, broker='kafka_server://localhost:9092', web_port=int(InstancePort))
-topic = app.topic(StreamTopic)
-influx_client = InfluxDBClient(url=influxdb_url, token=influxdb_token, org=influxdb_org)
-write_api = influx_client.write_api(write_options=SYNCHRONOUS)
-
-# Global data storage and model variables
-received_data = pd.DataFrame()
-scaler = None
-one_class_svm_model = None
+topic = app.topic(StreamTopic, value_serializer='multiflow')  # Binary row messages and legacy JSON csv_data events
+influx_sink = InfluxSink(url=influxdb_url, token=influxdb_token, org=influxdb_org, bucket=influxdb_bucket)
+influx_sink.attach(app)
 
-# Function to train or update One-Class SVM model
+# Function to train or update One-Class SVM model (the scaler is part of the model, so both are swapped in together)
 def train_one_class_svm(data):
-    global scaler
-    scaler = StandardScaler()
-    scaled_data = scaler.fit_transform(data)
-    model = OneClassSVM(gamma='auto', kernel='rbf', nu=0.05)
-    model.fit(scaled_data)
+    model = make_pipeline(StandardScaler(), OneClassSVM(gamma='auto', kernel='rbf', nu=0.05))
+    model.fit(data)
     return model
 
 # Function to detect anomalies with One-Class SVM
 def detect_anomaly(model, data):
-    scaled_data = scaler.transform(data) if scaler else data
-    predictions = model.predict(scaled_data)
+    predictions = model.predict(data)
     return predictions
 
-# Function to send data to InfluxDB
-def send_to_influxdb(row_df, CollectionName):
-    for _, row in row_df.iterrows():
-        point = Point(CollectionName).tag("outliers", row['outliers'])
-        for column in row.index:
-            if column != 'outliers':
-                point = point.field(column, float(row[column]))
-        write_api.write(bucket=influxdb_bucket, record=point)
-        print(f"Data point written to InfluxDB: {row.to_dict()}")
-
-# Faust agent to process messages from the Kafka topic
+# Prometheus metrics on the App's web port (GET /metrics): events, stage latencies, retraining, buffers and sink queues
+app_metrics = AppMetrics()
+app_metrics.attach(app)
+app_metrics.track_sink('influxdb', influx_sink)
+
+# One training executor (TrainingMode, with TrainingWorkers workers) for the refits of every key
+training_executor = make_training_executor(TrainingMode)
+
+# Detection state of one stream key (sensor or stream ID, see KeyField; messages without a key share key None)
+class OutlierState:
+    # Saved in checkpoints (CheckpointEverySeconds) and restored when the instance restarts
+    checkpoint_fields = ('row_count', 'numeric_columns', 'received_data', 'trainer', 'online_svm_model', 'result_sink')
+
+    def __init__(self, key):
+        self.key = key
+        self.tags = {} if key is None else {'key': key}
+        self.row_count = 0
+        self.numeric_columns = None
+        # Data storage and models (only the last `initial_block_size` rows are needed for retraining)
+        self.received_data = RingBuffer(initial_block_size)
+        self.result_sink = ResultSink(keyed_name(OutputFileName, key))  # Labeled rows are appended every ResultFlushRows rows
+        # Periodic refits run on a snapshot of the window in the background (TrainingMode) and the new model is swapped in when ready
+        self.trainer = BackgroundTrainer(train_one_class_svm, executor=training_executor, name=keyed_name("One-Class SVM model", key))
+        app_metrics.track_trainer(self.trainer)
+        keyed_state.shedder.track_trainer(self.trainer)  # Retrains may wait while the App sheds load
+        self.online_svm_model = None
+
+    def close(self):
+        self.trainer.close()
+        self.result_sink.close()
+
+# State of every key read by this worker (the keys of its partitions)
+keyed_state = KeyedState(OutlierState)
+keyed_state.attach(app)
+attach_training_executor(app, training_executor)  # Shut down after the key states are closed
+app_metrics.gauge('multiflow_buffer_rows', lambda: sum(len(state.received_data) for state in keyed_state), buffer='received_data')
+app_metrics.gauge('multiflow_sink_queue', lambda: sum(state.result_sink.pending for state in keyed_state), sink='results')
+app_metrics.track_keyed_state(keyed_state)
+
+# Faust agent to process messages from the Kafka topic (one event at a time, or in micro-batches when BatchMaxEvents > 1;
+# the events of a batch are handled key by key, each key with its own state)
 @app.agent(topic)
 async def outlier_detection_agent(stream):
-    global received_data, one_class_svm_model, scaler
-
-    row_count = 0
-    numeric_columns = None
-
-    async for event in stream:
-        # Parsing the incoming event to create a DataFrame row
-        csv_data = event.get('csv_data', '')
-        try:
-            row_values = list(map(float, csv_data.split(',')))
-            num_columns = len(row_values)
-            column_names = [f'col{i+1}' for i in range(num_columns)]
-            row_df = pd.DataFrame([row_values], columns=column_names)
-            print("Parsed DataFrame row:", row_df)
-        except ValueError:
+    stopwatch = app_metrics.stopwatch()  # Time spent in each stage of a batch
+
+    async for state, events in keyed_state.batches(stream):
+        stopwatch.start()
+        numeric_columns = state.numeric_columns
+        received_data = state.received_data
+        one_class_svm_trainer = state.trainer
+
+        # Parsing the incoming events into one 2-D array (the column count is set by the first row)
+        rows, skipped = event_rows(events, received_data.num_columns)
+        for csv_data in skipped:
             print(f"Skipping event due to parsing error: {csv_data}")
+        if len(rows) == 0:
             continue
+        app_metrics.inc('multiflow_rows_total', len(rows))
+        stopwatch.lap('parse')
+        print("Parsed rows:", rows)
 
-        # Initializing columns and trainning initial One-Class SVM model
+        # Initializing columns and trainning initial One-Class SVM model (only the first row is available at this point)
         if numeric_columns is None:
-            numeric_columns = row_df.select_dtypes(include='number').columns.tolist()
-            initial_data = pd.concat([received_data, row_df]).head(initial_block_size)
-            one_class_svm_model = train_one_class_svm(initial_data[numeric_columns])
-            print(f"Initial One-Class SVM model trained on the first {initial_block_size} rows.")
-
-        # Detecting anomalies
-        current_data = pd.DataFrame(row_df[numeric_columns].values.reshape(1, -1), columns=numeric_columns)
-        predictions = detect_anomaly(one_class_svm_model, current_data)
-        
-        # Assigning 'outliers' label based on predictions (-1 for outliers)
-        row_df['outliers'] = 'yes' if predictions[0] == -1 else 'no'
-        
-        # Adding the row to received data and update the row count
-        received_data = pd.concat([received_data, row_df], ignore_index=True)
-        row_count += 1
-
-        # Sending data to InfluxDB
-        send_to_influxdb(row_df, CollectionName=CollectionName)
-
-        # Periodically updating the model every `update_interval` rows
-        if row_count % update_interval == 0:
-            recent_data = received_data.iloc[-initial_block_size:]
-            one_class_svm_model = train_one_class_svm(recent_data[numeric_columns])
-            print(f"One-Class SVM model updated after {row_count} rows.")
-
-        # Saving to CSV in batches of 100 rows
-        if row_count % 100 == 0:
-            received_data.to_csv(f"{OutputFileName}.csv", index=False)
-            print("CSV file updated with latest events.")
+            numeric_columns = state.numeric_columns = column_names_for(rows.shape[1])
+            if SVMMode == 'online':
+                state.online_svm_model = OnlineOneClassSVM(n_components=OnlineSVMComponents, nu=0.05).partial_fit(rows[:1])
+                print(f"Online One-Class SVM model initialized with {OnlineSVMComponents} random Fourier features.")
+            else:
+                one_class_svm_trainer.fit_now(rows[:1], 0)
+                print(f"Initial One-Class SVM model trained on the first {initial_block_size} rows.")
+
+        # Scoring the batch in chunks that end where a model update is due
+        for start, stop in interval_chunks(state.row_count, len(rows), update_interval):
+            chunk = rows[start:stop]
+            online_svm_model = state.online_svm_model
+
+            # Detecting anomalies for the whole chunk in one call
+            predictions = detect_anomaly(online_svm_model if SVMMode == 'online' else one_class_svm_trainer.model, chunk)
+            
+            # Assigning 'outliers' label based on predictions (-1 for outliers)
+            labels = np.where(predictions == -1, 'yes', 'no')
+            
+            # Online mode: updating the model with every new row (the very first row was used to initialize it)
+            if SVMMode == 'online':
+                online_svm_model.partial_fit(chunk[1:] if state.row_count == 0 else chunk)
+            stopwatch.lap('score')
+
+            # Adding the rows to received data and update the row count
+            received_data.extend(chunk)
+            stopwatch.lap('buffer')
+            state.result_sink.append(chunk, numeric_columns, {'outliers': labels})
+            state.row_count += len(chunk)
+
+            # Sending data to InfluxDB
+            influx_sink.write_rows(CollectionName, chunk, numeric_columns, tags={"outliers": labels, **state.tags})
+            print(f"{len(chunk)} data points queued for InfluxDB")
+            stopwatch.lap('sink')
+
+            # Periodically updating the model every `update_interval` rows (requests made while a fit is still
+            # running are coalesced; scoring continues with the current model until the new one is ready)
+            if SVMMode != 'online' and state.row_count % update_interval == 0:
+                one_class_svm_trainer.submit(received_data.last(initial_block_size), state.row_count)
+                print(f"One-Class SVM model update requested after {state.row_count} rows: {one_class_svm_trainer.metrics(state.row_count)}")
+                stopwatch.lap('retrain')
 
 # Entry point for the application
 if __name__ == '__main__':
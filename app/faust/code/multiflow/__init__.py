@@ -0,0 +1,20 @@
+# Shared building blocks for the MultiFlow Faust apps.
+# This folder is not an App: it only holds helpers that the Apps in /app import.
+from multiflow.buffer import RingBuffer, column_names_for, parse_csv_rows
+from multiflow.batching import micro_batches, interval_chunks, crossed_interval
+from multiflow.influx import InfluxSink, build_lines
+from multiflow.quantiles import KLLSketch, SlidingWindowQuantiles, DecayedQuantiles, make_quantile_estimator
+from multiflow.timeseries import LongFormatWindow, Watermark, wide_to_long
+from multiflow.models import ModelStore, RetrainScheduler
+from multiflow.training import BackgroundTrainer, TrainingMode, make_training_executor, attach_training_executor
+from multiflow.online_svm import OnlineOneClassSVM
+from multiflow.forecasting import NumpyForecaster, FORECAST_METHODS
+from multiflow.mmd import StreamingMMD
+from multiflow.results import ResultSink, read_results
+from multiflow.codec import RowsCodec, RowProducer, encode_rows, decode_event, event_rows
+from multiflow.metrics import AppMetrics, Histogram, Stopwatch
+from multiflow.host import PipelineHost, Pipeline, PipelineStream
+from multiflow.keyed import KeyedState, keyed_batches, keyed_events, keyed_name, event_key
+from multiflow.checkpoint import CheckpointStore, snapshot_fields, restore_fields
+from multiflow.shedding import LoadShedder, LagMonitor, SHEDDING_POLICIES
+from multiflow.tracing import LatencyTracer, SequenceStamper, event_trace, trace_written, current_trace
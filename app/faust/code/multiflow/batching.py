@@ -0,0 +1,36 @@
+import os
+
+# Micro-batch configuration shared by the detector Apps.
+# BatchMaxEvents=1 (default) keeps the original one-event-at-a-time behaviour.
+# Larger batches raise throughput; BatchMaxLatencyMs caps how long an event may wait for its batch to fill.
+BatchMaxEvents = int(os.getenv('BatchMaxEvents', '1'))
+BatchMaxLatencyMs = float(os.getenv('BatchMaxLatencyMs', '100'))
+
+
+# Async generator yielding lists of events from a Faust stream.
+# A batch is emitted when it holds `max_events` events or `max_latency_ms` has elapsed, whichever comes first.
+async def micro_batches(stream, max_events=None, max_latency_ms=None):
+    max_events = BatchMaxEvents if max_events is None else max_events
+    max_latency_ms = BatchMaxLatencyMs if max_latency_ms is None else max_latency_ms
+
+    if max_events <= 1:
+        async for event in stream:
+            yield [event]
+    else:
+        async for events in stream.take(max_events, within=max_latency_ms / 1000.0):
+            yield events
+
+
+# Function to split `n` new rows into chunks that end exactly where a periodic update (every `interval` rows) is due.
+# Scoring chunk by chunk and updating the model in between gives the same results as scoring row by row.
+def interval_chunks(row_count, n, interval):
+    start = 0
+    while start < n:
+        stop = min(n, start + interval - (row_count + start) % interval)
+        yield start, stop
+        start = stop
+
+
+# Function to check whether a multiple of `interval` was reached while the row count moved from `previous` to `current`
+def crossed_interval(previous, current, interval):
+    return current // interval > previous // interval
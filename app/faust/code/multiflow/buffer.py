@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+
+
+# Function to build the default column names used by every App ('col1', 'col2', ...)
+def column_names_for(num_columns):
+    return [f'col{i+1}' for i in range(num_columns)]
+
+
+# Function to parse a list of comma-separated lines into one 2-D float64 array.
+# Returns the parsed rows and the lines that were skipped (malformed or with the wrong number of values).
+def parse_csv_rows(lines, num_columns=None):
+    split_lines = [csv_data.split(',') for csv_data in lines]
+    try:
+        rows = np.array(split_lines, dtype=np.float64)
+        if rows.ndim == 2 and (num_columns is None or rows.shape[1] == num_columns):
+            return rows, []
+    except ValueError:
+        pass
+
+    # Slow path: validate line by line
+    parsed, skipped = [], []
+    for csv_data, values in zip(lines, split_lines):
+        try:
+            row = np.array(values, dtype=np.float64)
+        except ValueError:
+            skipped.append(csv_data)
+            continue
+        if num_columns is None:
+            num_columns = len(row)
+        if len(row) != num_columns:
+            skipped.append(csv_data)
+            continue
+        parsed.append(row)
+    rows = np.array(parsed, dtype=np.float64).reshape(len(parsed), num_columns or 0)
+    return rows, skipped
+
+
+class RingBuffer:
+    """Fixed-capacity window of float64 rows backed by a preallocated array.
+
+    Every row is written twice (at `pos` and `pos + capacity`), so the last N rows
+    are always one contiguous slice: appends are O(1) and `last(n)` is a zero-copy view.
+    Views are only valid until the next append; copy them if they must outlive it.
+    With `growable=True` the buffer doubles instead of overwriting its oldest row,
+    which keeps the full history at an amortised O(1) cost per row.
+    """
+
+    def __init__(self, capacity, num_columns=None, growable=False):
+        if capacity < 1:
+            raise ValueError("RingBuffer capacity must be at least 1")
+        self.capacity = int(capacity)
+        self.growable = growable
+        self.num_columns = None
+        self.column_names = []
+        self.total = 0  # Rows appended since creation (or the last clear)
+        self._size = 0
+        self._end = 0  # Slot that receives the next row
+        self._data = None
+        self._scratch = None
+        if num_columns is not None:
+            self._allocate(num_columns)
+
+    def _allocate(self, num_columns):
+        self.num_columns = int(num_columns)
+        self.column_names = column_names_for(self.num_columns)
+        self._data = np.empty((2 * self.capacity, self.num_columns), dtype=np.float64)
+        self._scratch = np.empty(self.num_columns, dtype=np.float64)
+
+    def _grow(self):
+        current = self.last()
+        self.capacity *= 2
+        data = np.empty((2 * self.capacity, self.num_columns), dtype=np.float64)
+        data[:self._size] = current
+        data[self.capacity:self.capacity + self._size] = current
+        self._data = data
+        self._end = self._size
+
+    def _commit(self, row):
+        if self._size == self.capacity and self.growable:
+            self._grow()
+        self._data[self._end] = row
+        self._data[self._end + self.capacity] = row
+        self._end = (self._end + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+        self.total += 1
+        return self._data[self._end - 1 + self.capacity]
+
+    def _check_width(self, width):
+        if self.num_columns is None:
+            self._allocate(width)
+        elif width != self.num_columns:
+            raise ValueError(f"Expected {self.num_columns} values per row, got {width}")
+
+    # Parse a comma-separated line straight into the preallocated scratch row and append it.
+    # Raises ValueError (and leaves the buffer untouched) if the line is malformed.
+    def append_csv(self, csv_data):
+        values = csv_data.split(',')
+        if self.num_columns is None:
+            return self.append(values)  # The first row sets the column count
+        self._check_width(len(values))
+        self._scratch[:] = values
+        return self._commit(self._scratch)
+
+    # Append one row of numeric values; returns a view of the stored row
+    def append(self, values):
+        row = np.asarray(values, dtype=np.float64).ravel()
+        self._check_width(row.shape[0])
+        return self._commit(row)
+
+    # Append several rows (2-D array-like) at once with block copies
+    def extend(self, rows):
+        rows = np.asarray(rows, dtype=np.float64)
+        if rows.ndim != 2:
+            raise ValueError("extend() expects a 2-D array of rows")
+        if len(rows) == 0:
+            return
+        self._check_width(rows.shape[1])
+        added = len(rows)
+        while self.growable and self._size + len(rows) > self.capacity:
+            self._grow()
+        rows = rows[-self.capacity:]  # Older rows would be overwritten anyway
+
+        n = len(rows)
+        first = min(n, self.capacity - self._end)
+        for offset in (0, self.capacity):
+            self._data[offset + self._end:offset + self._end + first] = rows[:first]
+            self._data[offset:offset + n - first] = rows[first:]
+        self._end = (self._end + n) % self.capacity
+        self._size = min(self._size + n, self.capacity)
+        self.total += added
+
+    # Zero-copy view of the last `n` rows (all buffered rows by default), oldest first
+    def last(self, n=None):
+        if self._data is None:
+            return np.empty((0, 0), dtype=np.float64)
+        n = self._size if n is None else max(0, min(int(n), self._size))
+        stop = self._end + self.capacity
+        return self._data[stop - n:stop]
+
+    # Copy of the last `n` rows as a DataFrame with the usual 'colN' names
+    def to_frame(self, n=None):
+        return pd.DataFrame(self.last(n).copy(), columns=self.column_names)
+
+    def is_full(self):
+        return self._size == self.capacity
+
+    def clear(self):
+        self._size = 0
+        self._end = 0
+        self.total = 0
+
+    def __len__(self):
+        return self._size
@@ -0,0 +1,90 @@
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+# Checkpoints: snapshots of the keyed state of an App (windows, fitted models, thresholds, counters) on local disk,
+# so that a restarted instance resumes where it stopped instead of collecting its initial rows and retraining again.
+# A snapshot is taken every time Faust commits the consumer offsets, and the commit interval is set to
+# CheckpointEverySeconds; the commit waits until the snapshot files are written, so the committed offsets never pass
+# the offsets saved with the state: after a restart the events between the two are read again and skipped (the
+# restored state already holds them).
+# The snapshots are incremental: each key has its own file, rewritten only when the key received events since.
+CheckpointPath = os.getenv('CheckpointPath', 'checkpoints')
+CheckpointEverySeconds = float(os.getenv('CheckpointEverySeconds', '0'))  # 0 disables checkpoints
+
+
+# Function to read an attribute given as a dotted name (e.g. 'trainer.model')
+def _get(obj, field):
+    for name in field.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+
+# Function to take a snapshot of the `fields` of a state object (a dict of picklable values).
+# Helpers that hold files or threads (ResultSink, BackgroundTrainer, ModelStore) provide their own `checkpoint()`.
+def snapshot_fields(obj, fields):
+    snapshot = {}
+    for field in fields:
+        value = _get(obj, field)
+        snapshot[field] = value.checkpoint() if hasattr(value, 'checkpoint') else value
+    return snapshot
+
+
+# Function to put the values of a snapshot back into a new state object (helpers `restore()` their own part)
+def restore_fields(obj, snapshot):
+    for field, value in snapshot.items():
+        current = _get(obj, field)
+        if hasattr(current, 'checkpoint'):
+            current.restore(value)
+        else:
+            parent, _, name = field.rpartition('.')
+            setattr(_get(obj, parent) if parent else obj, name, value)
+
+
+class CheckpointStore:
+    """Folder of snapshot files, one per name, under CheckpointPath/<instance name>.
+
+    `save` pickles a snapshot right away (so it is consistent) and writes it from a background thread to a
+    temporary file that is then renamed, so a crash never leaves a half-written snapshot behind. It returns the
+    future of the write, whose result is the size written (None when the write failed).
+    """
+
+    def __init__(self, name, root=None):
+        self.path = os.path.join(root or CheckpointPath, name)
+        os.makedirs(self.path, exist_ok=True)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint')
+
+    def filename(self, name):
+        return os.path.join(self.path, f"{name}.pkl")
+
+    # Folder for files saved next to the snapshots, that they refer to (e.g. ModelStore archives)
+    def folder(self, name):
+        return os.path.join(self.path, name)
+
+    # Queue a snapshot for writing; returns the future of the write (its size in bytes, None on failure)
+    def save(self, name, snapshot):
+        data = pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+        return self._writer.submit(self._write, self.filename(name), data)
+
+    # Read a snapshot (None when there is none)
+    def load(self, name):
+        try:
+            with open(self.filename(name), 'rb') as file:
+                return pickle.load(file)
+        except FileNotFoundError:
+            return None
+
+    # Wait for the queued writes
+    def close(self):
+        self._writer.shutdown(wait=True)
+
+    def _write(self, filename, data):
+        temporary = os.path.join(self.path, '.' + os.path.basename(filename) + '.tmp')
+        try:
+            with open(temporary, 'wb') as file:
+                file.write(data)
+            os.replace(temporary, filename)
+        except OSError as e:
+            print(f"Error writing checkpoint {filename}: {e}")
+            return None
+        return len(data)
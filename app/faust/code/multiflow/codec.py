@@ -0,0 +1,198 @@
+import json
+import os
+import struct
+
+import numpy as np
+from faust.serializers import codecs
+
+from multiflow.buffer import parse_csv_rows
+from multiflow.tracing import SequenceStamper, TraceEvents
+
+# Compact binary events: instead of JSON {"csv_data": "<comma-joined text>"}, a message can carry one or more rows as
+#   'rows'  - b'MFR1' + uint32 row count + uint32 column count + the values as little-endian float64, row by row;
+#   'arrow' - an Arrow IPC stream (one record batch, one float64 column per App column).
+# The 'multiflow' codec decodes both (and still accepts the legacy JSON messages) into {'rows': 2-D float64 array}
+# or the original dict, so an App only has to subscribe with value_serializer='multiflow' and use `event_rows`.
+
+ROWS_MAGIC = b'MFR1'
+ROWS_HEADER = struct.Struct('<4sII')
+ARROW_MAGIC = b'\xff\xff\xff\xff'  # Continuation marker that starts every Arrow IPC stream message
+EventFormat = os.getenv('EventFormat', 'rows')  # Format written by the producer helpers: 'rows', 'arrow' or 'csv'
+
+
+# Function to encode rows (2-D array-like) as one message in the given format
+def encode_rows(rows, format='rows'):
+    rows = np.asarray(rows, dtype=np.float64)
+    if rows.ndim == 1:
+        rows = rows.reshape(1, -1)
+    if format == 'rows':
+        return ROWS_HEADER.pack(ROWS_MAGIC, rows.shape[0], rows.shape[1]) + rows.astype('<f8', copy=False).tobytes()
+    if format == 'arrow':
+        import pyarrow
+        import pyarrow.ipc
+        batch = pyarrow.record_batch([pyarrow.array(column) for column in rows.T], names=[f'col{i + 1}' for i in range(rows.shape[1])])
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, batch.schema) as writer:
+            writer.write_batch(batch)
+        return sink.getvalue().to_pybytes()
+    if format == 'csv':
+        if len(rows) != 1:
+            raise ValueError("The csv format carries one row per message")
+        return json.dumps({'csv_data': ','.join(map(repr, rows[0].tolist()))}).encode('utf-8')
+    raise ValueError(f"Unknown event format '{format}' (expected 'rows', 'arrow' or 'csv')")
+
+
+# Function to decode one message: {'rows': 2-D array} for binary messages, the JSON value otherwise
+def decode_event(data):
+    data = bytes(data)
+    if data[:4] == ROWS_MAGIC:
+        _, count, columns = ROWS_HEADER.unpack_from(data)
+        rows = np.frombuffer(data, dtype='<f8', count=count * columns, offset=ROWS_HEADER.size)
+        return {'rows': rows.reshape(count, columns)}
+    if data[:4] == ARROW_MAGIC:
+        import pyarrow.ipc
+        table = pyarrow.ipc.open_stream(data).read_all()
+        rows = np.column_stack([column.to_numpy(zero_copy_only=False) for column in table.columns]).astype(np.float64, copy=False)
+        return {'rows': rows}
+    return json.loads(data)
+
+
+class RowsCodec(codecs.Codec):
+    """Faust codec for binary row messages, falling back to JSON for everything else."""
+
+    def _dumps(self, obj):
+        if isinstance(obj, np.ndarray):
+            return encode_rows(obj, EventFormat if EventFormat != 'csv' else 'rows')
+        if isinstance(obj, dict) and isinstance(obj.get('rows'), np.ndarray):
+            return encode_rows(obj['rows'], EventFormat if EventFormat != 'csv' else 'rows')
+        return json.dumps(obj).encode('utf-8')
+
+    def _loads(self, s):
+        return decode_event(s)
+
+
+codecs.register('multiflow', RowsCodec())
+
+
+# Function to pick the partition of a message key the way the Kafka default partitioner does (murmur2 of the key),
+# so keyed messages land where a keyed App expects them (None when the partitions are not known)
+def key_partition(key, partitions):
+    if not key or None in partitions:
+        return None
+    from aiokafka.partitioner import DefaultPartitioner
+    return DefaultPartitioner()(key, list(partitions), list(partitions))
+
+
+# Function to turn a list of decoded events (binary rows and/or legacy csv_data) into one 2-D array, in arrival order.
+# Returns (rows, skipped) like parse_csv_rows; the column count is set by the first row unless given.
+def event_rows(events, num_columns=None):
+    blocks, skipped, lines = [], [], []
+
+    def flush_lines():
+        nonlocal num_columns
+        if lines:
+            rows, bad = parse_csv_rows(lines, num_columns)
+            skipped.extend(bad)
+            if len(rows):
+                num_columns = rows.shape[1]
+                blocks.append(rows)
+            lines.clear()
+
+    for event in events:
+        rows = event.get('rows') if isinstance(event, dict) else None
+        if rows is None:
+            lines.append(event.get('csv_data', '') if isinstance(event, dict) else str(event))
+            continue
+        flush_lines()
+        rows = np.asarray(rows, dtype=np.float64)
+        if rows.ndim == 1:
+            rows = rows.reshape(1, -1)
+        if num_columns is not None and rows.shape[1] != num_columns:
+            skipped.append(f"<binary rows with {rows.shape[1]} values, expected {num_columns}>")
+            continue
+        num_columns = rows.shape[1]
+        blocks.append(rows)
+    flush_lines()
+
+    if not blocks:
+        return np.empty((0, num_columns or 0)), skipped
+    return (blocks[0] if len(blocks) == 1 else np.concatenate(blocks)), skipped
+
+
+class RowProducer:
+    """Kafka producer of compact row messages (aiokafka, as used by Faust).
+
+    `send(rows, key)` queues one row or a 2-D array of rows of a stream key and publishes one message every
+    `rows_per_message` rows of that key in `format` ('rows', 'arrow', or 'csv' for the legacy JSON events);
+    `flush()` publishes what is left. Use it as `async with RowProducer(topic) as producer:`.
+    The key is the Kafka message key, so a keyed App keeps one state per key (see multiflow.keyed), and it picks the
+    partition of the messages, like the Kafka default partitioner. With `trace` (default TraceEvents) every message
+    gets the trace headers of multiflow.tracing, and the messages without a key are spread over the partitions of the
+    topic in turn (sequence numbers are counted per partition).
+    """
+
+    def __init__(self, topic, bootstrap_servers='localhost:9092', format=None, rows_per_message=100, trace=None):
+        self.topic = topic
+        self.bootstrap_servers = bootstrap_servers
+        self.format = format or EventFormat
+        if self.format not in ('rows', 'arrow', 'csv'):
+            raise ValueError(f"Unknown event format '{self.format}' (expected 'rows', 'arrow' or 'csv')")
+        self.rows_per_message = 1 if self.format == 'csv' else max(1, int(rows_per_message))
+        self.rows_sent = 0
+        self.messages_sent = 0
+        self._pending = {}  # key: (arrays of rows, row count) not published yet
+        self._producer = None
+        self._stamper = SequenceStamper() if (TraceEvents if trace is None else trace) else None
+        self._partitions = [None]
+
+    async def start(self):
+        from aiokafka import AIOKafkaProducer
+        self._producer = AIOKafkaProducer(bootstrap_servers=self.bootstrap_servers)
+        await self._producer.start()
+        self._partitions = sorted(await self._producer.partitions_for(self.topic) or [0])
+
+    # Queue rows (one row or a 2-D array) of a stream key (str or bytes, None for none); full messages are
+    # published right away
+    async def send(self, rows, key=None):
+        key = key.encode('utf-8') if isinstance(key, str) else key
+        rows = np.asarray(rows, dtype=np.float64)
+        blocks, count = self._pending.get(key, ([], 0))
+        blocks.append(rows.reshape(1, -1) if rows.ndim == 1 else rows)
+        self._pending[key] = (blocks, count + len(blocks[-1]))
+        if self._pending[key][1] >= self.rows_per_message:
+            await self._flush_key(key, whole_messages_only=True)
+
+    # Publish the queued rows (only complete messages if `whole_messages_only`)
+    async def flush(self, whole_messages_only=False):
+        for key in list(self._pending):
+            await self._flush_key(key, whole_messages_only)
+
+    async def _flush_key(self, key, whole_messages_only):
+        blocks, _ = self._pending.pop(key)
+        rows = np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+        end = len(rows) - len(rows) % self.rows_per_message if whole_messages_only else len(rows)
+        for start in range(0, end, self.rows_per_message):
+            value = encode_rows(rows[start:min(start + self.rows_per_message, end)], self.format)
+            if key is not None:
+                partition = key_partition(key, self._partitions)
+            elif self._stamper is not None:
+                partition = self._partitions[self.messages_sent % len(self._partitions)]
+            else:
+                partition = None
+            headers = self._stamper.headers(self.topic, partition) if self._stamper is not None else None
+            await self._producer.send(self.topic, value, key=key, partition=partition, headers=headers)
+            self.messages_sent += 1
+        self.rows_sent += end
+        if end < len(rows):
+            self._pending[key] = ([rows[end:]], len(rows) - end)
+
+    async def stop(self):
+        await self.flush()
+        await self._producer.stop()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
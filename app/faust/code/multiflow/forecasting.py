@@ -0,0 +1,142 @@
+import os
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Lightweight forecasters for the Chronos App, computed with NumPy for all the items (columns) of a long-format
+# series at once, as an alternative to fitting an AutoGluon neural model.
+# They follow the predictor interface of detect_anomalies_streaming_with_dataframe (the one of AutoGluon's
+# TimeSeriesPredictor): `fit(train_data)` on a long frame indexed by (item_id, timestamp), then `predict(data)`
+# returns the next `prediction_length` steps of every item after the end of `data`, indexed by (item_id, timestamp),
+# with the columns 'mean', '0.1' and '0.9'. Each item is forecast on its own grid (the spacing of its last two
+# timestamps), so every row of the horizon gets a forecast. The 0.1/0.9 band is the mean plus the 0.1/0.9 quantiles
+# of the in-sample one-step residuals of the item, widened with the horizon as the forecast variance grows.
+ForecastSeason = int(os.getenv('ForecastSeason', '1'))  # Season length in rows of 'seasonal_naive' (1: last value)
+ForecastOrder = int(os.getenv('ForecastOrder', '5'))  # Lags of 'ar'
+
+FORECAST_METHODS = ('seasonal_naive', 'ets', 'ar')
+SMOOTHING_GRID = np.linspace(0.05, 1.0, 20)  # Smoothing factors tried by 'ets'
+
+
+# Function to turn a long (item_id, timestamp) frame into one row of values per item, in timestamp order.
+# Returns the item names, the values (items x timestamps), and the last timestamp and step (ns) of every item;
+# all items must have the same number of timestamps (as in the Chronos window, made of complete rows).
+def long_to_matrix(data):
+    codes, items = pd.factorize(data.index.get_level_values("item_id"), sort=True)
+    timestamps = pd.DatetimeIndex(data.index.get_level_values("timestamp")).as_unit('ns').asi8
+    counts = np.bincount(codes, minlength=len(items))
+    if len(items) == 0 or (counts != counts[0]).any():
+        raise ValueError("Every item must have the same number of timestamps")
+    order = np.lexsort((timestamps, codes))
+    values = data["target"].to_numpy(dtype=np.float64)[order].reshape(len(items), -1)
+    timestamps = timestamps[order].reshape(len(items), -1)
+    steps = timestamps[:, -1] - timestamps[:, -2] if timestamps.shape[1] > 1 else np.full(len(items), 60 * 10**9)
+    return np.asarray(items, dtype=object), values, timestamps[:, -1], steps
+
+
+class NumpyForecaster:
+    """Forecaster of several series at once, with residual-quantile bands.
+
+    `method` is one of:
+      * 'seasonal_naive' - the value of the same step `season` rows earlier (`season=1`: the last value);
+      * 'ets' - simple exponential smoothing, with the smoothing factor of each item picked on the training data;
+      * 'ar' - autoregressive model of `order` lags with an intercept, least squares per item.
+    Parameters and residual quantiles are fitted by `fit`; `predict` applies them to the latest values of `data`.
+    """
+
+    def __init__(self, method='ets', prediction_length=1, season=None, order=None, quantiles=(0.1, 0.9)):
+        if method not in FORECAST_METHODS:
+            raise ValueError(f"Unknown forecast method '{method}' (expected {', '.join(FORECAST_METHODS)})")
+        self.method = method
+        self.prediction_length = int(prediction_length)
+        self.season = max(1, int(season or ForecastSeason))
+        self.order = max(1, int(order or ForecastOrder))
+        self.quantiles = tuple(quantiles)
+        self.items = None
+        self.params = None  # Per item: smoothing factors ('ets') or AR coefficients ('ar')
+        self.residual_quantiles = None  # items x quantiles
+
+    # Fit the parameters and residual quantiles of every item on a long (item_id, timestamp) frame
+    def fit(self, train_data, **kwargs):
+        self.items, values, _, _ = long_to_matrix(train_data)
+        if self.method == 'seasonal_naive':
+            if values.shape[1] <= self.season:
+                raise ValueError(f"'seasonal_naive' needs more than {self.season} timestamps per item")
+            residuals = values[:, self.season:] - values[:, :-self.season]
+        elif self.method == 'ets':
+            self.params, residuals = self._fit_smoothing(values)
+        else:
+            self.params, residuals = self._fit_autoregressive(values)
+        self.residual_quantiles = np.nanquantile(residuals, self.quantiles, axis=1).T
+        return self
+
+    # Forecast the next prediction_length steps of every item after the end of `data`
+    def predict(self, data, **kwargs):
+        if self.residual_quantiles is None:
+            raise ValueError("The forecaster is not fitted")
+        items, values, last, steps = long_to_matrix(data)
+        fitted = {item: position for position, item in enumerate(self.items)}
+        positions = np.array([fitted[item] for item in items])  # KeyError for an item that was not fitted
+        horizon = np.arange(self.prediction_length)
+
+        if self.method == 'seasonal_naive':
+            mean = values[:, values.shape[1] - self.season + horizon % self.season]
+            spread = np.sqrt(horizon // self.season + 1.0)[np.newaxis, :]
+        elif self.method == 'ets':
+            alphas = self.params[positions]
+            # Level after the last value: exponentially decaying weights of the values (the first one starts the level)
+            ages = np.arange(values.shape[1] - 1, -1, -1)
+            weights = alphas[:, np.newaxis] * (1.0 - alphas[:, np.newaxis]) ** ages
+            weights[:, 0] = (1.0 - alphas) ** (values.shape[1] - 1)
+            mean = np.repeat((weights * values).sum(axis=1, keepdims=True), self.prediction_length, axis=1)
+            spread = np.sqrt(1.0 + horizon[np.newaxis, :] * alphas[:, np.newaxis] ** 2)
+        else:
+            mean, spread = self._forecast_autoregressive(values, self.params[positions])
+
+        quantiles = self.residual_quantiles[positions]
+        timestamps = last[:, np.newaxis] + steps[:, np.newaxis] * (horizon + 1)
+        index = pd.MultiIndex.from_arrays([np.repeat(items, self.prediction_length), pd.DatetimeIndex(timestamps.reshape(-1))],
+                                          names=["item_id", "timestamp"])
+        predictions = {"mean": mean.reshape(-1)}
+        for column, quantile in enumerate(self.quantiles):
+            predictions[str(quantile)] = (mean + quantiles[:, column:column + 1] * spread).reshape(-1)
+        return pd.DataFrame(predictions, index=index)
+
+    # Smoothing factor of every item (lowest sum of squared one-step errors on the grid) and its one-step errors
+    def _fit_smoothing(self, values):
+        alphas = SMOOTHING_GRID[np.newaxis, :]
+        level = np.repeat(values[:, :1], len(SMOOTHING_GRID), axis=1)  # items x grid
+        errors = np.empty((values.shape[0], len(SMOOTHING_GRID), values.shape[1] - 1))
+        for t in range(1, values.shape[1]):
+            error = values[:, t:t + 1] - level
+            errors[:, :, t - 1] = error
+            level = level + alphas * error
+        best = np.argmin((errors ** 2).sum(axis=2), axis=1)
+        return SMOOTHING_GRID[best], errors[np.arange(len(best)), best]
+
+    # AR coefficients of every item (intercept, then the lags from the oldest to the most recent) and the residuals
+    def _fit_autoregressive(self, values):
+        if values.shape[1] <= 2 * self.order:
+            raise ValueError(f"'ar' needs more than {2 * self.order} timestamps per item")
+        windows = sliding_window_view(values, self.order + 1, axis=1)  # items x samples x (lags + target)
+        features = np.concatenate([np.ones(windows.shape[:2] + (1,)), windows[:, :, :-1]], axis=2)
+        targets = windows[:, :, -1]
+        gram = np.einsum('isk,isl->ikl', features, features) + 1e-8 * np.eye(self.order + 1)
+        coefficients = np.linalg.solve(gram, np.einsum('isk,is->ik', features, targets)[:, :, np.newaxis])[:, :, 0]
+        return coefficients, targets - np.einsum('isk,ik->is', features, coefficients)
+
+    # Recursive AR forecast of every item, and the band spread of each step (from the impulse response)
+    def _forecast_autoregressive(self, values, coefficients):
+        history = values[:, -self.order:].copy()
+        mean = np.empty((values.shape[0], self.prediction_length))
+        for step in range(self.prediction_length):
+            mean[:, step] = coefficients[:, 0] + (history * coefficients[:, 1:]).sum(axis=1)
+            history = np.concatenate([history[:, 1:], mean[:, step:step + 1]], axis=1)
+        lags = coefficients[:, :0:-1]  # Most recent lag first
+        impulse = np.zeros((values.shape[0], self.prediction_length))
+        impulse[:, 0] = 1.0
+        for step in range(1, self.prediction_length):
+            recent = impulse[:, max(0, step - self.order):step][:, ::-1]
+            impulse[:, step] = (recent * lags[:, :recent.shape[1]]).sum(axis=1)
+        return mean, np.sqrt(np.cumsum(impulse ** 2, axis=1))
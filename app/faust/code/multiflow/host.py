@@ -0,0 +1,252 @@
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+# Multi-detector host: one App consumes and parses a stream topic once, and fans the parsed rows out to several
+# detector pipelines running in the same process. A pipeline is one of the detector Apps (e.g.
+# OutlierDetection_DynamicIQRMethod) loaded as its own module with its own settings, so it keeps its own
+# parameters, state, sinks and metrics; its agent function reads the shared rows instead of a Kafka stream.
+# Pipelines are given as JSON specs, {"name": "iqr-fast", "app": "OutlierDetection_DynamicIQRMethod",
+# "env": {"UpdateInterval": "10"}}, and can be added or removed while the host runs (GET/POST /pipelines/,
+# DELETE /pipelines/<name>/ on the host web port).
+# The settings read by the multiflow helpers themselves (BatchMaxEvents, ResultFormat, ...) are the host's.
+# Pipelines are not checkpointed: the host commits the offsets of the rows it queued, not of the rows a pipeline
+# has processed, so a pipeline snapshot could never match the committed offsets. A restarted host starts its
+# pipelines cold.
+PipelineQueueSize = int(os.getenv('PipelineQueueSize', '100'))  # Batches a pipeline may fall behind before ingest waits
+
+
+# Function to run code with extra environment variables (the Apps read their settings when imported)
+@contextmanager
+def environment(env):
+    saved = dict(os.environ)
+    os.environ.update({name: str(value) for name, value in env.items()})
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+# Function to import a fresh copy of an App module under another name (its module state is not shared)
+def load_app_module(app_name, module_name, env):
+    spec = importlib.util.find_spec(app_name)
+    if spec is None or spec.origin is None:
+        raise ValueError(f"App '{app_name}' not found")
+    module = importlib.util.module_from_spec(importlib.util.spec_from_file_location(module_name, spec.origin))
+    sys.modules[module_name] = module  # Lets background fits in worker processes pickle the App functions
+    try:
+        with environment(env):
+            module.__spec__.loader.exec_module(module)
+    except BaseException:
+        sys.modules.pop(module_name, None)
+        raise
+    return module
+
+
+# Function to tell whether this code runs inside the event loop
+def _loop_running():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class PipelineStream:
+    """The part of a Faust stream the detector agents use: async iteration, `events()` and their micro-batches.
+
+    The queue holds (key, partition, value) items; events have the `key`, `value` and `message.tp` of Faust events.
+    """
+
+    def __init__(self, maxsize=PipelineQueueSize):
+        self.queue = asyncio.Queue(maxsize)
+
+    def __aiter__(self):
+        return self._items(lambda key, tp, value: value)
+
+    def events(self):
+        return self._items(_event)
+
+    # Batches of up to `max_events` values / events: whatever is queued once the first one arrived
+    def take(self, max_events, within=None):
+        return self._batches(max_events, lambda key, tp, value: value)
+
+    def take_events(self, max_events, within=None):
+        return self._batches(max_events, _event)
+
+    async def _items(self, wrap):
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            yield wrap(*item)
+
+    async def _batches(self, max_events, wrap):
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            batch = [wrap(*item)]
+            while len(batch) < max_events and not self.queue.empty():
+                item = self.queue.get_nowait()
+                if item is None:
+                    yield batch
+                    return
+                batch.append(wrap(*item))
+            yield batch
+
+
+# Function to build a Faust-like event for a PipelineStream item
+def _event(key, tp, value):
+    return SimpleNamespace(key=key, value=value, message=SimpleNamespace(tp=tp, offset=None))
+
+
+class Pipeline:
+    """One detector App running inside the host, fed through a PipelineStream."""
+
+    def __init__(self, name, app, env=None, agent=None):
+        self.name = name
+        self.app_name = app
+        self.env = {'Name': name, 'OutputFileName': name, **(env or {})}
+        self.module = load_app_module(app, f'pipeline_{name}', self.env)
+        agents = self.module.app.agents
+        self.agent = agents[agent] if agent else next(iter(agents.values()))
+        keyed_state = getattr(self.module, 'keyed_state', None)
+        if keyed_state is not None and keyed_state.checkpoints is not None:  # No checkpoints in a host (see above)
+            keyed_state.checkpoints.close()
+            try:
+                os.rmdir(keyed_state.checkpoints.path)  # Created empty by KeyedState.attach
+            except OSError:
+                pass
+            keyed_state.checkpoints = None
+        self.metrics = getattr(self.module, 'app_metrics', None)
+        self.stream = PipelineStream()
+        self.task = None
+        self.started = time.time()
+        self.rows = 0
+        self.error = None
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.agent.fun(self.stream))
+        self.task.add_done_callback(self._done)
+
+    def _done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            self.error = repr(task.exception())
+            print(f"Pipeline {self.name} stopped with an error: {self.error}")
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    # Queue one event (waits while the pipeline is PipelineQueueSize events behind)
+    async def put(self, event, rows, key=None, tp=None):
+        if self.running:
+            await self.stream.queue.put((key, tp, event))
+            self.rows += rows
+            if self.metrics is not None:
+                self.metrics.inc('multiflow_events_total')
+
+    # Let the pipeline finish the queued events, then flush and close its sinks and trainers
+    async def stop(self):
+        if self.running:
+            await self.stream.queue.put(None)
+            await asyncio.wait([self.task])
+        await self.module.app.on_before_shutdown.send()
+        sys.modules.pop(self.module.__name__, None)
+
+    def describe(self):
+        return {'name': self.name, 'app': self.app_name, 'env': self.env, 'running': self.running, 'rows': self.rows,
+                'queued': self.stream.queue.qsize(), 'uptime_seconds': time.time() - self.started, 'error': self.error}
+
+
+class PipelineHost:
+    """The pipelines of a host App: `fan_out` sends each parsed batch to all of them."""
+
+    def __init__(self):
+        self.pipelines = {}
+
+    # Add a pipeline from its spec ({'name', 'app', 'env', optional 'agent'}); it starts right away when the
+    # event loop runs, or with the first batch for the pipelines added while the App module is imported
+    def add(self, spec):
+        name = spec.get('name') or spec.get('app')
+        if not name or not spec.get('app'):
+            raise ValueError("A pipeline needs an 'app' (and a unique 'name')")
+        if name in self.pipelines:
+            raise ValueError(f"Pipeline '{name}' already exists")
+        pipeline = Pipeline(name, spec['app'], spec.get('env'), spec.get('agent'))
+        self.pipelines[name] = pipeline
+        if _loop_running():
+            pipeline.start()
+        print(f"Pipeline {name} added ({spec['app']})")
+        return pipeline
+
+    async def remove(self, name):
+        pipeline = self.pipelines.pop(name)
+        await pipeline.stop()
+        print(f"Pipeline {name} removed")
+
+    # Send one batch of rows of a key (read-only, shared by all pipelines) to every running pipeline
+    async def fan_out(self, rows, key=None, tp=None):
+        rows.flags.writeable = False
+        event = {'rows': rows}
+        for pipeline in list(self.pipelines.values()):
+            if pipeline.task is None:
+                pipeline.start()
+            await pipeline.put(event, len(rows), key, tp)
+
+    # Metrics registries of the pipelines, rendered with the host's own
+    def metrics(self):
+        return [pipeline.metrics for pipeline in self.pipelines.values() if pipeline.metrics is not None]
+
+    # Add the pipelines from a JSON list of specs (or a file holding it)
+    def add_from(self, specs):
+        if specs and not specs.lstrip().startswith('['):
+            with open(specs) as file:
+                specs = file.read()
+        for spec in json.loads(specs or '[]'):
+            self.add(spec)
+
+    # Add the pipeline routes to the App's web server and stop the pipelines when it shuts down
+    def attach(self, app):
+        from faust import web
+
+        host = self
+
+        @app.page('/pipelines/')
+        class PipelinesView(web.View):
+            async def get(self, request):
+                return self.json([pipeline.describe() for pipeline in host.pipelines.values()])
+
+            async def post(self, request):
+                try:
+                    pipeline = host.add(await request.json())
+                except Exception as e:
+                    return self.json({'error': str(e)}, status=400)
+                return self.json(pipeline.describe())
+
+        @app.page('/pipelines/{name}/')
+        class PipelineView(web.View):
+            async def get(self, request, name):
+                if name not in host.pipelines:
+                    return self.json({'error': f"No pipeline '{name}'"}, status=404)
+                return self.json(host.pipelines[name].describe())
+
+            async def delete(self, request, name):
+                if name not in host.pipelines:
+                    return self.json({'error': f"No pipeline '{name}'"}, status=404)
+                await host.remove(name)
+                return self.json({'removed': name})
+
+        @app.on_before_shutdown.connect
+        async def stop_pipelines(app, **kwargs):
+            for name in list(host.pipelines):
+                await host.remove(name)
+
+        return stop_pipelines
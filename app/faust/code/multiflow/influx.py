@@ -0,0 +1,288 @@
+import asyncio
+import atexit
+import gzip
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import deque
+
+import numpy as np
+
+from multiflow.tracing import current_trace
+
+# InfluxDB connection, shared by every App (same variables the Apps already use)
+influxdb_url = os.getenv('INFLUXDB_URL', 'http://influxdb_server:8086')
+influxdb_token = os.getenv('INFLUXDB_TOKEN', 'admin')
+influxdb_org = os.getenv('INFLUXDB_ORG', 'multiflow')
+influxdb_bucket = os.getenv('INFLUXDB_BUCKET', 'faust_app')
+
+# Batching and backpressure settings of the sink
+InfluxBatchSize = int(os.getenv('InfluxBatchSize', '500'))  # Lines per HTTP write
+InfluxFlushIntervalMs = float(os.getenv('InfluxFlushIntervalMs', '1000'))  # Max time a line waits before being sent
+InfluxMaxPending = int(os.getenv('InfluxMaxPending', '50000'))  # Lines buffered before the oldest are dropped
+InfluxMaxRetries = int(os.getenv('InfluxMaxRetries', '5'))  # Retries of a failed write before it is dropped
+
+
+# Functions to escape names and values as required by the InfluxDB line protocol
+def escape_measurement(name):
+    return str(name).replace('\\', '\\\\').replace(',', '\\,').replace(' ', '\\ ')
+
+
+def escape_key(name):
+    return escape_measurement(name).replace('=', '\\=')
+
+
+# Function to build line protocol from a 2-D array of float fields.
+# `tags` maps tag names to a single value or one value per row; `timestamps` are integer nanoseconds.
+# Non-finite values (NaN/inf) are not valid field values, so they are left out of their line.
+def build_lines(measurement, rows, column_names, tags=None, timestamps=None):
+    rows = np.asarray(rows, dtype=np.float64)
+    if rows.ndim == 1:
+        rows = rows.reshape(1, -1)
+    n = len(rows)
+    if n == 0:
+        return []
+
+    prefix = np.full(n, escape_measurement(measurement), dtype=object)
+    for tag, values in (tags or {}).items():
+        if isinstance(values, str) or np.ndim(values) == 0:
+            values = np.full(n, values, dtype=object)
+        tag_values = np.array([escape_key(value) for value in values], dtype=object)
+        prefix = prefix + f',{escape_key(tag)}=' + tag_values
+
+    keys = [escape_key(column) + '=' for column in column_names]
+    text = rows.astype(str).astype(object)
+    finite = np.isfinite(rows)
+    fields = np.full(n, '', dtype=object)
+    if finite.all():
+        for i, key in enumerate(keys):
+            fields = fields + (',' if i else '') + key + text[:, i]
+    else:
+        for r in range(n):
+            fields[r] = ','.join(key + value for key, value, ok in zip(keys, text[r], finite[r]) if ok)
+
+    lines = prefix + ' ' + fields
+    if timestamps is not None:
+        lines = lines + ' ' + np.asarray(timestamps, dtype=np.int64).astype(str).astype(object)
+    return [line for line, row_ok in zip(lines.tolist(), finite.any(axis=1)) if row_ok]
+
+
+class InfluxSink:
+    """Asynchronous, batching writer for InfluxDB v2.
+
+    `write_rows` only builds line protocol and queues it; a background thread sends the
+    queued lines in batches of `batch_size` (or every `flush_interval_ms`) to /api/v2/write.
+    Failed writes are retried with jittered exponential backoff. Writers never wait: when more
+    than `max_pending` lines are waiting, the oldest are dropped (and counted), so memory stays
+    bounded and an InfluxDB outage does not stall the Faust event loop.
+    Every row gets its own nanosecond timestamp so rows written together stay distinct points.
+    Rows written while an agent processes a traced batch report their latency once they are written.
+    """
+
+    def __init__(self, url=None, token=None, org=None, bucket=None, batch_size=None, flush_interval_ms=None,
+                 max_pending=None, max_retries=None, backoff_base=0.5, backoff_max=30.0, timeout=10.0, compress=True):
+        self.url = (url or influxdb_url).rstrip('/')
+        self.token = token or influxdb_token
+        self.org = org or influxdb_org
+        self.bucket = bucket or influxdb_bucket
+        self.batch_size = batch_size or InfluxBatchSize
+        self.flush_interval = (flush_interval_ms if flush_interval_ms is not None else InfluxFlushIntervalMs) / 1000.0
+        self.max_pending = max_pending or InfluxMaxPending
+        self.max_retries = InfluxMaxRetries if max_retries is None else max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.compress = compress
+
+        # Counters (read them for monitoring)
+        self.written = 0
+        self.dropped = 0
+        self.retries = 0
+        self.last_error = None
+
+        self._lines = deque()
+        self._traces = deque()  # (lines queued up to the trace's rows, TraceMark, queued at ns)
+        self._queued = 0  # Lines queued since the start
+        self._taken = 0  # Lines taken by the thread (or dropped) since the start
+        self._oldest = 0.0  # When the oldest queued line was queued
+        self._in_flight = 0
+        self._last_timestamp = 0
+        self._closed = False
+        self._flush_requested = False
+        self._overflowing = False  # Dropping lines since the queue last had room
+        self._condition = threading.Condition()
+        self._thread = None
+        self._write_url = self.url + '/api/v2/write?' + urllib.parse.urlencode(
+            {'org': self.org, 'bucket': self.bucket, 'precision': 'ns'})
+        atexit.register(self.close)
+
+    # Number of lines queued or being written
+    @property
+    def pending(self):
+        return len(self._lines) + self._in_flight
+
+    # Function to give each of `n` rows a distinct, increasing nanosecond timestamp
+    def _timestamps(self, n):
+        with self._condition:
+            start = max(time.time_ns(), self._last_timestamp + 1)
+            self._last_timestamp = start + n - 1
+        return np.arange(start, start + n, dtype=np.int64)
+
+    # Queue rows of float fields (2-D array-like) with optional tags
+    def write_rows(self, measurement, rows, column_names, tags=None, timestamps=None):
+        rows = np.asarray(rows, dtype=np.float64)
+        if rows.ndim == 1:
+            rows = rows.reshape(1, -1)
+        if timestamps is None:
+            timestamps = self._timestamps(len(rows))
+        self.write_lines(build_lines(measurement, rows, column_names, tags=tags, timestamps=timestamps), current_trace.get())
+        return len(rows)
+
+    # Queue already formatted line protocol without waiting; past `max_pending` the oldest lines are dropped.
+    # `trace` (a TraceMark) is told when the last of these lines is written.
+    def write_lines(self, lines, trace=None):
+        if not lines:
+            return
+        if self._closed:
+            self.dropped += len(lines)
+            return
+        self._start()
+        with self._condition:
+            was_empty = not self._lines
+            if was_empty:
+                self._oldest = time.monotonic()
+            self._lines.extend(lines)
+            self._queued += len(lines)
+            if trace is not None:
+                if self._traces and self._traces[-1][1] is trace:  # More rows of the same batch
+                    self._traces[-1] = (self._queued, trace, self._traces[-1][2])
+                else:
+                    self._traces.append((self._queued, trace, time.time_ns()))
+            self._drop_overflow()
+            if was_empty or len(self._lines) >= self.batch_size:
+                self._condition.notify_all()
+
+    # Drop the oldest queued lines beyond `max_pending` (and the traces of their rows); called with the lock held
+    def _drop_overflow(self):
+        overflow = min(len(self._lines), len(self._lines) + self._in_flight - self.max_pending)
+        if overflow <= 0:
+            self._overflowing = False
+            return
+        for _ in range(overflow):
+            self._lines.popleft()
+        self._taken += overflow
+        self.dropped += overflow
+        while self._traces and self._traces[0][0] <= self._taken:
+            self._traces.popleft()
+        if not self._overflowing:
+            self._overflowing = True
+            print(f"InfluxDB queue full ({self.max_pending} lines), dropping the oldest lines; last error: {self.last_error}")
+
+    # Block until everything queued so far has been written (or dropped); returns False on timeout
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._flush_requested = True
+            self._condition.notify_all()
+            while self._lines or self._in_flight:
+                if self._thread is None or not self._thread.is_alive():
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._flush_requested = False
+                    return False
+                self._condition.wait(0.1 if remaining is None else min(0.1, remaining))
+            self._flush_requested = False
+        return not self._lines
+
+    # Flush and stop the background thread
+    def close(self, timeout=30.0):
+        if self._closed:
+            return
+        self.flush(timeout)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # Register a flush on the Faust App shutdown so buffered points are not lost on stop (in a thread, so a slow
+    # InfluxDB does not stall the event loop, which the other pipelines of a host keep using)
+    def attach(self, app):
+        @app.on_before_shutdown.connect
+        async def flush_influx_sink(app, **kwargs):
+            await asyncio.get_running_loop().run_in_executor(None, self.close)
+        return flush_influx_sink
+
+    def _start(self):
+        if self._thread is None:
+            with self._condition:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='influx-sink', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and not self._flush_requested and len(self._lines) < self.batch_size:
+                    if not self._lines:
+                        self._condition.wait()
+                        continue
+                    remaining = self._oldest + self.flush_interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if not self._lines:
+                    if self._closed:
+                        return
+                    continue
+                batch = [self._lines.popleft() for _ in range(min(self.batch_size, len(self._lines)))]
+                self._in_flight = len(batch)
+                self._oldest = time.monotonic()
+                self._taken += len(batch)
+                traces = []
+                while self._traces and self._traces[0][0] <= self._taken:
+                    traces.append(self._traces.popleft())
+
+            sent = self._send(batch)
+            if sent:
+                for _, trace, queued in traces:
+                    trace.written('influx', queued)
+
+            with self._condition:
+                self._in_flight = 0
+                self._condition.notify_all()
+
+    # Function to POST one batch, retrying transient failures with jittered exponential backoff
+    def _send(self, batch):
+        body = '\n'.join(batch).encode('utf-8')
+        headers = {'Authorization': f'Token {self.token}', 'Content-Type': 'text/plain; charset=utf-8'}
+        if self.compress:
+            body = gzip.compress(body)
+            headers['Content-Encoding'] = 'gzip'
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                request = urllib.request.Request(self._write_url, data=body, headers=headers, method='POST')
+                with urllib.request.urlopen(request, timeout=self.timeout):
+                    pass
+                self.written += len(batch)
+                return True
+            except urllib.error.HTTPError as e:
+                self.last_error = f"HTTP {e.code}: {e.read()[:200]!r}"
+                if e.code != 429 and e.code < 500:
+                    break  # The payload was rejected, retrying will not help
+            except (urllib.error.URLError, OSError) as e:
+                self.last_error = str(e)
+            if attempt < self.max_retries:
+                self.retries += 1
+                delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.5))
+
+        self.dropped += len(batch)
+        print(f"Error writing to InfluxDB, dropped {len(batch)} points: {self.last_error}")
+        return False
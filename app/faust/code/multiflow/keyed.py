@@ -0,0 +1,266 @@
+import os
+import re
+import time
+
+from multiflow.batching import BatchMaxEvents, BatchMaxLatencyMs
+from multiflow.checkpoint import CheckpointStore, CheckpointEverySeconds, snapshot_fields, restore_fields
+from multiflow.shedding import LoadShedder
+from multiflow.tracing import LatencyTracer, current_trace
+
+# Keyed state: instead of module globals, an App keeps one state object (window, model, thresholds, output file...)
+# per stream key, i.e. the sensor or stream ID of each message. The key is the `KeyField` field of a JSON event
+# (e.g. {"csv_data": "...", "key": "sensor-7"}) or else the Kafka message key; messages without a key share the
+# state of key None, which behaves exactly like the former globals.
+# Kafka sends all messages of a key to the same partition, so several workers of an App can share the partitions of
+# a topic: each one holds the state of the keys of its own partitions, and drops the keys of partitions it loses.
+KeyField = os.getenv('KeyField', 'key')
+
+_IDLE = object()  # Value of KeyedState.busy while no key is being processed (None is the key of keyless messages)
+
+
+# Function to read the key of a Faust event (None when the message has no key)
+def event_key(event):
+    value = event.value
+    if isinstance(value, dict) and value.get(KeyField) is not None:
+        return str(value[KeyField])
+    if event.key is None:
+        return None
+    return event.key.decode('utf-8', 'replace') if isinstance(event.key, bytes) else str(event.key)
+
+
+# Function to name the output of a key: `name` for key None, `name_<key>` otherwise (safe as a file name)
+def keyed_name(name, key):
+    return name if key is None else f"{name}_{re.sub(r'[^A-Za-z0-9_.-]', '_', key)}"
+
+
+# Async generator yielding (key, partition, events) from a Faust stream, in micro-batches like `micro_batches`
+# (`max_events` may also be a ReadLimit, which changes while the App sheds load):
+# the events of a batch are grouped by key and partition (keys without a partitioner, like key None, come from
+# several partitions), keeping their order within each group
+async def keyed_events(stream, max_events=None, max_latency_ms=None):
+    max_events = BatchMaxEvents if max_events is None else max_events
+    max_latency_ms = BatchMaxLatencyMs if max_latency_ms is None else max_latency_ms
+
+    if isinstance(max_events, int) and max_events <= 1:
+        async for event in stream.events():
+            yield event_key(event), event.message.tp, [event]
+    else:
+        async for events in stream.take_events(max_events, within=max_latency_ms / 1000.0):
+            groups = {}
+            for event in events:
+                groups.setdefault((event_key(event), event.message.tp), []).append(event)
+            for (key, tp), group in groups.items():
+                yield key, tp, group
+
+
+# Async generator yielding (key, partition, values) from a Faust stream (see `keyed_events`)
+async def keyed_batches(stream, max_events=None, max_latency_ms=None):
+    async for key, tp, events in keyed_events(stream, max_events, max_latency_ms):
+        yield key, tp, [event.value for event in events]
+
+
+class KeyedState:
+    """Local store of per-key state: `factory(key)` creates the state of a key when its first message arrives.
+
+    `batches(stream)` yields (state, values) per key and remembers the partitions of every key; after a rebalance,
+    the keys none of whose partitions are still assigned to this worker are dropped (their state's `close()` is
+    called). With checkpoints (CheckpointEverySeconds > 0) the `checkpoint_fields` of each state are saved with the
+    offset of the key's last event in each partition, and a new state is restored from its key's snapshot (the
+    events it already holds are skipped, partition by partition). A state may define `restored()`, called after a
+    restore.
+    The `shedder` (a LoadShedder configured from the environment by default) sheds events while the App is behind;
+    when it has a policy, events are read SheddingReadEvents at a time while it sheds, and scored `max_events` at a
+    time; while the App keeps up they are read `max_events` at a time, as without a policy.
+    The `tracer` (a LatencyTracer) measures the latency of traced events: the trace of the batch being processed is
+    in `current_trace` while the agent handles it, so the sinks can report when its rows are written.
+    """
+
+    def __init__(self, factory, checkpoints=None, shedder=None, tracer=None):
+        self.factory = factory
+        self.states = {}
+        self.partitions = {}  # Partitions each key was read from
+        self.offsets = {}  # {partition: offset of the last event} of each key
+        self.checkpoints = checkpoints  # CheckpointStore (created by `attach` when checkpoints are enabled)
+        self.restored_offsets = {}  # {partition: offset} of the restored keys: their events up to it are skipped
+        self.changed = set()  # Keys with events since their last snapshot
+        self.busy = _IDLE  # Key whose events the agent is processing (not saved until it is done)
+        self.shedder = shedder if shedder is not None else LoadShedder()
+        self.tracer = tracer if tracer is not None else LatencyTracer()
+
+        # Checkpoint metrics
+        self.snapshots = 0
+        self.last_snapshot_seconds = 0.0
+        self.last_snapshot_bytes = 0
+        self.restored_keys = 0
+        self.restore_seconds = 0.0
+
+    def __len__(self):
+        return len(self.states)
+
+    def __iter__(self):
+        return iter(list(self.states.values()))
+
+    # State of a key (created on first use)
+    def get(self, key, tp=None):
+        state = self.states.get(key)
+        if state is None:
+            state = self.states[key] = self.factory(key)
+            if self.checkpoints is not None:
+                try:
+                    self._restore(key, state)
+                except Exception as e:
+                    print(f"Could not restore the state of key {key} from {self.checkpoints.path} ({e!r}), starting it cold")
+                    self.offsets.pop(key, None)
+                    self.restored_offsets.pop(key, None)
+                    if hasattr(state, 'close'):
+                        state.close()
+                    state = self.states[key] = self.factory(key)
+            if key is not None:
+                print(f"New state for key {key}")
+        if tp is not None:
+            self.partitions.setdefault(key, set()).add(tp)
+        return state
+
+    # Async generator yielding (state of the key, values of the key) from a Faust stream
+    async def batches(self, stream, max_events=None, max_latency_ms=None):
+        max_events = BatchMaxEvents if max_events is None else max_events
+        shedder = self.shedder
+        read_events = shedder.read_limit(max_events) if shedder.enabled else max_events
+        async for key, tp, events in keyed_events(stream, read_events, max_latency_ms):
+            self.tracer.consumed(events)
+            state = self.get(key, tp)
+            if key in self.restored_offsets:
+                events = self._skip_restored(key, tp, events)
+                if not events:
+                    continue
+            last_offset = events[-1].message.offset
+            chunks = [events]
+            if shedder.enabled:
+                shedder.update(events)
+                chunks = shedder.chunks(shedder.shed(events), max_events)
+            for chunk in chunks:
+                self.busy = key
+                current_trace.set(self.tracer.mark(chunk))
+                yield state, [event.value for event in chunk]
+                current_trace.set(None)
+                self.busy = _IDLE
+                self.changed.add(key)
+                if chunk[-1].message.offset is not None:
+                    self.offsets.setdefault(key, {})[tp] = chunk[-1].message.offset
+            if last_offset is not None:
+                self.offsets.setdefault(key, {})[tp] = last_offset  # Shed events are not replayed on restore either
+
+    # Save the state of every key changed since its last snapshot (the key being processed keeps its previous one).
+    # Returns once the snapshot files are written, so the offsets Faust commits next are never ahead of them.
+    def checkpoint(self):
+        if self.checkpoints is None or not self.changed:
+            return
+        started = time.perf_counter()
+        writes = {key: self._save(key) for key in list(self.changed) if key != self.busy}
+        size = 0
+        for key, write in writes.items():
+            written = write.result()
+            if written is None:
+                self.changed.add(key)  # Saved again with the next checkpoint
+            else:
+                size += written
+        self.snapshots += 1
+        self.last_snapshot_seconds = time.perf_counter() - started
+        self.last_snapshot_bytes = size
+
+    # Close and forget the state of a key (saving it first, so the worker that gets its partition may resume it)
+    def drop(self, key):
+        if key in self.changed and key != self.busy and self.checkpoints is not None:
+            self._save(key).result()
+        state = self.states.pop(key)
+        self.partitions.pop(key, None)
+        self.offsets.pop(key, None)
+        self.restored_offsets.pop(key, None)
+        self.changed.discard(key)
+        if hasattr(state, 'close'):
+            state.close()
+        if key is not None:
+            print(f"State of key {key} dropped")
+
+    def close(self):
+        for key in list(self.states):
+            self.drop(key)
+        if self.checkpoints is not None:
+            self.checkpoints.close()
+
+    # Drop the keys of partitions moved to another worker, and close every state when the App stops.
+    # With checkpoints, the state is saved on every offset commit, committed every CheckpointEverySeconds.
+    def attach(self, app):
+        @app.on_partitions_assigned.connect
+        async def drop_unassigned_keys(app, assigned, **kwargs):
+            for key, tps in list(self.partitions.items()):
+                if not tps & set(assigned):
+                    self.drop(key)
+                    continue
+                for tp in tps - set(assigned):  # The key keeps its other partitions; these are read elsewhere now
+                    tps.discard(tp)
+                    self.offsets.get(key, {}).pop(tp, None)
+                    self.restored_offsets.get(key, {}).pop(tuple(tp), None)
+
+        @app.on_before_shutdown.connect
+        async def close_keyed_state(app, **kwargs):
+            self.close()
+
+        self.shedder.attach(app)
+        self.tracer.attach(app)
+
+        if CheckpointEverySeconds > 0 and self.checkpoints is None and hasattr(self.factory, 'checkpoint_fields'):
+            from faust.sensors import Sensor
+
+            keyed_state = self
+
+            class CheckpointSensor(Sensor):
+                def on_commit_initiated(self, consumer):
+                    keyed_state.checkpoint()
+
+            self.checkpoints = CheckpointStore(app.conf.id)
+            app.conf.broker_commit_interval = CheckpointEverySeconds
+            app.sensors.add(CheckpointSensor())
+
+        return drop_unassigned_keys
+
+    def _save(self, key):
+        state = self.states[key]
+        offsets = {None if tp is None else tuple(tp): offset for tp, offset in self.offsets.get(key, {}).items()}
+        snapshot = {'key': key, 'offsets': offsets, 'fields': snapshot_fields(state, state.checkpoint_fields)}
+        self.changed.discard(key)
+        return self.checkpoints.save(keyed_name('state', key), snapshot)
+
+    def _restore(self, key, state):
+        started = time.perf_counter()
+        snapshot = self.checkpoints.load(keyed_name('state', key))
+        if snapshot is None or snapshot['key'] != key:
+            return
+        restore_fields(state, snapshot['fields'])
+        if hasattr(state, 'restored'):
+            state.restored()
+        offsets = {partition: offset for partition, offset in snapshot['offsets'].items() if offset is not None}
+        if offsets:
+            self.offsets[key] = dict(offsets)
+            self.restored_offsets[key] = offsets
+        seconds = time.perf_counter() - started
+        self.restored_keys += 1
+        self.restore_seconds += seconds
+        print(f"State of key {key} restored from {self.checkpoints.path} in {seconds:.3f} s (offsets {offsets})")
+
+    # Events of a restored key read from partition `tp` that are newer than its snapshot (committed offsets may be
+    # behind it); each partition is skipped up to its own offset
+    def _skip_restored(self, key, tp, events):
+        restored = self.restored_offsets[key]
+        partition = None if tp is None else tuple(tp)
+        if partition not in restored:
+            return events
+        offset = restored[partition]
+        newer = [event for event in events if event.message.offset is None or event.message.offset > offset]
+        if len(newer) < len(events):
+            print(f"Skipped {len(events) - len(newer)} events of key {key} already in its checkpoint")
+        if newer:
+            del restored[partition]
+            if not restored:
+                del self.restored_offsets[key]
+        return newer
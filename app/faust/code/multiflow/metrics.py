@@ -0,0 +1,293 @@
+import bisect
+import os
+import threading
+import time
+
+# Metrics of an App in the Prometheus text format, served on its Faust web port (GET /metrics, see MetricsPath).
+# `attach(app)` adds the route and counts the consumed events (and the consumer lag) with a Faust sensor;
+# the Apps time their stages with a stopwatch and register their buffers, sinks and background trainers:
+#   multiflow_events_total, multiflow_rows_total                     - events / rows consumed
+#   multiflow_stage_seconds{stage="parse|buffer|score|sink|retrain"} - time per batch spent in each stage (histogram)
+#   multiflow_retrains_total, multiflow_retrain_failures_total,
+#   multiflow_retrain_seconds{model=...}                             - background (re)training
+#   multiflow_buffer_rows{buffer=...}, multiflow_sink_queue{sink=...}, multiflow_sink_dropped_total{sink=...},
+#   multiflow_consumer_lag{topic=...,partition=...}
+#   multiflow_keys                                                   - stream keys with state (keyed Apps)
+#   multiflow_checkpoints_total, multiflow_checkpoint_seconds,
+#   multiflow_checkpoint_bytes, multiflow_restore_seconds, multiflow_restored_keys - checkpoints of the keyed state
+#   multiflow_shedding, multiflow_shed_events_total{policy=...},
+#   multiflow_coalesced_batches_total, multiflow_deferred_retrains_total          - load shedding of the keyed state
+#   multiflow_latency_seconds{hop=...,sink=...}, multiflow_traced_events_total,
+#   multiflow_dropped_events_total, multiflow_out_of_order_events_total          - traced events (multiflow.tracing)
+# Every sample has an app="<instance name>" label, so server.py can merge the metrics of all instances.
+MetricsPath = os.getenv('MetricsPath', '/metrics')
+
+STAGE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+RETRAIN_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 900.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+HELP = {
+    'multiflow_events_total': ('counter', 'Events consumed from the stream topic'),
+    'multiflow_rows_total': ('counter', 'Rows parsed from the consumed events'),
+    'multiflow_output_rows_total': ('counter', 'Result rows written to the output'),
+    'multiflow_duplicate_rows_total': ('counter', 'Result rows not written because they were already in the output'),
+    'multiflow_stage_seconds': ('histogram', 'Time spent per batch in each processing stage'),
+    'multiflow_retrains_total': ('counter', 'Models fitted by background training'),
+    'multiflow_retrain_failures_total': ('counter', 'Failed background fits'),
+    'multiflow_retrain_seconds': ('histogram', 'Duration of the background fits'),
+    'multiflow_buffer_rows': ('gauge', 'Rows held in a buffer or window'),
+    'multiflow_sink_queue': ('gauge', 'Rows waiting to be written by a sink'),
+    'multiflow_sink_dropped_total': ('counter', 'Rows a sink dropped (queue full or failed writes)'),
+    'multiflow_consumer_lag': ('gauge', 'Messages behind the end of a topic partition'),
+    'multiflow_keys': ('gauge', 'Stream keys with state in this worker'),
+    'multiflow_checkpoints_total': ('counter', 'Checkpoints of the keyed state taken'),
+    'multiflow_checkpoint_seconds': ('gauge', 'Time the last checkpoint held the event loop'),
+    'multiflow_checkpoint_bytes': ('gauge', 'Size of the key snapshots written by the last checkpoint'),
+    'multiflow_restore_seconds': ('gauge', 'Time spent restoring key state from checkpoints since the App started'),
+    'multiflow_restored_keys': ('gauge', 'Keys restored from checkpoints since the App started'),
+    'multiflow_shedding': ('gauge', 'Whether the App is behind and sheds load (1) or not (0)'),
+    'multiflow_shedding_activations_total': ('counter', 'Times load shedding was switched on'),
+    'multiflow_shed_events_total': ('counter', 'Events read but not processed, per shedding policy'),
+    'multiflow_coalesced_batches_total': ('counter', 'Bursts of events scored as one batch while shedding'),
+    'multiflow_deferred_retrains_total': ('counter', 'Retrain requests deferred while shedding'),
+    'multiflow_event_age_seconds': ('gauge', 'Age of the last event read (now minus its Kafka timestamp)'),
+    'multiflow_latency_seconds': ('histogram', 'Latency of the traced events per hop (kafka, process, sink, end_to_end)'),
+    'multiflow_traced_events_total': ('counter', 'Consumed events that carry a produce timestamp'),
+    'multiflow_dropped_events_total': ('counter', 'Events missing from the sequence numbers of their producer'),
+    'multiflow_out_of_order_events_total': ('counter', 'Events older than a sequence number already seen (redelivered or late)'),
+    'multiflow_uptime_seconds': ('gauge', 'Seconds since the App started'),
+}
+
+
+# Function to format a label set as {name="value",...} (values escaped as the text format requires)
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+# Function to format a sample value (Prometheus accepts +Inf / NaN)
+def format_value(value):
+    value = float(value)
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(int(value)) if value.is_integer() and abs(value) < 1e15 else repr(value)
+
+
+# Function to render {metric: [(suffix, labels, value)]} in the Prometheus text exposition format
+def render_families(families):
+    lines = []
+    for metric in sorted(families):
+        kind, description = HELP.get(metric, ('untyped', metric))
+        lines.append(f'# HELP {metric} {description}')
+        lines.append(f'# TYPE {metric} {kind}')
+        lines.extend(f'{metric}{suffix}{format_labels(labels)} {format_value(value)}' for suffix, labels, value in families[metric])
+    return '\n'.join(lines) + '\n'
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket upper bounds, as Prometheus expects."""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Samples as (suffix, extra labels, value)
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            yield '_bucket', {'le': format_value(bound)}, cumulative
+        yield '_sum', {}, self.sum
+        yield '_count', {}, self.count
+
+
+class Stopwatch:
+    """Adds the time between laps to the stages of a batch, e.g. `lap('parse')` after parsing.
+
+    Call `start()` when a batch begins: it records the stage totals of the previous batch (so batches
+    left early with `continue` are still counted) and restarts the clock. A stage may be lapped
+    several times per batch (chunks); its total is recorded once.
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.last = time.perf_counter()
+        self.totals = {}
+        self._histograms = {}  # Histogram of each stage, looked up once
+
+    def start(self):
+        self.done()
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.totals[stage] = self.totals.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def done(self):
+        for stage, seconds in self.totals.items():
+            if stage not in self._histograms:
+                self._histograms[stage] = self.metrics.histogram('multiflow_stage_seconds', stage=stage)
+            self._histograms[stage].observe(seconds)
+        self.totals.clear()
+
+
+class AppMetrics:
+    """Registry of the counters, histograms and gauges of one App, rendered in the Prometheus text format."""
+
+    def __init__(self, name=None):
+        self.name = name
+        self.started = time.time()
+        self._lock = threading.Lock()  # Trainers report from their worker threads
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._offsets = {}  # Last offset read per (topic, partition), for the consumer lag
+        self._consumer = None
+
+    # Add to a counter
+    def inc(self, metric, value=1, **labels):
+        key = (metric, tuple(labels.items()))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    # Histogram of a metric and label set (created on first use)
+    def histogram(self, metric, buckets=STAGE_BUCKETS, **labels):
+        key = (metric, tuple(labels.items()))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            return self._histograms[key]
+
+    # Add an observation to a histogram
+    def observe(self, metric, value, buckets=STAGE_BUCKETS, **labels):
+        histogram = self.histogram(metric, buckets, **labels)
+        with self._lock:
+            histogram.observe(value)
+
+    # Register a gauge read when the metrics are rendered
+    def gauge(self, metric, function, **labels):
+        self._gauges[(metric, tuple(labels.items()))] = function
+
+    # New stopwatch for the stages of an agent's batches
+    def stopwatch(self):
+        return Stopwatch(self)
+
+    # Register a buffer (anything with len()) as multiflow_buffer_rows{buffer=name}
+    def track_buffer(self, name, buffer):
+        self.gauge('multiflow_buffer_rows', lambda: len(buffer), buffer=name)
+
+    # Register a sink with a `pending` row count (InfluxSink, ResultSink) as multiflow_sink_queue{sink=name}, and its
+    # `dropped` count, if it has one, as multiflow_sink_dropped_total{sink=name}
+    def track_sink(self, name, sink):
+        self.gauge('multiflow_sink_queue', lambda: sink.pending, sink=name)
+        if hasattr(sink, 'dropped'):
+            self.gauge('multiflow_sink_dropped_total', lambda: sink.dropped, sink=name)
+
+    # Register a KeyedState: its key count, its checkpoints, its load shedding and the latency of its traced events
+    def track_keyed_state(self, keyed_state):
+        self.gauge('multiflow_keys', lambda: len(keyed_state))
+        self.gauge('multiflow_checkpoints_total', lambda: keyed_state.snapshots)
+        self.gauge('multiflow_checkpoint_seconds', lambda: keyed_state.last_snapshot_seconds)
+        self.gauge('multiflow_checkpoint_bytes', lambda: keyed_state.last_snapshot_bytes)
+        self.gauge('multiflow_restore_seconds', lambda: keyed_state.restore_seconds)
+        self.gauge('multiflow_restored_keys', lambda: keyed_state.restored_keys)
+        shedder = keyed_state.shedder
+        if shedder.enabled:
+            self.gauge('multiflow_shedding', lambda: int(shedder.overloaded))
+            self.gauge('multiflow_shedding_activations_total', lambda: shedder.activations)
+            self.gauge('multiflow_event_age_seconds', lambda: shedder.monitor.latency_ms / 1000)
+            self.gauge('multiflow_coalesced_batches_total', lambda: shedder.coalesced_batches)
+            self.gauge('multiflow_deferred_retrains_total', lambda: sum(state.trainer.deferred for state in keyed_state
+                                                                        if hasattr(state, 'trainer')))
+            for policy in shedder.shed_events:
+                self.gauge('multiflow_shed_events_total', lambda policy=policy: shedder.shed_events[policy], policy=policy)
+        tracer = keyed_state.tracer
+        tracer.metrics = self
+        self.gauge('multiflow_traced_events_total', lambda: tracer.traced_events)
+        self.gauge('multiflow_dropped_events_total', lambda: tracer.dropped_events)
+        self.gauge('multiflow_out_of_order_events_total', lambda: tracer.out_of_order_events)
+
+    # Count the fits of a BackgroundTrainer and their durations
+    def track_trainer(self, trainer):
+        def on_swap(duration, error):
+            if error is not None:
+                self.inc('multiflow_retrain_failures_total', model=trainer.name)
+                return
+            self.inc('multiflow_retrains_total', model=trainer.name)
+            self.observe('multiflow_retrain_seconds', duration, RETRAIN_BUCKETS, model=trainer.name)
+        trainer.on_swap.append(on_swap)
+
+    # Messages behind the end of each partition read so far ({(topic, partition): lag}; empty without a consumer)
+    def consumer_lag(self):
+        lag = {}
+        for tp, offset in list(self._offsets.items()):
+            try:
+                highwater = self._consumer.highwater(tp)
+            except Exception:
+                continue
+            if highwater is not None and highwater >= 0:
+                lag[(tp.topic, tp.partition)] = max(0, highwater - offset - 1)
+        return lag
+
+    # Render all metrics in the Prometheus text exposition format
+    def render(self):
+        return render_families(self.families())
+
+    # Samples of every metric ({metric: [(suffix, labels, value)]})
+    def families(self, families=None):
+        base = {'app': self.name} if self.name else {}
+        families = {} if families is None else families
+        with self._lock:
+            for (metric, labels), value in self._counters.items():
+                families.setdefault(metric, []).append(('', {**base, **dict(labels)}, value))
+            for (metric, labels), histogram in self._histograms.items():
+                for suffix, extra, value in histogram.samples():
+                    families.setdefault(metric, []).append((suffix, {**base, **dict(labels), **extra}, value))
+        for (metric, labels), function in list(self._gauges.items()):
+            try:
+                value = function()
+            except Exception:
+                continue
+            families.setdefault(metric, []).append(('', {**base, **dict(labels)}, value))
+        for (topic, partition), lag in self.consumer_lag().items():
+            families.setdefault('multiflow_consumer_lag', []).append(('', {**base, 'topic': topic, 'partition': partition}, lag))
+        families.setdefault('multiflow_uptime_seconds', []).append(('', base, time.time() - self.started))
+        return families
+
+    # Add the metrics route to the App's web server and count the consumed events with a Faust sensor.
+    # `include` returns more registries to render on the same route (e.g. the pipelines of a multi-detector host).
+    def attach(self, app, include=None):
+        from faust.sensors import Sensor
+
+        metrics = self
+        self.name = self.name or app.conf.id
+
+        class EventSensor(Sensor):
+            def on_stream_event_in(self, tp, offset, stream, event):
+                metrics.inc('multiflow_events_total')
+                metrics._offsets[tp] = offset
+                if metrics._consumer is None:
+                    metrics._consumer = app.consumer
+
+        app.sensors.add(EventSensor())
+
+        @app.page(MetricsPath)
+        async def metrics_page(web, request):
+            families = metrics.families()
+            for registry in (include() if include else []):
+                registry.families(families)
+            return web.bytes(render_families(families).encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
+
+        return metrics_page
@@ -0,0 +1,158 @@
+import numpy as np
+
+# Streaming Maximum Mean Discrepancy (MMD) between a reference window and incoming batches, for any number of columns.
+# The 'exact' estimator is the unbiased MMD^2 with an RBF kernel, exp(-||x - y||^2 / (2 sigma^2)), i.e. the same
+# value as frouros' MMD detector, but the reference-reference term is computed once (and updated incrementally
+# when the reference changes) so comparing a batch of B rows costs O(B * (N + B)) instead of O((N + B)^2).
+# 'rff' approximates the kernel with random Fourier features (O(B) per batch, whatever the reference size) and
+# 'linear' is the linear-time estimator of Gretton et al. (2012) on pairs of rows.
+
+
+# Function to compute the RBF kernel matrix between two 2-D arrays (squared norms can be passed when cached)
+def rbf_kernel(X, Y, sigma=1.0, x_norms=None, y_norms=None):
+    x_norms = (X * X).sum(axis=1) if x_norms is None else x_norms
+    y_norms = (Y * Y).sum(axis=1) if y_norms is None else y_norms
+    distances = np.maximum(x_norms[:, None] + y_norms[None, :] - 2.0 * X @ Y.T, 0.0)
+    return np.exp(-distances / (2.0 * sigma ** 2))
+
+
+# Function to pick the kernel width from the data: median pairwise distance of (at most 500) rows
+def median_sigma(rows, max_rows=500, seed=42):
+    rows = np.asarray(rows, dtype=np.float64)
+    if len(rows) > max_rows:
+        rows = rows[np.random.default_rng(seed).choice(len(rows), max_rows, replace=False)]
+    norms = (rows * rows).sum(axis=1)
+    distances = np.sqrt(np.maximum(norms[:, None] + norms[None, :] - 2.0 * rows @ rows.T, 0.0))
+    median = np.median(distances[np.triu_indices(len(rows), k=1)]) if len(rows) > 1 else 0.0
+    return float(median) if median > 0 else 1.0
+
+
+class StreamingMMD:
+    """MMD^2 between a reference window and batches, with cached reference statistics.
+
+    `fit(reference)` stores the reference and its kernel statistics; `distance(batch)` returns the
+    MMD^2 estimate for a batch; `add_reference(rows, evict)` / `remove_reference(n)` update the
+    reference statistics incrementally for sliding windows instead of recomputing them.
+    `sigma='median'` sets the kernel width from the reference with the median heuristic.
+    """
+
+    def __init__(self, estimator='exact', sigma=1.0, n_features=256, seed=42):
+        if estimator not in ('exact', 'rff', 'linear'):
+            raise ValueError(f"Unknown MMD estimator '{estimator}' (expected 'exact', 'rff' or 'linear')")
+        self.estimator = estimator
+        self.sigma = sigma
+        self.n_features = int(n_features)
+        self.seed = seed
+        self._rng = np.random.default_rng(seed)
+        self.reference = None
+        self._norms = None
+        self._kernel_sum = 0.0  # Sum of k(x_i, x_j) over all reference pairs, diagonal included
+        self._feature_sum = None  # RFF: sum of the reference feature vectors
+        self._feature_square_sum = 0.0  # RFF: sum of their squared norms
+        self._projection = None
+        self._phase = None
+        self._updates = 0
+
+    # Number of reference rows
+    def __len__(self):
+        return 0 if self.reference is None else len(self.reference)
+
+    # Store the reference rows and compute their kernel statistics once
+    def fit(self, reference):
+        reference = np.array(reference, dtype=np.float64, copy=True).reshape(len(reference), -1)
+        if self.sigma == 'median':
+            self.sigma = median_sigma(reference, seed=self.seed)
+        self.sigma = float(self.sigma)
+        self.reference = reference
+        self._norms = (reference * reference).sum(axis=1)
+        self._updates = 0
+        if self.estimator == 'exact':
+            self._kernel_sum = self._kernel(reference, reference, self._norms, self._norms).sum()
+        elif self.estimator == 'rff':
+            if self._projection is None:
+                rng = np.random.default_rng(self.seed)
+                self._projection = rng.normal(scale=1.0 / self.sigma, size=(reference.shape[1], self.n_features))
+                self._phase = rng.uniform(0.0, 2.0 * np.pi, size=self.n_features)
+            features = self._features(reference)
+            self._feature_sum = features.sum(axis=0)
+            self._feature_square_sum = (features * features).sum()
+        return self
+
+    # MMD^2 estimate between the reference and a batch of rows
+    def distance(self, batch):
+        batch = np.asarray(batch, dtype=np.float64).reshape(len(batch), -1)
+        n, m = len(self.reference), len(batch)
+        if self.estimator == 'linear':
+            return self._linear_distance(batch)
+
+        if self.estimator == 'rff':
+            features = self._features(batch)
+            batch_sum = features.sum(axis=0)
+            xx = (self._feature_sum @ self._feature_sum - self._feature_square_sum) / (n * (n - 1))
+            yy = (batch_sum @ batch_sum - (features * features).sum()) / (m * (m - 1))
+            xy = self._feature_sum @ batch_sum / (n * m)
+            return float(xx + yy - 2.0 * xy)
+
+        batch_norms = (batch * batch).sum(axis=1)
+        xx = (self._kernel_sum - n) / (n * (n - 1))  # Diagonal terms k(x, x) = 1 are left out
+        yy = (self._kernel(batch, batch, batch_norms, batch_norms).sum() - m) / (m * (m - 1))
+        xy = self._kernel(self.reference, batch, self._norms, batch_norms).sum() / (n * m)
+        return float(xx + yy - 2.0 * xy)
+
+    # Add rows to the reference, first evicting the `evict` oldest rows (sliding window)
+    def add_reference(self, rows, evict=0):
+        rows = np.asarray(rows, dtype=np.float64).reshape(len(rows), -1)
+        if evict:
+            self.remove_reference(evict)
+        norms = (rows * rows).sum(axis=1)
+        if self.estimator == 'exact':
+            cross = self._kernel(rows, self.reference, norms, self._norms).sum()
+            self._kernel_sum += 2.0 * cross + self._kernel(rows, rows, norms, norms).sum()
+        elif self.estimator == 'rff':
+            features = self._features(rows)
+            self._feature_sum += features.sum(axis=0)
+            self._feature_square_sum += (features * features).sum()
+        self.reference = np.concatenate([self.reference, rows])
+        self._norms = np.concatenate([self._norms, norms])
+        self._refresh(len(rows))
+
+    # Remove the `n` oldest reference rows
+    def remove_reference(self, n):
+        n = min(int(n), len(self.reference))
+        old, old_norms = self.reference[:n], self._norms[:n]
+        if self.estimator == 'exact':
+            cross = self._kernel(old, self.reference, old_norms, self._norms).sum()
+            self._kernel_sum -= 2.0 * cross - self._kernel(old, old, old_norms, old_norms).sum()
+        elif self.estimator == 'rff':
+            features = self._features(old)
+            self._feature_sum -= features.sum(axis=0)
+            self._feature_square_sum -= (features * features).sum()
+        self.reference = self.reference[n:]
+        self._norms = self._norms[n:]
+
+    # Recompute the reference statistics once the whole reference was replaced, so rounding errors do not build up
+    def _refresh(self, added):
+        self._updates += added
+        if self._updates >= len(self.reference):
+            self.fit(self.reference)
+
+    def _kernel(self, X, Y, x_norms, y_norms):
+        return rbf_kernel(X, Y, self.sigma, x_norms, y_norms)
+
+    def _features(self, rows):
+        return np.sqrt(2.0 / self.n_features) * np.cos(rows @ self._projection + self._phase)
+
+    # Linear-time estimate: mean of h = k(x, x') + k(y, y') - k(x, y') - k(x', y) over disjoint pairs,
+    # with the pairs drawn at random (consecutive stream rows are correlated, so they are not paired in order)
+    def _linear_distance(self, batch):
+        pairs = min(len(batch), len(self.reference)) // 2
+        if pairs == 0:
+            return 0.0
+        x = self.reference[self._rng.choice(len(self.reference), 2 * pairs, replace=False)]
+        y = batch[self._rng.choice(len(batch), 2 * pairs, replace=False)]
+        x1, x2, y1, y2 = x[0::2], x[1::2], y[0::2], y[1::2]
+
+        def k(a, b):
+            return np.exp(-((a - b) ** 2).sum(axis=1) / (2.0 * self.sigma ** 2))
+
+        return float((k(x1, x2) + k(y1, y2) - k(x1, y2) - k(x2, y1)).mean())
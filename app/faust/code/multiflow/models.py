@@ -0,0 +1,187 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+# Model lifecycle helpers for Apps that (re)train models while the stream runs.
+
+# Where model files are written: a folder on disk (default) or 'memory' for a tmpfs folder (/dev/shm when available)
+ModelStorePath = os.getenv('ModelStorePath', 'model_cache')
+ModelStoreSize = int(os.getenv('ModelStoreSize', '2'))  # Fitted models kept at most (least recently used are evicted)
+
+
+class RetrainScheduler:
+    """Decides when a model is due for a new fit.
+
+    A fit is due when there is no model yet, when `every_rows` rows arrived since the last fit
+    or when `every_seconds` passed since the last fit (0 disables either rule).
+    """
+
+    def __init__(self, every_rows=0, every_seconds=0.0):
+        self.every_rows = int(every_rows)
+        self.every_seconds = float(every_seconds)
+        self.fits = 0
+        self.last_fit_row = None
+        self.last_fit_time = None
+
+    # Whether a fit is due at `row_count` rows
+    def due(self, row_count):
+        if self.last_fit_row is None:
+            return True
+        if self.every_rows > 0 and row_count - self.last_fit_row >= self.every_rows:
+            return True
+        if self.every_seconds > 0 and time.monotonic() - self.last_fit_time >= self.every_seconds:
+            return True
+        return False
+
+    # Record a fit made at `row_count` rows
+    def mark_fitted(self, row_count):
+        self.fits += 1
+        self.last_fit_row = row_count
+        self.last_fit_time = time.monotonic()
+
+
+class ModelStore:
+    """Bounded, least-recently-used store of fitted models and their folders.
+
+    Every model gets its own folder inside a private folder of `root`; when more than
+    `max_models` models are stored, the least recently used one is dropped and its folder
+    deleted, so disk (or tmpfs) usage stays bounded. `root='memory'` puts the folders on tmpfs.
+    A checkpoint keeps the latest model with the files of its folder; `loader(path)`, when given,
+    loads the model back from the restored folder instead of unpickling it. With an `archive` folder
+    (e.g. CheckpointStore.folder), the folder of every model is copied there once, when it is stored,
+    and checkpoints only name their copy; otherwise they hold the files themselves.
+    """
+
+    def __init__(self, max_models=None, root=None, prefix='models', loader=None, archive=None):
+        self.max_models = max(1, max_models or ModelStoreSize)
+        root = root or ModelStorePath
+        if root == 'memory':
+            root = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        os.makedirs(root, exist_ok=True)
+        self.root = tempfile.mkdtemp(prefix=f"{prefix}_", dir=root)
+        self.loader = loader
+        self.archive = archive
+        self.evicted = 0
+        self._models = OrderedDict()  # key -> (model, folder)
+        self._archived = {}  # key -> name of the copy of its folder in `archive`
+        self._checkpointed = deque(maxlen=2)  # Copies named by the last checkpoints (the last one may still be written)
+        self._next_id = 0
+        self._lock = threading.RLock()  # Models may be stored from a training thread
+
+    def __len__(self):
+        return len(self._models)
+
+    def __contains__(self, key):
+        return key in self._models
+
+    # New empty folder for the next model to be fitted
+    def new_path(self, name='model'):
+        with self._lock:
+            self._next_id += 1
+            return os.path.join(self.root, f"{name}_{self._next_id}")
+
+    # Store a fitted model (and the folder holding its files), evicting the least recently used ones.
+    # With an `archive`, the folder is copied there first (from the training thread that stores the model).
+    def put(self, key, model, path=None):
+        archived = self._archive(path) if path and self.archive else None
+        return self._put(key, model, path, archived)
+
+    def _put(self, key, model, path, archived):
+        with self._lock:
+            if key in self._models:
+                self._remove(key)
+            self._models[key] = (model, path)
+            if archived is not None:
+                self._archived[key] = archived
+            while len(self._models) > self.max_models:
+                self._remove(next(iter(self._models)))
+                self.evicted += 1
+            stale = set(os.listdir(self.archive)) - set(self._archived.values()) - set(self._checkpointed) if self.archive and os.path.isdir(self.archive) else ()
+        for name in stale:  # Copies of evicted models that no checkpoint names any more
+            shutil.rmtree(os.path.join(self.archive, name), ignore_errors=True)
+        return model
+
+    # Fitted model stored under `key` (None if missing); marks it as recently used
+    def get(self, key):
+        with self._lock:
+            if key not in self._models:
+                return None
+            self._models.move_to_end(key)
+            return self._models[key][0]
+
+    # Most recently stored or used model (None if empty)
+    def latest(self):
+        with self._lock:
+            if not self._models:
+                return None
+            return next(reversed(self._models.values()))[0]
+
+    # Drop every model and delete the store folder
+    def clear(self):
+        with self._lock:
+            for key in list(self._models):
+                self._remove(key)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    # Latest model, with the files of its folder (or the name of their copy in `archive`), for a checkpoint
+    # (see multiflow.checkpoint)
+    def checkpoint(self):
+        with self._lock:
+            if not self._models:
+                return None
+            key = next(reversed(self._models))
+            model, path = self._models[key]
+            if key in self._archived:
+                self._checkpointed.append(self._archived[key])
+                return {'key': key, 'model': None if self.loader else model, 'archived': self._archived[key]}
+            files = {}
+            for folder, _, names in os.walk(path) if path else ():
+                for name in names:
+                    with open(os.path.join(folder, name), 'rb') as file:
+                        files[os.path.relpath(os.path.join(folder, name), path)] = file.read()
+            return {'key': key, 'model': None if path and self.loader else model, 'files': files if path else None}
+
+    # Store the model of a checkpoint again (in a new folder)
+    def restore(self, snapshot):
+        if snapshot is None:
+            return
+        path = None
+        archived = snapshot.get('archived')
+        if archived is not None:
+            path = self.new_path('restored')
+            shutil.copytree(os.path.join(self.archive, archived), path)
+            self._checkpointed.append(archived)
+        elif snapshot['files'] is not None:
+            path = self.new_path('restored')
+            for name, data in snapshot['files'].items():
+                os.makedirs(os.path.dirname(os.path.join(path, name)), exist_ok=True)
+                with open(os.path.join(path, name), 'wb') as file:
+                    file.write(data)
+        model = self.loader(path) if path and self.loader else snapshot['model']
+        self._put(snapshot['key'], model, path, archived)
+
+    # Register a cleanup on the Faust App shutdown so the model folders do not outlive the Instance
+    def attach(self, app):
+        @app.on_before_shutdown.connect
+        async def clear_model_store(app, **kwargs):
+            self.clear()
+        return clear_model_store
+
+    # Copy a model folder into `archive` under a new name (copied aside, then renamed: copies are always complete)
+    def _archive(self, path):
+        os.makedirs(self.archive, exist_ok=True)
+        name = f"{os.path.basename(path)}_{uuid.uuid4().hex[:12]}"
+        temporary = os.path.join(self.archive, '.' + name + '.tmp')
+        shutil.copytree(path, temporary)
+        os.replace(temporary, os.path.join(self.archive, name))
+        return name
+
+    def _remove(self, key):
+        self._archived.pop(key, None)
+        _, path = self._models.pop(key)
+        if path and os.path.abspath(path).startswith(os.path.abspath(self.root) + os.sep):
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,88 @@
+import numpy as np
+
+
+class OnlineOneClassSVM:
+    """Incrementally updated approximation of StandardScaler + RBF One-Class SVM.
+
+    The scaler statistics are running means/variances, the RBF kernel is approximated with
+    random Fourier features (they do not depend on the data, so they never need refitting) and a
+    linear One-Class SVM is trained on those features by SGD, one pass over each new row, with the
+    same objective and 'optimal' learning rate as scikit-learn's SGDOneClassSVM.
+    Updating and scoring a row both cost O(n_components * num_columns), however long the stream runs.
+    `predict` follows scikit-learn: -1 for outliers, 1 for inliers.
+    """
+
+    def __init__(self, n_components=200, nu=0.05, gamma=None, random_state=42):
+        self.n_components = int(n_components)
+        self.nu = float(nu)
+        self.gamma = gamma  # None: 1 / num_columns, like gamma='auto' of the batch model
+        self.random_state = random_state
+        self.count = 0
+
+        # Running scaler statistics, random features and the linear model (w . z - offset)
+        self.mean = None
+        self._m2 = None
+        self.weights = None
+        self.offset = 0.0
+        self._projection = None
+        self._phase = None
+        self._t = 0
+        typical_weight = np.sqrt(1.0 / np.sqrt(self.nu))
+        self._t0 = 1.0 / (typical_weight * self.nu)
+
+    # Update the model with new rows (2-D array), one SGD step per row in arrival order
+    def partial_fit(self, rows):
+        rows = np.asarray(rows, dtype=np.float64)
+        if rows.ndim == 1:
+            rows = rows.reshape(1, -1)
+        if len(rows) == 0:
+            return self
+        if self.mean is None:
+            self._init(rows.shape[1])
+
+        # Scaler statistics (Chan et al. parallel update of mean and variance)
+        n = len(rows)
+        total = self.count + n
+        delta = rows.mean(axis=0) - self.mean
+        self._m2 += ((rows - rows.mean(axis=0)) ** 2).sum(axis=0) + delta ** 2 * self.count * n / total
+        self.mean += delta * n / total
+        self.count = total
+
+        # SGD on the hinge loss of every row: min nu/2 ||w||^2 + max(0, offset - w.z) - nu * offset
+        features = self._transform(rows)
+        weights, offset, nu = self.weights, self.offset, self.nu
+        for z in features:
+            eta = 1.0 / (nu * (self._t0 + self._t))
+            violated = weights @ z < offset
+            weights *= 1.0 - eta * nu
+            if violated:
+                weights += eta * z
+            offset += eta * (nu - violated)
+            self._t += 1
+        self.offset = offset
+        return self
+
+    # Signed distance to the separating hyperplane (negative for outliers)
+    def decision_function(self, rows):
+        rows = np.asarray(rows, dtype=np.float64)
+        if rows.ndim == 1:
+            rows = rows.reshape(1, -1)
+        return self._transform(rows) @ self.weights - self.offset
+
+    def predict(self, rows):
+        return np.where(self.decision_function(rows) < 0, -1, 1)
+
+    def _init(self, num_columns):
+        gamma = self.gamma if self.gamma is not None else 1.0 / num_columns
+        rng = np.random.default_rng(self.random_state)
+        self.mean = np.zeros(num_columns)
+        self._m2 = np.zeros(num_columns)
+        self.weights = np.zeros(self.n_components)
+        self._projection = rng.normal(scale=np.sqrt(2.0 * gamma), size=(num_columns, self.n_components))
+        self._phase = rng.uniform(0.0, 2.0 * np.pi, size=self.n_components)
+
+    def _transform(self, rows):
+        scale = np.sqrt(self._m2 / max(self.count, 1))
+        scale[scale == 0] = 1.0  # Constant columns are only centred, as in StandardScaler
+        scaled = (rows - self.mean) / scale
+        return np.sqrt(2.0 / self.n_components) * np.cos(scaled @ self._projection + self._phase)
@@ -0,0 +1,188 @@
+import numpy as np
+
+# Streaming quantile estimators for several columns at once.
+# All of them share the same interface: `update(rows)` with a 1-D row or a 2-D array of rows,
+# and `quantiles(qs)` returning an array of shape (len(qs), num_columns) that can be read at any time.
+
+
+class KLLSketch:
+    """KLL quantile sketch over the full history of every column.
+
+    All columns receive one value per row, so their compactors fill in lockstep and every level
+    is stored as one (items x columns) array that is sorted and compacted column-wise in one go.
+    Memory is bounded by roughly 3k items per column and each update costs O(1) amortised.
+    While nothing has been compacted yet the sketch holds every value and answers exactly.
+    """
+
+    def __init__(self, num_columns, k=200, seed=42):
+        self.num_columns = int(num_columns)
+        self.k = int(k)
+        self.count = 0
+        self._rng = np.random.default_rng(seed)
+        self._levels = [np.empty((0, self.num_columns))]
+        self._level0 = np.empty((self.k, self.num_columns))
+        self._level0_size = 0
+
+    def _capacity(self, level):
+        depth = len(self._levels) - 1 - level
+        return max(8, int(np.ceil(self.k * (2.0 / 3.0) ** depth)))
+
+    def update(self, rows):
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, self.num_columns)
+        self.count += len(rows)
+        start = 0
+        while start < len(rows):
+            capacity = min(self._capacity(0), len(self._level0))
+            take = min(len(rows) - start, capacity - self._level0_size)
+            self._level0[self._level0_size:self._level0_size + take] = rows[start:start + take]
+            self._level0_size += take
+            start += take
+            if self._level0_size >= capacity:
+                self._compress()
+
+    def _compress(self):
+        self._levels[0] = self._level0[:self._level0_size].copy()
+        self._level0_size = 0
+        for level in range(len(self._levels)):
+            items = self._levels[level]
+            if len(items) < self._capacity(level):
+                break
+            if level + 1 == len(self._levels):
+                self._levels.append(np.empty((0, self.num_columns)))
+
+            # Sort every column, keep one of each pair of neighbours (random offset) and promote them
+            items = np.sort(items, axis=0)
+            usable = len(items) - len(items) % 2
+            offset = int(self._rng.integers(2))
+            self._levels[level + 1] = np.concatenate([self._levels[level + 1], items[offset:usable:2]])
+            self._levels[level] = items[usable:]
+
+        leftover = self._levels[0]
+        self._levels[0] = np.empty((0, self.num_columns))
+        self._level0[:len(leftover)] = leftover
+        self._level0_size = len(leftover)
+
+    def quantiles(self, qs):
+        qs = np.atleast_1d(np.asarray(qs, dtype=np.float64))
+        parts = [self._level0[:self._level0_size]] + self._levels[1:]
+        values = np.concatenate(parts)
+        if len(values) == 0:
+            return np.full((len(qs), self.num_columns), np.nan)
+        if len(self._levels) == 1:
+            return np.quantile(values, qs, axis=0)  # Nothing compacted yet: exact answer
+
+        # Weighted rank query: an item at level h stands for 2**h values
+        weights = np.concatenate([np.full(len(part), 2.0 ** level) for level, part in enumerate(parts)])
+        order = np.argsort(values, axis=0)
+        sorted_values = np.take_along_axis(values, order, axis=0)
+        cumulative = np.cumsum(weights[order], axis=0)
+        targets = qs[:, None, None] * cumulative[-1]
+        index = np.minimum((cumulative[None, :, :] < targets).sum(axis=1), len(values) - 1)
+        return np.take_along_axis(sorted_values, index, axis=0)
+
+
+class SlidingWindowQuantiles:
+    """Exact quantiles over the last `window` rows.
+
+    Each column keeps its window values sorted; a new row replaces the oldest one with a
+    binary search and an in-place shift, so an update costs O(window) memory moves at most
+    and a query is a direct lookup (same linear interpolation as numpy.quantile).
+    """
+
+    def __init__(self, num_columns, window=1000):
+        self.num_columns = int(num_columns)
+        self.window = int(window)
+        self.count = 0
+        self._ring = np.empty((self.window, self.num_columns))
+        self._sorted = np.empty((self.window, self.num_columns))
+
+    def update(self, rows):
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, self.num_columns)
+        for row in rows:
+            size = min(self.count, self.window)
+            slot = self.count % self.window
+            for column in range(self.num_columns):
+                values = self._sorted[:, column]
+                if size == self.window:
+                    # Remove the value leaving the window
+                    position = np.searchsorted(values[:size], self._ring[slot, column])
+                    values[position:size - 1] = values[position + 1:size]
+                    size_before_insert = size - 1
+                else:
+                    size_before_insert = size
+                position = np.searchsorted(values[:size_before_insert], row[column])
+                values[position + 1:size_before_insert + 1] = values[position:size_before_insert].copy()
+                values[position] = row[column]
+            self._ring[slot] = row
+            self.count += 1
+
+    def quantiles(self, qs):
+        qs = np.atleast_1d(np.asarray(qs, dtype=np.float64))
+        size = min(self.count, self.window)
+        if size == 0:
+            return np.full((len(qs), self.num_columns), np.nan)
+        position = qs * (size - 1)
+        low = np.floor(position).astype(int)
+        high = np.minimum(low + 1, size - 1)
+        fraction = (position - low)[:, None]
+        values = self._sorted[:size]
+        return values[low] + (values[high] - values[low]) * fraction
+
+
+class DecayedQuantiles:
+    """Exponentially decayed quantile estimates (constant memory and O(1) per row).
+
+    Each quantile moves towards new values by a step proportional to an exponentially
+    weighted estimate of the column spread (stochastic approximation), so old rows fade out
+    with a time constant of roughly 1/`decay` rows. The first rows are answered exactly.
+    """
+
+    def __init__(self, num_columns, qs=(0.25, 0.75), decay=0.01):
+        self.num_columns = int(num_columns)
+        self.qs = np.asarray(qs, dtype=np.float64)
+        self.decay = float(decay)
+        self.count = 0
+        self._warmup = max(2, int(round(1.0 / self.decay)))
+        self._history = []
+        self._estimates = None
+        self._mean = None
+        self._spread = None
+
+    def update(self, rows):
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, self.num_columns)
+        for row in rows:
+            self.count += 1
+            if self._estimates is None:
+                self._history.append(row.copy())
+                if len(self._history) >= self._warmup:
+                    history = np.array(self._history)
+                    self._estimates = np.quantile(history, self.qs, axis=0)
+                    self._mean = history.mean(axis=0)
+                    self._spread = history.std(axis=0)
+                    self._history = []
+                continue
+            self._mean += self.decay * (row - self._mean)
+            self._spread += self.decay * (np.abs(row - self._mean) - self._spread)
+            step = self.decay * np.maximum(self._spread, 1e-12)
+            self._estimates += step * (self.qs[:, None] - (row < self._estimates))
+
+    def quantiles(self, qs=None):
+        qs = self.qs if qs is None else np.atleast_1d(np.asarray(qs, dtype=np.float64))
+        if self._estimates is None:
+            if not self._history:
+                return np.full((len(qs), self.num_columns), np.nan)
+            return np.quantile(np.array(self._history), qs, axis=0)
+        if not np.array_equal(qs, self.qs):
+            raise ValueError(f"DecayedQuantiles only tracks the quantiles {self.qs.tolist()}")
+        return self._estimates.copy()
+
+
+# Function to create the estimator selected by an App ('full', 'window' or 'decay')
+def make_quantile_estimator(mode, num_columns, qs=(0.25, 0.75), k=200, window=1000, decay=0.01):
+    if mode == 'full':
+        return KLLSketch(num_columns, k=k)
+    if mode == 'window':
+        return SlidingWindowQuantiles(num_columns, window=window)
+    if mode == 'decay':
+        return DecayedQuantiles(num_columns, qs=qs, decay=decay)
+    raise ValueError(f"Unknown quantile mode '{mode}' (expected 'full', 'window' or 'decay')")
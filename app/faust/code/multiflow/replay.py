@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import importlib
+import json
+import mmap
+import os
+import time
+
+from multiflow.buffer import parse_csv_rows
+from multiflow.codec import encode_rows, decode_event, key_partition
+from multiflow.tracing import SequenceStamper
+
+# Stream replayer: sends the lines of CSV files (e.g. datasets/Pressure_complete.csv) to Kafka topics, like the
+# Node ws service does, but fast enough to find the limits of the Faust Apps:
+#   - files are memory-mapped and read in chunks of lines;
+#   - sends are paced against an absolute schedule (precise rates), or not paced at all (rate 0);
+#   - the producer batches (linger) and compresses the messages, and several files/topics are replayed in parallel,
+#     spreading the messages over the partitions of each topic;
+#   - messages are the legacy {"csv_data": line} events or the binary 'rows'/'arrow' messages of multiflow.codec;
+#   - with --trace, every message carries the produce time and sequence number headers of multiflow.tracing;
+#   - with --key, every message carries that Kafka key (the stream key of the keyed Apps), which picks its partition.
+# Without a broker, the lines can be replayed straight into a Faust agent through its in-memory test context.
+#
+# Usage (from app/faust/code):
+#   python -m multiflow.replay ../../../datasets/Pressure_complete.csv --topic phd_kafka --rate 5000
+#   python -m multiflow.replay data.csv --topic a --topic b --rate 0 --format rows --rows-per-message 100
+#   python -m multiflow.replay data.csv --agent OutlierDetection_DynamicIQRMethod:outlier_detection_agent
+#   python -m multiflow.replay data.csv --topic phd_kafka --rate 1000 --trace
+#   python -m multiflow.replay a.csv b.csv --topic phd_kafka --topic phd_kafka --key sensor-a --key sensor-b
+
+CHUNK_BYTES = 1 << 20  # Bytes mapped and split into lines at a time
+
+
+# Function to read the non-empty lines of a file in chunks (lists of str), through a memory map
+def read_line_chunks(path, chunk_bytes=CHUNK_BYTES, skip_header=False, limit=None):
+    sent = 0
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start, size = 0, len(data)
+            if data[:3] == b'\xef\xbb\xbf':  # UTF-8 byte order mark
+                start = 3
+            while start < size:
+                end = data.find(b'\n', min(start + chunk_bytes, size - 1))
+                end = size if end < 0 else end + 1
+                lines = [line.strip() for line in data[start:end].decode('utf-8').split('\n')]
+                lines = [line for line in lines if line]
+                start = end
+                if skip_header:
+                    lines, skip_header = lines[1:], False
+                if limit is not None:
+                    lines = lines[:limit - sent]
+                sent += len(lines)
+                if lines:
+                    yield lines
+                if limit is not None and sent >= limit:
+                    return
+
+
+# Function to turn a chunk of lines into messages of `rows_per_message` rows: (message bytes, row count)
+def encode_lines(lines, format='csv', rows_per_message=1):
+    if format == 'csv':
+        return [(json.dumps({'csv_data': line}).encode('utf-8'), 1) for line in lines]
+    rows, skipped = parse_csv_rows(lines)
+    for line in skipped:
+        print(f"Skipping line that is not numeric: {line}")
+    return [(encode_rows(rows[start:start + rows_per_message], format), len(rows[start:start + rows_per_message]))
+            for start in range(0, len(rows), rows_per_message)]
+
+
+class Pacer:
+    """Keeps an average rate (rows per second) against an absolute schedule, so sleeping errors do not add up.
+
+    `rate` 0 or None means as fast as possible.
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate or 0
+        self.start = time.perf_counter()
+        self.rows = 0
+
+    async def wait(self, rows):
+        self.rows += rows
+        if self.rate:
+            ahead = self.start + self.rows / self.rate - time.perf_counter()
+            if ahead > 0.001:
+                await asyncio.sleep(ahead)
+
+
+class KafkaTarget:
+    """Batching, compressing Kafka producer (aiokafka) for the replayer."""
+
+    def __init__(self, bootstrap_servers='localhost:9092', compression='gzip', linger_ms=20, max_batch_size=1 << 20):
+        self.bootstrap_servers = bootstrap_servers
+        self.compression = None if compression == 'none' else compression
+        self.linger_ms = linger_ms
+        self.max_batch_size = max_batch_size
+        self._producer = None
+        self._partitions = {}
+
+    async def start(self):
+        from aiokafka import AIOKafkaProducer
+        self._producer = AIOKafkaProducer(bootstrap_servers=self.bootstrap_servers, compression_type=self.compression,
+                                          linger_ms=self.linger_ms, max_batch_size=self.max_batch_size)
+        await self._producer.start()
+
+    # Number of partitions of a topic (messages are spread over all of them)
+    async def partitions(self, topic):
+        if topic not in self._partitions:
+            self._partitions[topic] = sorted(await self._producer.partitions_for(topic) or [0])
+        return self._partitions[topic]
+
+    # Queue a message; returns a future resolved once the broker acknowledged its batch
+    async def send(self, topic, value, partition=None, headers=None, key=None):
+        return await self._producer.send(topic, value, key=key, partition=partition, headers=headers)
+
+    async def stop(self):
+        await self._producer.stop()
+
+
+class AgentTarget:
+    """Replays into a Faust agent through its in-memory test context (no broker needed).
+
+    Messages are decoded with the 'multiflow' codec, as the agent topic would do.
+    """
+
+    def __init__(self, agent):
+        self.agent = agent
+        self._context = None
+        self._test_agent = None
+        self._lock = None
+
+    async def start(self):
+        self._lock = asyncio.Lock()  # One message at a time: the test context loses messages put concurrently
+        self._context = self.agent.test_context()
+        self._test_agent = await self._context.__aenter__()
+
+    async def partitions(self, topic):
+        return [None]
+
+    async def send(self, topic, value, partition=None, headers=None, key=None):
+        async with self._lock:
+            await self._test_agent.put(decode_event(value), key=key, headers=headers)
+        return None
+
+    async def stop(self):
+        await self._context.__aexit__(None, None, None)
+
+
+# Function to import an agent given as 'module:agent_name'
+def load_agent(spec):
+    module_name, _, agent_name = spec.partition(':')
+    return getattr(importlib.import_module(module_name), agent_name)
+
+
+# Function to replay one file to one topic, with the Kafka key `key` (None: spread over the partitions);
+# returns the replay statistics
+async def replay_file(target, path, topic, rate=None, format='csv', rows_per_message=1, skip_header=False, limit=None, report_every=5.0,
+                      trace=False, key=None):
+    pacer = Pacer(rate)
+    stamper = SequenceStamper() if trace else None
+    partitions = await target.partitions(topic)
+    key = key.encode('utf-8') if isinstance(key, str) else key
+    keyed_partition = key_partition(key, partitions) if key is not None else None
+    rows = messages = size = 0
+    pending = []
+    last_report = time.perf_counter()
+    for lines in read_line_chunks(path, skip_header=skip_header, limit=limit):
+        for value, count in encode_lines(lines, format, rows_per_message):
+            await pacer.wait(count)
+            partition = partitions[messages % len(partitions)] if key is None else keyed_partition
+            headers = stamper.headers(topic, partition) if stamper is not None else None
+            future = await target.send(topic, value, partition, headers, key)
+            if future is not None:
+                pending.append(future)
+            rows += count
+            messages += 1
+            size += len(value)
+        if len(pending) > 10000:  # Keep the number of unacknowledged sends bounded
+            await asyncio.gather(*pending)
+            pending = []
+        if report_every and time.perf_counter() - last_report >= report_every:
+            last_report = time.perf_counter()
+            print(f"{topic}: {rows} rows sent, {rows / (last_report - pacer.start):.0f} rows/s")
+    await asyncio.gather(*pending)
+    seconds = time.perf_counter() - pacer.start
+    return {'file': path, 'topic': topic, 'rows': rows, 'messages': messages, 'bytes': size,
+            'seconds': seconds, 'rows_per_second': rows / seconds if seconds > 0 else 0.0}
+
+
+# Function to replay several (file, topic) or (file, topic, key) streams in parallel through one target
+async def replay(target, streams, **options):
+    await target.start()
+    try:
+        return await asyncio.gather(*[replay_file(target, stream[0], stream[1], key=stream[2] if len(stream) > 2 else None, **options)
+                                      for stream in streams])
+    finally:
+        await target.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m multiflow.replay', description='Replay CSV files as Kafka events.')
+    parser.add_argument('files', nargs='+', help='CSV files to replay (one per topic, or one for all topics)')
+    parser.add_argument('--topic', action='append', help='target topic, repeatable (default: StreamTopic or phd_kafka)')
+    parser.add_argument('--rate', type=float, default=0, help='rows per second for each stream (0 = as fast as possible)')
+    parser.add_argument('--format', choices=['csv', 'rows', 'arrow'], default='csv', help='message format (default: csv_data JSON)')
+    parser.add_argument('--rows-per-message', type=int, default=100, help="rows per 'rows'/'arrow' message")
+    parser.add_argument('--skip-header', action='store_true', help='do not send the first line of each file')
+    parser.add_argument('--limit', type=int, help='maximum rows sent per stream')
+    parser.add_argument('--bootstrap-servers', default=os.getenv('KafkaBootstrapServers', 'localhost:9092'))
+    parser.add_argument('--compression', choices=['gzip', 'snappy', 'lz4', 'zstd', 'none'], default='gzip')
+    parser.add_argument('--linger-ms', type=int, default=20)
+    parser.add_argument('--agent', help="replay into a Faust agent in memory instead of Kafka ('module:agent_name')")
+    parser.add_argument('--trace', action='store_true', help='stamp every message with its produce time and sequence number')
+    parser.add_argument('--key', action='append', help='Kafka key of the messages of each stream, repeatable (one for all streams, or one per stream)')
+    args = parser.parse_args(argv)
+
+    topics = args.topic or [os.getenv('StreamTopic', 'phd_kafka')]
+    if len(args.files) == 1:
+        streams = [(args.files[0], topic) for topic in topics]
+    elif len(args.files) == len(topics):
+        streams = list(zip(args.files, topics))
+    else:
+        parser.error('give one file, or as many files as topics')
+    if args.key:
+        if len(args.key) not in (1, len(streams)):
+            parser.error('give one key, or one key per stream')
+        streams = [(path, topic, key) for (path, topic), key in zip(streams, args.key * len(streams) if len(args.key) == 1 else args.key)]
+
+    target = AgentTarget(load_agent(args.agent)) if args.agent else KafkaTarget(args.bootstrap_servers, args.compression, args.linger_ms)
+    results = asyncio.run(replay(target, streams, rate=args.rate, format=args.format, rows_per_message=args.rows_per_message,
+                                 skip_header=args.skip_header, limit=args.limit, trace=args.trace))
+    for result in results:
+        print(f"{result['file']} -> {result['topic']}: {result['rows']} rows in {result['messages']} messages "
+              f"({result['bytes'] / 1024:.0f} KB) in {result['seconds']:.2f} s = {result['rows_per_second']:.0f} rows/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from multiflow.tracing import current_trace
+
+# Append-only sink for the labeled rows of the detector Apps.
+# ResultFormat selects the output:
+#   'csv' (default) - rows are appended to <OutputFileName>.csv, as before;
+#   'parquet' / 'arrow' - every flush adds a compressed part file to the folder <OutputFileName>.parquet / .arrow
+#   and small parts are merged in the background (pyarrow is needed for these two formats).
+ResultFormat = os.getenv('ResultFormat', 'csv')
+ResultFlushRows = int(os.getenv('ResultFlushRows', '100'))  # Rows between two writes
+ResultCompactParts = int(os.getenv('ResultCompactParts', '10'))  # Small parts merged into one (0 disables merging)
+ResultCompression = os.getenv('ResultCompression', 'zstd')
+
+PART_PATTERN = re.compile(r'^part-(\d+)(?:-(\d+))?\.(parquet|arrow)$')
+
+
+# Function to list the complete part files of a result folder, as (first, last, name) sorted by first part.
+# A merged part 'part-<first>-<last>' replaces the small parts it covers, even while they are still being deleted.
+def list_parts(path):
+    parts = []
+    for name in os.listdir(path) if os.path.isdir(path) else []:
+        match = PART_PATTERN.match(name)
+        if match:
+            first = int(match.group(1))
+            parts.append((first, int(match.group(2) or first), name))
+    parts.sort(key=lambda part: (part[0], -part[1]))
+    visible, covered = [], 0
+    for first, last, name in parts:
+        if first > covered:
+            visible.append((first, last, name))
+            covered = last
+    return visible
+
+
+# Function to read everything a ResultSink wrote so far (CSV file or part folder) into one DataFrame
+def read_results(path):
+    if os.path.isfile(path):
+        return pd.read_csv(path)
+    tables = [_read_part(os.path.join(path, name)) for _, _, name in list_parts(path)]
+    if not tables:
+        return pd.DataFrame()
+    return pd.concat(tables, ignore_index=True)
+
+
+def _read_part(filename):
+    if filename.endswith('.parquet'):
+        return pd.read_parquet(filename)
+    import pyarrow.ipc
+    with pyarrow.ipc.open_file(filename) as reader:
+        return reader.read_all().to_pandas()
+
+
+def _write_part(frame, filename, compression):
+    import pyarrow
+    table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+    temporary = os.path.join(os.path.dirname(filename), '.' + os.path.basename(filename) + '.tmp')
+    if filename.endswith('.parquet'):
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(table, temporary, compression=compression)
+    else:
+        import pyarrow.ipc
+        options = pyarrow.ipc.IpcWriteOptions(compression=compression if compression in ('zstd', 'lz4') else None)
+        with pyarrow.ipc.new_file(temporary, table.schema, options=options) as writer:
+            writer.write_table(table)
+    os.replace(temporary, filename)  # Readers only ever see complete files
+
+
+class ResultSink:
+    """Append-only writer of labeled rows with bounded memory.
+
+    `append(rows, column_names, extra)` buffers a 2-D array of values plus extra label/score
+    columns; every `flush_rows` rows the buffered rows (and only those) are written: appended to the
+    CSV file, or written as a new compressed Parquet/Arrow part file (written to a hidden temporary
+    name and renamed, so readers never see half-written parts). Once `compact_parts` small parts
+    exist they are merged into one part by a background thread. Use `read_results` to read the output.
+    """
+
+    def __init__(self, name, format=None, flush_rows=None, compact_parts=None, compression=None):
+        self.format = format or ResultFormat
+        if self.format not in ('csv', 'parquet', 'arrow'):
+            raise ValueError(f"Unknown result format '{self.format}' (expected 'csv', 'parquet' or 'arrow')")
+        self.path = f"{name}.{self.format}"
+        self.flush_rows = flush_rows or ResultFlushRows
+        self.compact_parts = ResultCompactParts if compact_parts is None else compact_parts
+        self.compression = compression or ResultCompression
+        self.rows_written = 0
+        self.parts_written = 0
+
+        self._buffer = []  # (rows, extra columns) appended since the last write
+        self._traces = []  # (TraceMark, appended at ns) of the traced batches in the buffer
+        self._buffered = 0
+        self._columns = None
+        self._initialized = False
+        self._next_part = 1
+        self._compactor = None
+        self._compaction = None
+
+    # Buffer rows (2-D array) with their extra columns ({name: one value or one value per row}); writes every `flush_rows` rows
+    def append(self, rows, column_names, extra=None):
+        rows = np.array(rows)  # Copied: rows are often views of a RingBuffer that will be overwritten
+        if rows.ndim == 1:
+            rows = rows.reshape(1, -1)
+        if len(rows) == 0:
+            return
+        extra = {column: np.broadcast_to(np.asarray(values), len(rows)) for column, values in (extra or {}).items()}
+        previous = self.rows_written + self._buffered
+        self._columns = list(column_names)
+        self._buffer.append((rows, extra))
+        self._buffered += len(rows)
+        trace = current_trace.get()
+        if trace is not None and not (self._traces and self._traces[-1][0] is trace):  # Once per batch
+            self._traces.append((trace, time.time_ns()))
+        if (previous + len(rows)) // self.flush_rows > previous // self.flush_rows:
+            self.flush()
+
+    # Rows buffered and not written yet
+    @property
+    def pending(self):
+        return self._buffered
+
+    # Write the buffered rows now
+    def flush(self):
+        if not self._buffer:
+            return
+        frame = pd.DataFrame(np.concatenate([rows for rows, _ in self._buffer]), columns=self._columns)
+        for column in self._buffer[0][1]:
+            frame[column] = np.concatenate([extra[column] for _, extra in self._buffer])
+        self._buffer, self._buffered = [], 0
+        if self.format == 'csv':
+            frame.to_csv(self.path, mode='a' if self._initialized else 'w', header=not self._initialized, index=False)
+        else:
+            self._write_new_part(frame)
+        self._initialized = True
+        self.rows_written += len(frame)
+        print(f"{len(frame)} rows written to {self.path}")
+        traces, self._traces = self._traces, []
+        for trace, appended in traces:
+            trace.written('results', appended)
+
+    # Flush and wait for a running merge
+    def close(self):
+        self.flush()
+        if self._compactor is not None:
+            self._compactor.shutdown(wait=True)
+            self._compactor = None
+
+    # Flush and return the position of the output, so a restored App can rewind it (see multiflow.checkpoint)
+    def checkpoint(self):
+        self.flush()
+        if self._compaction is not None:
+            self._compaction.result()
+        size = os.path.getsize(self.path) if self.format == 'csv' and self._initialized else None
+        return {'rows_written': self.rows_written, 'parts_written': self.parts_written, 'next_part': self._next_part,
+                'initialized': self._initialized, 'size': size}
+
+    # Continue the output from a checkpoint: the rows written after it are removed (they will be written again)
+    def restore(self, snapshot):
+        self.rows_written = snapshot['rows_written']
+        self.parts_written = snapshot['parts_written']
+        self._next_part = snapshot['next_part']
+        self._initialized = snapshot['initialized']
+        if not self._initialized:
+            return
+        if self.format == 'csv':
+            if not os.path.exists(self.path):  # Output removed since: start it again, with its header
+                self._initialized = False
+                return
+            with open(self.path, 'r+b') as file:
+                file.truncate(snapshot['size'])
+            return
+        parts = list_parts(self.path)
+        if parts and parts[-1][1] >= self._next_part:
+            # Rows written after the checkpoint: keep the first rows_written rows as one merged part
+            frame = read_results(self.path).iloc[:self.rows_written]
+            for name in os.listdir(self.path):
+                if PART_PATTERN.match(name):
+                    os.remove(os.path.join(self.path, name))
+            if len(frame):
+                _write_part(frame, os.path.join(self.path, f"part-000001-{self._next_part - 1:06d}.{self.format}"), self.compression)
+
+    # Register a flush on the Faust App shutdown so buffered rows are not lost on stop
+    def attach(self, app):
+        @app.on_before_shutdown.connect
+        async def flush_result_sink(app, **kwargs):
+            self.close()
+        return flush_result_sink
+
+    def _write_new_part(self, frame):
+        if not self._initialized:
+            os.makedirs(self.path, exist_ok=True)
+            # Starting a new output, as the CSV mode does with mode='w'
+            for name in os.listdir(self.path):
+                if PART_PATTERN.match(name):
+                    os.remove(os.path.join(self.path, name))
+        part = self._next_part
+        self._next_part += 1
+        _write_part(frame, os.path.join(self.path, f"part-{part:06d}.{self.format}"), self.compression)
+        self.parts_written += 1
+        if self.compact_parts > 1 and (self._compaction is None or self._compaction.done()):
+            small = [p for p in list_parts(self.path) if p[0] == p[1]]
+            if len(small) >= self.compact_parts:
+                if self._compactor is None:
+                    self._compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='result-compaction')
+                self._compaction = self._compactor.submit(self._compact, small)
+
+    # Merge small parts into 'part-<first>-<last>', then delete them (readers skip covered parts meanwhile)
+    def _compact(self, parts):
+        try:
+            frames = [_read_part(os.path.join(self.path, name)) for _, _, name in parts]
+            first, last = parts[0][0], parts[-1][1]
+            _write_part(pd.concat(frames, ignore_index=True), os.path.join(self.path, f"part-{first:06d}-{last:06d}.{self.format}"), self.compression)
+            for _, _, name in parts:
+                os.remove(os.path.join(self.path, name))
+        except Exception as e:
+            print(f"Error merging result parts in {self.path}: {e}")
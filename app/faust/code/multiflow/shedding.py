@@ -0,0 +1,191 @@
+import functools
+import os
+import random
+import time
+import weakref
+
+# Load shedding: when the stream brings more lines per second than an App can score, its consumer lag grows without
+# bound and its results drift further and further behind the data. A LoadShedder watches how far behind the App is
+# (messages behind the end of its partitions, and the age of the events it reads) and, above a threshold, applies
+# the degradation policies of the instance, chosen by SheddingPolicy (comma-separated):
+#   'latest' - skip to the latest data: only the newest event of each key in a read is processed;
+#   'sample' - process a uniform sample of the events (SheddingSampleRate of them);
+#   'reservoir' - process at most SheddingReservoirSize events of each key per read, picked uniformly;
+#   'coalesce' - score the events of a key read at once as one batch, instead of BatchMaxEvents at a time;
+#   'defer_retrain' - retrain requests wait (the current model keeps scoring) until the App has caught up.
+# Shedding starts when the lag exceeds SheddingMaxLag or the event age exceeds SheddingMaxLatencyMs, and stops when
+# both are back under half of their threshold. Shed events are still committed, and counted per policy.
+# Without a policy (default) the events are processed as before.
+SheddingPolicy = os.getenv('SheddingPolicy', '')
+SheddingMaxLag = int(os.getenv('SheddingMaxLag', '10000'))  # Messages behind the end of the partitions (0: not used)
+SheddingMaxLatencyMs = float(os.getenv('SheddingMaxLatencyMs', '0'))  # Age of the events read (0: not used)
+SheddingSampleRate = float(os.getenv('SheddingSampleRate', '0.1'))
+SheddingReservoirSize = int(os.getenv('SheddingReservoirSize', '100'))
+SheddingReadEvents = int(os.getenv('SheddingReadEvents', '1000'))  # Events read at once while shedding
+
+SHEDDING_POLICIES = ('latest', 'sample', 'reservoir', 'coalesce', 'defer_retrain')
+
+
+# Function to parse a list of policies ('latest,defer_retrain'); 'none' or an empty string disables shedding
+def parse_policies(value):
+    names = value.split(',') if isinstance(value, str) else list(value or ())
+    policies = tuple(name.strip().lower() for name in names if name.strip() and name.strip().lower() != 'none')
+    for policy in policies:
+        if policy not in SHEDDING_POLICIES:
+            raise ValueError(f"Unknown shedding policy '{policy}' (expected {', '.join(SHEDDING_POLICIES)})")
+    return policies
+
+
+class LagMonitor:
+    """How far behind the stream an App is: the messages behind the end of the partitions it read (from the
+    consumer's highwater marks, when there is a consumer) and the age of the last event read (its Kafka timestamp)."""
+
+    def __init__(self):
+        self.offsets = {}  # Last offset read per partition
+        self.latency_ms = 0.0
+        self.consumer = None
+
+    def observe(self, events):
+        for event in events:
+            message = event.message
+            if message.offset is not None:
+                self.offsets[message.tp] = message.offset
+        timestamp = getattr(events[-1].message, 'timestamp', None) if events else None  # None in PipelineStream events
+        if timestamp:
+            self.latency_ms = max(0.0, (time.time() - timestamp) * 1000)
+
+    # Messages behind the end of the partitions read so far (0 without a consumer)
+    def lag(self):
+        lag = 0
+        if self.consumer is None:
+            return lag
+        for tp, offset in list(self.offsets.items()):
+            try:
+                highwater = self.consumer.highwater(tp)
+            except Exception:
+                continue
+            if highwater is not None and highwater >= 0:
+                lag += max(0, highwater - offset - 1)
+        return lag
+
+
+@functools.total_ordering
+class ReadLimit:
+    """Number of events to read at once that follows a LoadShedder: `max_events` while the App keeps up, and the
+    shedder's `read_events` while it sheds. Faust's `take_events` compares its buffer with the limit on every event,
+    so a read in progress picks up the change."""
+
+    def __init__(self, shedder, max_events):
+        self.shedder = shedder
+        self.max_events = max_events
+
+    def __int__(self):
+        return max(self.max_events, self.shedder.read_events) if self.shedder.overloaded else self.max_events
+
+    def __eq__(self, other):
+        return int(self) == other
+
+    def __lt__(self, other):
+        return int(self) < other
+
+
+class LoadShedder:
+    """Degradation policies of an App, applied to the events of each key while the App is behind (see above).
+
+    `update(events)` measures the lag with the events just read and switches shedding on or off; `shed(events)`
+    returns the events to process and `chunks(events, max_events)` the batches to score them in. `read_limit`
+    gives the number of events to read at once, which only grows to `read_events` while shedding. Background trainers
+    registered with `track_trainer` defer their retrains while shedding (with 'defer_retrain'), and fit the latest
+    deferred request once the App has caught up.
+    """
+
+    def __init__(self, policies=None, max_lag=None, max_latency_ms=None, sample_rate=None, reservoir_size=None,
+                 read_events=None, seed=None):
+        self.policies = parse_policies(SheddingPolicy if policies is None else policies)
+        self.max_lag = SheddingMaxLag if max_lag is None else int(max_lag)
+        self.max_latency_ms = SheddingMaxLatencyMs if max_latency_ms is None else float(max_latency_ms)
+        self.sample_rate = SheddingSampleRate if sample_rate is None else float(sample_rate)
+        self.reservoir_size = max(1, SheddingReservoirSize if reservoir_size is None else int(reservoir_size))
+        self.read_events = SheddingReadEvents if read_events is None else int(read_events)
+        self.monitor = LagMonitor()
+        self.random = random.Random(seed)
+        self.overloaded = False
+        self._app = None
+        self._trainers = weakref.WeakSet()
+
+        # Metrics
+        self.shed_events = {policy: 0 for policy in self.policies if policy in ('latest', 'sample', 'reservoir')}
+        self.kept_events = 0
+        self.coalesced_batches = 0
+        self.activations = 0
+        self.lag = 0
+
+    # Whether a policy is set
+    @property
+    def enabled(self):
+        return bool(self.policies)
+
+    # Number of events to read at once: `max_events`, or `read_events` while shedding (see ReadLimit)
+    def read_limit(self, max_events):
+        return ReadLimit(self, max_events)
+
+    # Whether retrains are deferred right now
+    def defers_retrains(self):
+        return self.overloaded and 'defer_retrain' in self.policies
+
+    # Measure the lag after reading `events` and switch shedding on (above a threshold) or off (under half of both)
+    def update(self, events):
+        self.monitor.observe(events)
+        if self.monitor.consumer is None and self._app is not None and self.monitor.offsets:
+            self.monitor.consumer = self._app.consumer
+        self.lag = self.monitor.lag()
+        latency_ms = self.monitor.latency_ms
+        if not self.overloaded:
+            if (self.max_lag > 0 and self.lag > self.max_lag) or (self.max_latency_ms > 0 and latency_ms > self.max_latency_ms):
+                self.overloaded = True
+                self.activations += 1
+                print(f"Load shedding on ({', '.join(self.policies)}): lag {self.lag} messages, event age {latency_ms:.0f} ms")
+        elif (self.max_lag <= 0 or self.lag <= self.max_lag / 2) and (self.max_latency_ms <= 0 or latency_ms <= self.max_latency_ms / 2):
+            self.overloaded = False
+            print(f"Load shedding off: lag {self.lag} messages, event age {latency_ms:.0f} ms, shed so far {self.shed_events}")
+            for trainer in list(self._trainers):
+                trainer.resume()
+        return self.overloaded
+
+    # Events of a key to process (all of them unless shedding), in their order
+    def shed(self, events):
+        if self.overloaded and events:
+            kept = events
+            if 'latest' in self.policies:
+                kept = kept[-1:]
+                self.shed_events['latest'] += len(events) - 1
+            if 'sample' in self.policies:
+                sampled = [event for event in kept if self.random.random() < self.sample_rate]
+                self.shed_events['sample'] += len(kept) - len(sampled)
+                kept = sampled
+            if 'reservoir' in self.policies and len(kept) > self.reservoir_size:
+                picked = sorted(self.random.sample(range(len(kept)), self.reservoir_size))
+                self.shed_events['reservoir'] += len(kept) - len(picked)
+                kept = [kept[i] for i in picked]
+            events = kept
+        self.kept_events += len(events)
+        return events
+
+    # Batches of at most `max_events` events to score (one batch of all of them when coalescing)
+    def chunks(self, events, max_events):
+        if not events:
+            return []
+        if self.overloaded and 'coalesce' in self.policies and len(events) > max_events:
+            self.coalesced_batches += 1
+            return [events]
+        max_events = max(1, max_events)
+        return [events[start:start + max_events] for start in range(0, len(events), max_events)]
+
+    # Let a BackgroundTrainer defer its retrains while shedding (it resumes when the App has caught up)
+    def track_trainer(self, trainer):
+        trainer.defer = self.defers_retrains
+        self._trainers.add(trainer)
+
+    # Read the consumer lag of the App (its consumer exists once the App is running)
+    def attach(self, app):
+        self._app = app
@@ -0,0 +1,137 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from multiflow.buffer import RingBuffer, column_names_for
+
+# Wide-to-long conversion for the Chronos Apps.
+# Every cell of the stream gets its own timestamp, one minute apart, in row-major order
+# (row 0 col1, row 0 col2, ..., row 1 col1, ...), starting from the App's start time.
+
+ONE_MINUTE_NS = 60 * 10**9
+
+
+# Function to turn the App start time into the base of the timestamp index (whole seconds, as before)
+def timestamp_base(start_time):
+    return pd.Timestamp(start_time).floor('s').as_unit('ns').value
+
+
+# Function to build the long DataFrame from per-cell item codes, timestamps (ns) and targets.
+# Every cell has its own increasing timestamp, so the MultiIndex codes are known up front and
+# the index is built directly instead of being factorized by set_index.
+def long_frame(column_names, item_codes, timestamps_ns, targets, index=False):
+    timestamps = pd.DatetimeIndex(timestamps_ns, name="timestamp")
+    if not index:
+        return pd.DataFrame({
+            "item_id": np.asarray(column_names, dtype=object)[item_codes],
+            "timestamp": timestamps,
+            "target": targets,
+        })
+    multi_index = pd.MultiIndex(
+        levels=[pd.Index(column_names, name="item_id"), timestamps],
+        codes=[item_codes, np.arange(len(targets))],
+        names=["item_id", "timestamp"],
+        verify_integrity=False,
+    )
+    return pd.DataFrame({"target": targets}, index=multi_index)
+
+
+# Function to convert wide rows (2-D array) into a long (item_id, timestamp, target) DataFrame with array operations.
+# `first_cell_index` is the minute offset of the first cell; with `index=True` (item_id, timestamp) becomes the index.
+def wide_to_long(rows, column_names, start_time, first_cell_index=0, index=False):
+    rows = np.asarray(rows, dtype=np.float64)
+    offsets = first_cell_index + np.arange(rows.size, dtype=np.int64)
+    item_codes = np.tile(np.arange(rows.shape[1]), len(rows))
+    return long_frame(column_names, item_codes, timestamp_base(start_time) + offsets * ONE_MINUTE_NS, rows.reshape(-1), index=index)
+
+
+class LongFormatWindow:
+    """Sliding long-format window of the last `max_rows` wide rows.
+
+    New rows are converted once, when they arrive, into (item, minute offset, target) cells that
+    are appended to a RingBuffer; `to_frame()` only materialises the current window.
+    Cell timestamps are fixed by the cell's global position in the stream, so a cell keeps the
+    same timestamp while it slides through the window.
+    """
+
+    def __init__(self, max_rows, start_time):
+        self.max_rows = int(max_rows)
+        self.base = timestamp_base(start_time)
+        self.column_names = None
+        self.rows_seen = 0
+        self._cells = None
+
+    # Number of wide rows currently in the window
+    def __len__(self):
+        return 0 if self._cells is None else len(self._cells) // len(self.column_names)
+
+    # Append new wide rows (1-D row or 2-D array)
+    def append(self, rows):
+        rows = np.asarray(rows, dtype=np.float64)
+        if rows.ndim == 1:
+            rows = rows.reshape(1, -1)
+        if self._cells is None:
+            self.column_names = column_names_for(rows.shape[1])
+            self._cells = RingBuffer(self.max_rows * rows.shape[1], num_columns=3)
+        elif rows.shape[1] != len(self.column_names):
+            raise ValueError(f"Expected {len(self.column_names)} values per row, got {rows.shape[1]}")
+
+        num_columns = rows.shape[1]
+        first_cell = self.rows_seen * num_columns
+        cells = np.empty((rows.size, 3))
+        cells[:, 0] = np.tile(np.arange(num_columns), len(rows))  # Item code
+        cells[:, 1] = first_cell + np.arange(rows.size)  # Minute offset from the start time
+        cells[:, 2] = rows.reshape(-1)  # Target
+        self._cells.extend(cells)
+        self.rows_seen += len(rows)
+
+    # Long-format DataFrame of the last `n` rows of the window (all of them by default)
+    def to_frame(self, n=None, index=True):
+        if self._cells is None:
+            return long_frame([], np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0), index=index)
+        cells = self._cells.last(None if n is None else n * len(self.column_names))
+        timestamps_ns = self.base + cells[:, 1].astype(np.int64) * ONE_MINUTE_NS
+        return long_frame(self.column_names, cells[:, 0].astype(np.int64), timestamps_ns, cells[:, 2], index=index)
+
+
+class Watermark:
+    """Latest timestamp published for each item of a long-format output (item_id and timestamp columns).
+
+    `newer()` keeps the rows of a result frame that are later than the watermark of their item and `advance()`
+    moves the watermarks past the rows written, so no (item, timestamp) row is written twice. `load()` advances
+    them over the rows already in a CSV output, e.g. rows written after the checkpoint an App was restored from.
+    """
+
+    def __init__(self):
+        self.latest = {}  # item_id -> latest timestamp written (ns)
+
+    def __len__(self):
+        return len(self.latest)
+
+    # Boolean mask of the (item_id, timestamp) pairs later than the watermark of their item
+    def mask(self, item_ids, timestamps):
+        timestamps = pd.DatetimeIndex(timestamps).as_unit('ns').asi8
+        limits = pd.Series(np.asarray(item_ids, dtype=object)).map(self.latest).fillna(np.iinfo(np.int64).min)
+        return timestamps > limits.to_numpy(dtype=np.int64)
+
+    # Rows of `frame` not written yet
+    def newer(self, frame):
+        if frame is None or frame.empty:
+            return frame
+        return frame[self.mask(frame["item_id"], frame["timestamp"])]
+
+    # Move the watermarks past the rows of `frame`
+    def advance(self, frame):
+        if frame is None or frame.empty:
+            return
+        latest = pd.Series(pd.DatetimeIndex(frame["timestamp"]).as_unit('ns').asi8, index=frame["item_id"].to_numpy())
+        for item, timestamp in latest.groupby(level=0).max().items():
+            self.latest[item] = max(self.latest.get(item, timestamp), timestamp)
+
+    # Advance the watermarks over the rows of an existing CSV output (read in chunks, only its two key columns)
+    def load(self, path, chunksize=100000):
+        if not os.path.exists(path):
+            return
+        for chunk in pd.read_csv(path, usecols=["item_id", "timestamp"], parse_dates=["timestamp"], chunksize=chunksize):
+            self.advance(chunk)
@@ -0,0 +1,236 @@
+import contextvars
+import os
+import socket
+import threading
+import time
+import uuid
+
+from multiflow.metrics import Histogram
+
+# End-to-end latency tracing: how old is the data an App writes? A producer stamps every message with optional Kafka
+# headers (so the 'rows', 'arrow' and JSON payloads do not change):
+#   mf-produced-ns - wall clock time the message was produced, in nanoseconds;
+#   mf-seq         - sequence number of the message in its topic partition, per producer;
+#   mf-source      - name of the producer (a new one on every start, so sequences restart cleanly).
+# The Python producer paths stamp them when TraceEvents is set (RowProducer) or with `--trace` (multiflow.replay).
+# KeyedState.batches hands the traces of each batch to the sinks through `current_trace`, and the sinks report when
+# the rows of the batch were written, so every traced event gets its latency per hop:
+#   kafka      - from produced to consumed by the App;
+#   process    - from consumed to queued in a sink (parsing, buffering, scoring);
+#   sink       - from queued to written by the sink (InfluxDB write, result file flush);
+#   end_to_end - from produced to written.
+# The latencies are aggregated into histograms, written every TraceFlushSeconds as the TraceMeasurement measurement
+# (one point per hop and sink, with the count, mean, quantiles and bucket counts of the interval), and exported on
+# /metrics. Gaps in the sequence numbers of a producer are reported as dropped events.
+# Clocks: hops that cross machines (kafka, end_to_end) are only as exact as the clock sync of producer and App.
+TraceEvents = os.getenv('TraceEvents', 'false').lower() in ('1', 'true', 'yes')  # Stamp messages in RowProducer
+TraceMeasurement = os.getenv('TraceMeasurement', 'multiflow_latency')
+TraceFlushSeconds = float(os.getenv('TraceFlushSeconds', '10'))
+
+PRODUCED_HEADER = 'mf-produced-ns'
+SEQUENCE_HEADER = 'mf-seq'
+SOURCE_HEADER = 'mf-source'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+current_trace = contextvars.ContextVar('multiflow_current_trace', default=None)  # TraceMark of the batch being processed
+
+
+class SequenceStamper:
+    """Trace headers for the messages of one producer: the produce time and a sequence number per topic partition."""
+
+    def __init__(self, source=None):
+        self.source = source or f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self.sequences = {}
+
+    # Headers of the next message sent to a topic partition (partition None: the producer does not pick one)
+    def headers(self, topic, partition=None):
+        sequence = self.sequences.get((topic, partition), 0)
+        self.sequences[(topic, partition)] = sequence + 1
+        return [(PRODUCED_HEADER, str(time.time_ns()).encode()), (SEQUENCE_HEADER, str(sequence).encode()),
+                (SOURCE_HEADER, self.source.encode())]
+
+
+# Function to read the trace headers of a Faust event: (source, sequence, produced ns), or None when it has none
+def event_trace(event):
+    headers = getattr(event, 'headers', None)
+    if not headers or PRODUCED_HEADER not in headers:
+        return None
+    try:
+        produced = int(headers[PRODUCED_HEADER])
+        sequence = int(headers[SEQUENCE_HEADER]) if SEQUENCE_HEADER in headers else None
+    except ValueError:
+        return None
+    source = headers.get(SOURCE_HEADER)
+    return source.decode('utf-8', 'replace') if isinstance(source, bytes) else source, sequence, produced
+
+
+# Function to estimate a quantile from the buckets of a Histogram (linear within the bucket; `maximum` for the last one)
+def histogram_quantile(histogram, quantile, maximum):
+    if histogram.count == 0:
+        return float('nan')
+    rank = quantile * histogram.count
+    cumulative, lower = 0, 0.0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        if count and cumulative + count >= rank:
+            return min(maximum, lower + (bound - lower) * (rank - cumulative) / count)
+        cumulative += count
+        lower = bound
+    return maximum
+
+
+# Function to record that the rows of the batch being processed were written by a synchronous sink (e.g. to_csv)
+def trace_written(sink):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.written(sink)
+
+
+class TraceMark:
+    """Traced events of a batch: when the batch was consumed and when each of its events was produced."""
+
+    __slots__ = ('tracer', 'consumed_ns', 'produced_ns', 'sinks')
+
+    def __init__(self, tracer, consumed_ns, produced_ns):
+        self.tracer = tracer
+        self.consumed_ns = consumed_ns
+        self.produced_ns = produced_ns
+        self.sinks = set()  # Sinks that already wrote rows of the batch
+
+    # Record that the rows of the batch were written by `sink` (queued in it at `enqueued_ns`); once per sink, when
+    # the first of them are written (rows of a batch may be split between two writes)
+    def written(self, sink, enqueued_ns=None):
+        if sink not in self.sinks:
+            self.sinks.add(sink)
+            self.tracer.written(self, sink, enqueued_ns)
+
+
+class LatencyTracer:
+    """Latency histograms and sequence gaps of the traced events of one App (see above).
+
+    `consumed(events)` is called with every batch read and `mark(events)` gives the TraceMark of the events a batch
+    processes; sinks call `TraceMark.written`, from any thread. The histograms of the last interval are written to
+    InfluxDB by `flush()` (every `flush_seconds`, and on shutdown once attached).
+    """
+
+    def __init__(self, name=None, measurement=None, flush_seconds=None, sink=None):
+        self.name = name
+        self.measurement = measurement or TraceMeasurement
+        self.flush_seconds = TraceFlushSeconds if flush_seconds is None else flush_seconds
+        self.sink = sink  # InfluxSink of the measurement (created on the first flush)
+        self.metrics = None  # AppMetrics that also gets the latencies (see AppMetrics.track_keyed_state)
+
+        # Totals (read them for monitoring)
+        self.traced_events = 0
+        self.dropped_events = 0
+        self.out_of_order_events = 0
+
+        self._lock = threading.Lock()  # Sinks report from their own threads
+        self._histograms = {}  # (hop, sink): Histogram of the current interval
+        self._maximum = {}
+        self._next_sequence = {}  # (source, partition): sequence number expected next
+        self._interval_dropped = 0
+        self._interval_out_of_order = 0
+        self._consumed_ns = 0
+        self._last_flush = time.monotonic()
+
+    # Record the Kafka hop and the sequence numbers of the events just read
+    def consumed(self, events):
+        now = time.time_ns()
+        self._consumed_ns = now
+        for event in events:
+            trace = event_trace(event)
+            if trace is None:
+                continue
+            source, sequence, produced = trace
+            self.traced_events += 1
+            self._observe('kafka', None, (now - produced) / 1e9)
+            if sequence is not None:
+                self._check_sequence((source, event.message.tp), sequence)
+        if time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+    # TraceMark of the events a batch processes (None when none of them is traced)
+    def mark(self, events):
+        produced = [trace[2] for trace in map(event_trace, events) if trace is not None]
+        return TraceMark(self, self._consumed_ns, produced) if produced else None
+
+    # Record the process, sink and end-to-end hops of the events of a mark written by `sink`
+    def written(self, mark, sink, enqueued_ns=None):
+        now = time.time_ns()
+        enqueued_ns = now if enqueued_ns is None else enqueued_ns
+        for produced in mark.produced_ns:
+            self._observe('process', sink, (enqueued_ns - mark.consumed_ns) / 1e9)
+            self._observe('sink', sink, (now - enqueued_ns) / 1e9)
+            self._observe('end_to_end', sink, (now - produced) / 1e9)
+
+    # Write the histograms of the interval since the last flush to InfluxDB
+    def flush(self):
+        with self._lock:
+            histograms, self._histograms = self._histograms, {}
+            maximum, self._maximum = self._maximum, {}
+            dropped, self._interval_dropped = self._interval_dropped, 0
+            out_of_order, self._interval_out_of_order = self._interval_out_of_order, 0
+            self._last_flush = time.monotonic()
+        if not histograms:
+            return
+        from multiflow.influx import InfluxSink, build_lines
+        if self.sink is None:
+            self.sink = InfluxSink()
+        timestamp = [time.time_ns()]
+        lines = []
+        for (hop, sink), histogram in sorted(histograms.items(), key=lambda item: (item[0][0], item[0][1] or '')):
+            fields = {'count': histogram.count, 'mean_ms': histogram.sum / histogram.count * 1000,
+                      'p50_ms': histogram_quantile(histogram, 0.5, maximum[(hop, sink)]) * 1000,
+                      'p90_ms': histogram_quantile(histogram, 0.9, maximum[(hop, sink)]) * 1000,
+                      'p99_ms': histogram_quantile(histogram, 0.99, maximum[(hop, sink)]) * 1000,
+                      'max_ms': maximum[(hop, sink)] * 1000}
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                fields[f'le_{bound * 1000:g}ms'] = cumulative
+            if hop == 'kafka':
+                fields.update(dropped=dropped, out_of_order=out_of_order)
+            tags = {'app': self.name or '', 'hop': hop, **({'sink': sink} if sink else {})}
+            lines += build_lines(self.measurement, [list(fields.values())], list(fields), tags=tags, timestamps=timestamp)
+        self.sink.write_lines(lines)
+
+    # Flush and stop the sink
+    def close(self):
+        self.flush()
+        if self.sink is not None:
+            self.sink.close()
+
+    # Name the measurement points after the App and flush them on the Faust App shutdown
+    def attach(self, app):
+        self.name = self.name or app.conf.id
+
+        @app.on_before_shutdown.connect
+        async def flush_latency_tracer(app, **kwargs):
+            self.close()
+        return flush_latency_tracer
+
+    def _observe(self, hop, sink, seconds):
+        with self._lock:
+            key = (hop, sink)
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(LATENCY_BUCKETS)
+                self._maximum[key] = seconds
+            self._histograms[key].observe(seconds)
+            self._maximum[key] = max(self._maximum[key], seconds)
+        if self.metrics is not None:
+            self.metrics.observe('multiflow_latency_seconds', seconds, LATENCY_BUCKETS, hop=hop, **({'sink': sink} if sink else {}))
+
+    # Count the events missing before `sequence` (dropped) or arriving after a later one (redelivered or late)
+    def _check_sequence(self, key, sequence):
+        expected = self._next_sequence.get(key)
+        if expected is None or sequence == expected:
+            self._next_sequence[key] = sequence + 1
+        elif sequence > expected:
+            missing = sequence - expected
+            self.dropped_events += missing
+            self._interval_dropped += missing
+            self._next_sequence[key] = sequence + 1
+            print(f"Sequence gap from producer {key[0]}: {missing} events missing before #{sequence}")
+        else:
+            self.out_of_order_events += 1
+            self._interval_out_of_order += 1
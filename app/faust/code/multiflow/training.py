@@ -0,0 +1,244 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Background (re)training shared by the detector Apps.
+# TrainingMode selects where periodic refits run:
+#   'thread' (default) - a worker thread, for estimators that release the GIL while fitting;
+#   'process' - a worker process (the fit function and its arguments must be picklable);
+#   'sync' - inside the agent, as before (labels are reproducible run to run).
+# The keyed Apps share one executor of TrainingWorkers workers between the trainers of all their keys.
+TrainingMode = os.getenv('TrainingMode', 'thread')
+TrainingWorkers = int(os.getenv('TrainingWorkers', '1'))
+
+
+# Function to create the executor used for a training mode (None for 'sync')
+def make_training_executor(mode, workers=None):
+    workers = workers or TrainingWorkers
+    if mode == 'sync':
+        return None
+    if mode == 'thread':
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='training')
+    if mode == 'process':
+        # Forked workers already have the App module loaded, so its fit functions can be pickled by name
+        method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+        executor.submit(int).result()  # Start the workers now, before the App starts its sink and checkpoint threads
+        return executor
+    raise ValueError(f"Unknown training mode '{mode}' (expected 'thread', 'process' or 'sync')")
+
+
+# Function to shut down a training executor shared by the trainers of an App on the Faust App shutdown
+# (waits for the running fits)
+def attach_training_executor(app, executor):
+    @app.on_before_shutdown.connect
+    async def close_training_executor(app, **kwargs):
+        if executor is not None:
+            executor.shutdown(wait=True)
+    return close_training_executor
+
+
+class BackgroundTrainer:
+    """Fits models off the event loop and swaps them in when they are ready (double buffering).
+
+    The agent keeps scoring with `model` while `fit(snapshot, *args)` runs on a copy of the
+    training window; the finished model replaces it in a single assignment. At most one fit
+    runs at a time: retrain requests made meanwhile are coalesced and only the latest one is
+    fitted once the running fit is done. While `defer()` is true (see LoadShedder.track_trainer) and there is a
+    model, requests are deferred instead: the latest one is submitted by `resume()`.
+    An `executor` given to the trainer may be shared with other trainers and is not shut down by `close()`.
+    """
+
+    def __init__(self, fit, mode=None, executor=None, name='model'):
+        self.fit = fit
+        self.mode = mode or TrainingMode
+        self.name = name
+        self._owns_executor = executor is None
+        self.executor = executor if executor is not None else make_training_executor(self.mode)
+        if self.executor is None:
+            self.mode = 'sync'
+
+        # Current model and metrics (read them for monitoring)
+        self.model = None
+        self.version = 0
+        self.model_row_count = 0  # Rows received when the current model's training window was taken
+        self.model_time = None  # When the current model was swapped in
+        self.fits = 0
+        self.failures = 0
+        self.coalesced = 0
+        self.last_fit_duration = 0.0
+        self.total_fit_duration = 0.0
+        self.last_error = None
+        self.on_swap = []  # Callbacks called with (duration, error) after each fit, e.g. AppMetrics.track_trainer
+        self.defer = None  # Callable telling whether retrains wait for now (e.g. LoadShedder.defers_retrains)
+        self.deferred = 0
+
+        self._lock = threading.RLock()  # Reentrant: a fit that is already done runs its callback right away
+        self._closed = False
+        self._future = None
+        self._next_request = None
+        self._deferred_request = None
+
+    # Whether a fit is running in the background
+    @property
+    def running(self):
+        return self._future is not None
+
+    # Request a fit on `data` (an array or DataFrame, copied so the caller may keep changing its buffer)
+    # taken at `row_count` rows.
+    # In 'sync' mode the model is fitted and swapped before returning; returns False if the request was coalesced
+    # or deferred.
+    def submit(self, data, row_count, *args):
+        request = (data.copy(), row_count, args)
+        if self.model is not None and self.defer is not None and self.defer():
+            self.deferred += 1
+            self._deferred_request = request
+            return False
+        self._deferred_request = None
+        return self._submit(request)
+
+    # Submit the latest deferred request, if any
+    def resume(self):
+        request, self._deferred_request = self._deferred_request, None
+        if request is None or self._closed:
+            return False
+        print(f"Deferred retraining of {self.name} resumed ({self.deferred} requests deferred so far)")
+        return self._submit(request)
+
+    def _submit(self, request):
+        if self.mode == 'sync':
+            self._swap(*self._run(request))
+            return True
+        with self._lock:
+            if self._future is not None:
+                if self._next_request is not None:
+                    self.coalesced += 1
+                self._next_request = request
+                return False
+            self._start(request)
+        return True
+
+    # Fit and swap in a model right away, in the calling thread (e.g. the small initial model)
+    def fit_now(self, data, row_count, *args):
+        self._swap(*self._run((data, row_count, args)))
+        return self.model
+
+    # Wait for the running fit (and the coalesced one after it, if any); returns False on timeout
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                future = self._future
+            if future is None:
+                return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            try:
+                future.result(remaining)
+            except Exception:
+                pass
+            time.sleep(0.001)  # Let the done callback swap the model in
+
+    # Await the running fit without blocking the event loop (used when there is no model to score with yet)
+    async def ready(self):
+        while self._future is not None:
+            future = self._future
+            try:
+                await asyncio.wrap_future(future)
+            except Exception:
+                pass
+            await asyncio.sleep(0)
+        return self.model
+
+    # Rows received since the current model's training window was taken
+    def staleness(self, row_count):
+        return row_count - self.model_row_count
+
+    # Snapshot of the training metrics
+    def metrics(self, row_count=None):
+        return {
+            'fits': self.fits,
+            'failures': self.failures,
+            'coalesced': self.coalesced,
+            'deferred': self.deferred,
+            'running': self.running,
+            'version': self.version,
+            'last_fit_seconds': self.last_fit_duration,
+            'mean_fit_seconds': self.total_fit_duration / self.fits if self.fits else 0.0,
+            'model_age_seconds': time.monotonic() - self.model_time if self.model_time is not None else None,
+            'staleness_rows': self.staleness(row_count) if row_count is not None else None,
+        }
+
+    # Current model and its metadata for a checkpoint (see multiflow.checkpoint); a running fit is not saved
+    def checkpoint(self):
+        return {'model': self.model, 'version': self.version, 'model_row_count': self.model_row_count}
+
+    # Swap in the model of a checkpoint
+    def restore(self, snapshot):
+        self.version = snapshot['version']
+        self.model_row_count = snapshot['model_row_count']
+        self.model_time = time.monotonic()
+        self.model = snapshot['model']
+
+    # Stop retraining: a fit still waiting for a worker is cancelled, and the executor is shut down (waiting for
+    # the running fit) unless it was given to the trainer
+    def close(self):
+        self._closed = True
+        with self._lock:
+            future, self._next_request = self._future, None
+        if future is not None:
+            future.cancel()
+        if self._owns_executor and self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+    # Register a shutdown of the executor on the Faust App shutdown
+    def attach(self, app):
+        @app.on_before_shutdown.connect
+        async def close_background_trainer(app, **kwargs):
+            self.close()
+        return close_background_trainer
+
+    def _start(self, request):
+        data, row_count, args = request
+        submitted = time.perf_counter()
+        self._future = self.executor.submit(self.fit, data, *args)
+        self._future.add_done_callback(lambda future: self._done(future, row_count, submitted))
+
+    def _run(self, request):
+        data, row_count, args = request
+        started = time.perf_counter()
+        try:
+            return self.fit(data, *args), row_count, time.perf_counter() - started, None
+        except Exception as e:
+            return None, row_count, time.perf_counter() - started, e
+
+    def _done(self, future, row_count, submitted):
+        if not future.cancelled():
+            error = future.exception()
+            model = None if error is not None else future.result()
+            self._swap(model, row_count, time.perf_counter() - submitted, error)
+        with self._lock:
+            self._future = None
+            request, self._next_request = self._next_request, None
+            if request is not None and not self._closed:
+                self._start(request)
+
+    def _swap(self, model, row_count, duration, error):
+        self.last_fit_duration = duration
+        for callback in self.on_swap:
+            callback(duration, error)
+        if error is not None:
+            self.failures += 1
+            self.last_error = repr(error)
+            print(f"Error training {self.name}: {error}")
+            return
+        self.fits += 1
+        self.total_fit_duration += duration
+        self.model_row_count = row_count
+        self.model_time = time.monotonic()
+        self.version += 1
+        self.model = model  # Atomic swap: the agent sees either the old or the new model
@@ -1,13 +1,129 @@
 import subprocess
 import os
-from flask import Flask, jsonify
+import json
+import re
+import shlex
+import threading
+import time
+import urllib.request
+import urllib.error
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, jsonify, Response
 from flask_cors import CORS
 from flask import request
 import signal
+from zygote import Zygote
 
 app = Flask(__name__)
 CORS(app)
 
+# Running Faust instances started by this server ({pid: {'name': ..., 'port': ..., 'launcher': ..., 'startup_seconds': ...}}),
+# scraped by /metrics and listed by /instances
+instances = {}
+MetricsPath = os.getenv('MetricsPath', '/metrics')
+MetricsTimeout = float(os.getenv('MetricsTimeout', '2'))
+ForwardTimeout = float(os.getenv('ForwardTimeout', '120'))  # Requests forwarded to an instance (adding a pipeline imports its App)
+
+# Instances are forked from a warm zygote (see zygote.py) that has already imported pandas, sklearn, frouros,
+# AutoGluon..., so starting one only costs the import of its App; 'shell' starts a new shell and interpreter for each.
+# Commands that need a shell (pipes, redirections, ...) or do not run faust always go through the shell.
+FaustLauncher = os.getenv('FaustLauncher', 'zygote')
+StartupTimeout = float(os.getenv('StartupTimeout', '300'))  # Seconds to wait for the web port of a new instance
+zygote = None
+zygote_failed = False
+zygote_lock = threading.Lock()
+shells = {}  # Shell-started instances ({pid: Popen}), polled so they do not stay zombies
+
+# Function to get the zygote, starting it when needed (None if disabled or if it could not start)
+def get_zygote():
+    global zygote, zygote_failed
+    if FaustLauncher != 'zygote':
+        return None
+    with zygote_lock:
+        if (zygote is None or not zygote.alive()) and not zygote_failed:
+            try:
+                zygote = Zygote().start()
+                print(f"Zygote preloaded {', '.join(zygote.preloaded)} in {zygote.preload_seconds:.1f} s")
+            except Exception as e:
+                print(f"Zygote unavailable, instances will be started with a shell: {e}")
+                zygote, zygote_failed = None, True
+        return zygote
+
+# Function to split a command into its leading NAME=value settings and its arguments; (None, None) if it needs a shell
+def parse_command(command):
+    if re.search(r'[;&|<>`$()\n]', command):
+        return None, None
+    try:
+        words = shlex.split(command)
+    except ValueError:
+        return None, None
+    env = {}
+    while words and re.match(r'[A-Za-z_][A-Za-z0-9_]*=', words[0]):
+        name, value = words.pop(0).split('=', 1)
+        env[name] = value
+    return env, words
+
+# Function to tell whether an instance is still running
+def instance_running(pid):
+    if pid in shells:
+        return shells[pid].poll() is None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except Exception:
+        pass
+    return True
+
+# Function to wait in the background until the web port of a new instance answers, and record its start-up time
+def wait_until_ready(pid, started):
+    instance = instances.get(pid)
+    while instance is not None and time.perf_counter() - started < StartupTimeout and instance_running(pid):
+        try:
+            urllib.request.urlopen(f"http://localhost:{instance['port']}/", timeout=1).close()
+        except urllib.error.HTTPError:
+            pass  # Any HTTP answer means the worker is up
+        except Exception:
+            time.sleep(0.1)
+            continue
+        instance['startup_seconds'] = time.perf_counter() - started
+        print(f"Instance {instance['name']} (PID {pid}) ready in {instance['startup_seconds']:.2f} s")
+        return
+    print(f"Instance (PID {pid}) did not become ready")
+
+# Function to merge the Prometheus texts of several instances: samples of the same metric are grouped
+# under a single HELP/TYPE header, as the text format requires
+def merge_metrics(texts):
+    families = {}
+    for text in texts:
+        current = None
+        for line in text.splitlines():
+            if line.startswith('# HELP ') or line.startswith('# TYPE '):
+                _, kind, name, *rest = line.split(' ', 3)
+                current = name
+                family = families.setdefault(name, {'HELP': None, 'TYPE': None, 'samples': []})
+                family[kind] = family[kind] or line
+            elif line and not line.startswith('#'):
+                name = re.match(r'[^{\s]+', line).group(0)
+                if current is None or not name.startswith(current):
+                    current = name
+                families.setdefault(current, {'HELP': None, 'TYPE': None, 'samples': []})['samples'].append(line)
+    lines = []
+    for family in families.values():
+        lines.extend(header for header in (family['HELP'], family['TYPE']) if header)
+        lines.extend(family['samples'])
+    return '\n'.join(lines) + '\n'
+
+# Function to fetch the metrics of one instance (None if it does not answer)
+def scrape_instance(port):
+    try:
+        with urllib.request.urlopen(f'http://localhost:{port}{MetricsPath}', timeout=MetricsTimeout) as response:
+            return response.read().decode('utf-8')
+    except Exception as e:
+        print(f"Error scraping metrics on port {port}: {e}")
+        return None
+
 @app.route('/list-python-files', methods=['GET'])
 def list_python_files():
     try:
@@ -50,22 +166,35 @@ def start_faust():
             print(f"Error executing preliminary command: {error_message}")
             return jsonify(status="Error", message=error_message), 500
 
-        # Command to start the Faust process
-        faust_command = f'{command}'
+        # Fork the Faust process from the zygote, or start it with a shell; either way it leads its own
+        # process group, so stopping it reaches every process it started
+        env, argv = parse_command(command)
+        launcher = get_zygote() if argv and argv[0] == 'faust' else None
+        started = time.perf_counter()
+        if launcher is not None:
+            pid, _ = launcher.spawn(argv, env, cwd='/app')
+            launched_by = 'zygote'
+        else:
+            process = subprocess.Popen(command, shell=True, cwd='/app', start_new_session=True)
+            pid = process.pid
+            shells[pid] = process
+            launched_by = 'shell'
+        launch_seconds = time.perf_counter() - started
 
-        # Start the Faust process using Popen
-        process = subprocess.Popen(faust_command, shell=True, cwd='/app')
+        # Remember the instance web port (the Port variable of the command) to aggregate its metrics
+        port = re.search(r'\bPort=(\d+)', command)
+        name = re.search(r'\bName=(\S+)', command)
+        instances[pid] = {'name': name.group(1) if name else str(pid), 'port': int(port.group(1)) if port else 6066,
+                          'launcher': launched_by, 'launch_seconds': launch_seconds, 'startup_seconds': None}
+        threading.Thread(target=wait_until_ready, args=(pid, started), daemon=True).start()
 
-        # Capture the PID of the process
-        pid = process.pid
-
-        print(f"Faust application started with PID: {pid}")
+        print(f"Faust application started with PID: {pid} ({launched_by}, {launch_seconds * 1000:.0f} ms)")
 
         # Write the PID to a text file
         #with open(f'{pid}.txt', 'w') as pid_file:
         #    pid_file.write(f"{pid} - {data.get('instanceName')}")
 
-        return jsonify(status="Running", pid=pid), 200
+        return jsonify(status="Running", pid=pid, launcher=launched_by, launch_seconds=launch_seconds), 200
 
     except Exception as e:
         error_message = str(e)
@@ -88,19 +217,25 @@ def stop_faust():
             return jsonify(status="Error", message="Invalid PID"), 400
 
         # Check if the process exists before attempting to kill it
-        try:
-            os.kill(pid, 0)
-        except ProcessLookupError:
+        if not instance_running(pid):
+            instances.pop(pid, None)
+            shells.pop(pid, None)
             return jsonify(status="Error", message="Process not found"), 404
-        except Exception as e:
-            return jsonify(status="Error", message=str(e)), 500
 
-        # Attempt to kill the process
+        # Terminate the process group of the instance (shell and worker alike); a process that does not
+        # lead its own group is terminated alone
         try:
-            os.kill(pid, signal.SIGTERM)
-            os.kill(pid+1, signal.SIGTERM) #kill process pid+1 (faust app)
+            if os.getpgid(pid) == pid:
+                os.killpg(pid, signal.SIGTERM)
+            else:
+                os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
         except Exception as e:
             return jsonify(status="Error", message=str(e)), 500
+        instances.pop(pid, None)
+        if pid in shells:
+            threading.Thread(target=shells.pop(pid).wait, daemon=True).start()
 
         return jsonify(status="Stopped", message=f"Process {pid} stopped successfully"), 200
 
@@ -108,5 +243,76 @@ def stop_faust():
         return jsonify(status="Error", message=str(e)), 400
 
 
+# Metrics of all running instances in one Prometheus text response (each sample keeps its app="<name>" label);
+# multiflow_instance_up tells which instances answered
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    for pid in list(instances):
+        if not instance_running(pid):
+            instances.pop(pid, None)
+            shells.pop(pid, None)
+
+    running = list(instances.items())
+    with ThreadPoolExecutor(max_workers=max(1, min(16, len(running)))) as executor:
+        texts = list(executor.map(lambda item: scrape_instance(item[1]['port']), running))
+
+    up = ['# HELP multiflow_instance_up Whether the instance answered the metrics scrape', '# TYPE multiflow_instance_up gauge']
+    for (pid, instance), text in zip(running, texts):
+        up.append(f'multiflow_instance_up{{app="{instance["name"]}",pid="{pid}",port="{instance["port"]}"}} {0 if text is None else 1}')
+    up += ['# HELP multiflow_instance_startup_seconds Seconds from the start request until the instance web port answered',
+           '# TYPE multiflow_instance_startup_seconds gauge']
+    up += [f'multiflow_instance_startup_seconds{{app="{instance["name"]}",launcher="{instance["launcher"]}"}} {instance["startup_seconds"]}'
+           for pid, instance in running if instance['startup_seconds'] is not None]
+    body = merge_metrics(['\n'.join(up)] + [text for text in texts if text])
+    return Response(body, mimetype='text/plain', headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+# Function to forward a request to the web port of an instance; returns (status, JSON answer)
+def forward_to_instance(pid, path, method='GET', body=None):
+    if pid not in instances:
+        return 404, {'error': f"No instance with PID {pid}"}
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    forwarded = urllib.request.Request(f"http://localhost:{instances[pid]['port']}{path}", data=data, method=method,
+                                       headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(forwarded, timeout=ForwardTimeout) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b'{}')
+
+# Pipelines of a multi-detector host instance (MultiDetector_Host.py): list them, or add one with a JSON spec
+# such as {"name": "iqr-fast", "app": "OutlierDetection_DynamicIQRMethod", "env": {"UpdateInterval": "10"}}
+@app.route('/pipelines/<int:pid>', methods=['GET', 'POST'])
+def pipelines(pid):
+    try:
+        if request.method == 'POST':
+            status, answer = forward_to_instance(pid, '/pipelines/', 'POST', request.get_json())
+        else:
+            status, answer = forward_to_instance(pid, '/pipelines/')
+        return jsonify(answer), status
+    except Exception as e:
+        return jsonify(status="Error", message=str(e)), 500
+
+# Remove a pipeline from a multi-detector host instance (its queued rows are processed and its sinks flushed first)
+@app.route('/pipelines/<int:pid>/<name>', methods=['DELETE'])
+def remove_pipeline(pid, name):
+    try:
+        status, answer = forward_to_instance(pid, f'/pipelines/{urllib.parse.quote(name)}/', 'DELETE')
+        return jsonify(answer), status
+    except Exception as e:
+        return jsonify(status="Error", message=str(e)), 500
+
+# Instances started by this server, with how they were launched and their start-up times
+@app.route('/instances', methods=['GET'])
+def list_instances():
+    running = [{'pid': pid, 'running': instance_running(pid), **instance} for pid, instance in list(instances.items())]
+    launcher = {'mode': FaustLauncher, 'ready': zygote is not None and zygote.alive(),
+                'preloaded': zygote.preloaded if zygote else [], 'preload_seconds': zygote.preload_seconds if zygote else None}
+    return jsonify(instances=running, launcher=launcher), 200
+
+# Warm the zygote up while the server starts, so the first instance does not wait for the preload
+threading.Thread(target=get_zygote, daemon=True).start()
+
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5010) #5010 #6066
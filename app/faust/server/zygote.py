@@ -0,0 +1,187 @@
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from multiprocessing.connection import Listener, Client
+
+# Warm launcher for the Faust instances ("zygote"): a single-threaded process that imports the heavy modules once
+# (ZygotePreload: numpy, pandas, sklearn, frouros, faust, AutoGluon, ...) and forks every new instance from itself,
+# so an instance only pays for importing its own App module instead of a cold interpreter and all of its libraries.
+# Each child starts a new session (its pid is also its process group id), so stopping an instance signals the
+# whole group instead of guessing the pid of the worker behind a shell.
+#
+# server.py starts the zygote with `Zygote().start()` and talks to it over a local socket:
+#   spawn(argv, env, cwd) -> (pid, seconds to fork)      wait(pid, timeout) -> exit code or None
+ZygotePreload = os.getenv('ZygotePreload', 'numpy,pandas,sklearn.ensemble,sklearn.svm,sklearn.preprocessing,scipy.stats,'
+                                           'frouros.detectors.data_drift,faust,faust.cli.faust,autogluon.timeseries')
+ZygoteSocket = os.getenv('ZygoteSocket')  # Unix socket path (default: one per server process in the temp folder)
+ZygoteStartTimeout = float(os.getenv('ZygoteStartTimeout', '120'))  # AutoGluon alone takes a while to import
+
+
+# Function to import the modules to share with the instances; a missing optional library is only reported
+def preload(modules):
+    loaded = []
+    for module in [module.strip() for module in modules.split(',') if module.strip()]:
+        try:
+            __import__(module)
+            loaded.append(module)
+        except Exception as e:
+            print(f"Zygote: not preloading {module}: {e}")
+    return loaded
+
+
+# Function to turn the forked child into the instance: own session, its environment and working folder, then the
+# command line (argv[0] 'faust' runs the Faust CLI in this interpreter, anything else is exec'd). Never returns.
+def run_child(argv, env, cwd):
+    code = 1
+    try:
+        os.setsid()
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        os.environ.update(env)
+        if cwd:
+            os.chdir(cwd)
+            sys.path.insert(0, cwd)  # Where `faust -A Module` finds the App, as with the faust script run from there
+        if argv[0] != 'faust':
+            os.execvp(argv[0], argv)
+        # Forked children would otherwise share the random state seeded when the zygote imported these modules
+        import random
+        random.seed()
+        if 'numpy' in sys.modules:
+            sys.modules['numpy'].random.seed()
+        sys.argv = list(argv)
+        from faust.cli.faust import cli
+        cli(args=argv[1:], prog_name='faust')
+        code = 0
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+class Zygote:
+    """Client of the zygote process, used by server.py (thread-safe: one request at a time)."""
+
+    def __init__(self, address=ZygoteSocket, preload=ZygotePreload):
+        self.address = address or os.path.join(tempfile.gettempdir(), f'multiflow-zygote-{os.getpid()}.sock')
+        self.preload = preload
+        self.authkey = os.urandom(16)
+        self.process = None
+        self.preloaded = []
+        self.preload_seconds = None
+        self._connection = None
+        self._lock = threading.Lock()
+
+    # Start the zygote process and wait until it has preloaded its modules
+    def start(self, timeout=ZygoteStartTimeout):
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        env = {**os.environ, 'ZygotePreload': self.preload, 'ZYGOTE_AUTHKEY': self.authkey.hex()}
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), self.address], env=env)
+        deadline = time.time() + timeout
+        while self._connection is None:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Zygote exited with code {self.process.returncode}")
+            if time.time() > deadline:
+                self.stop()
+                raise RuntimeError(f"Zygote not ready after {timeout} s")
+            try:
+                self._connection = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+            except (FileNotFoundError, ConnectionRefusedError):
+                time.sleep(0.05)
+        status = self._request({'op': 'status'})
+        self.preloaded, self.preload_seconds = status['preloaded'], status['preload_seconds']
+        return self
+
+    # Whether the zygote process is running
+    def alive(self):
+        return self.process is not None and self.process.poll() is None and self._connection is not None
+
+    def _request(self, message):
+        with self._lock:
+            self._connection.send(message)
+            reply = self._connection.recv()
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply
+
+    # Fork a new instance: returns (pid, seconds taken by the fork)
+    def spawn(self, argv, env=None, cwd=None):
+        reply = self._request({'op': 'spawn', 'argv': list(argv), 'env': dict(env or {}), 'cwd': cwd})
+        return reply['pid'], reply['seconds']
+
+    # Exit code of an instance, waiting up to `timeout` seconds (None while it is running or if unknown)
+    def wait(self, pid, timeout=0):
+        return self._request({'op': 'wait', 'pid': pid, 'timeout': timeout})['code']
+
+    def stop(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+
+
+# Function to run the zygote: preload, then serve spawn requests until the server disconnects
+def main(address):
+    start = time.perf_counter()
+    loaded = preload(ZygotePreload)
+    preload_seconds = time.perf_counter() - start
+    print(f"Zygote ready in {preload_seconds:.1f} s, preloaded: {', '.join(loaded)}")
+
+    exited = {}  # Exit codes of the reaped children
+
+    # Reap the instances as they exit, so no zombies remain and stopped pids really disappear
+    def reap(signum=None, frame=None):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            exited[pid] = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+
+    signal.signal(signal.SIGCHLD, reap)
+    listener = Listener(address, family='AF_UNIX', authkey=bytes.fromhex(os.environ['ZYGOTE_AUTHKEY']))
+    connection = listener.accept()
+    listener.close()  # A single client (the server); this also removes the socket file
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, OSError):
+            break
+        try:
+            if message['op'] == 'status':
+                reply = {'preloaded': loaded, 'preload_seconds': preload_seconds}
+            elif message['op'] == 'spawn':
+                begin = time.perf_counter()
+                pid = os.fork()
+                if pid == 0:
+                    connection.close()
+                    run_child(message['argv'], message['env'], message['cwd'])
+                reply = {'pid': pid, 'seconds': time.perf_counter() - begin}
+            elif message['op'] == 'wait':
+                deadline = time.time() + message['timeout']
+                while message['pid'] not in exited and time.time() < deadline:
+                    time.sleep(0.01)
+                    reap()
+                reply = {'code': exited.get(message['pid'])}
+            else:
+                reply = {'error': f"Unknown request {message['op']}"}
+        except Exception as e:
+            reply = {'error': str(e)}
+        connection.send(reply)
+    print("Zygote stopped (the running instances keep running)")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
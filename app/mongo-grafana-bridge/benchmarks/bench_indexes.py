@@ -0,0 +1,99 @@
+# Benchmark: latency of typical dashboard queries on a large results collection in a local mongod, without indexes,
+# with the time field index the bridge creates (AutoIndexTimeField) and with the compound indexes created by
+# POST /advisor from the recorded query shapes.
+# The collection is filled with --docs documents shaped like the detector results (see bench_query.py; one per
+# second), and every query is sent --requests times to the bridge's Flask app in this process.
+# It reports the p50/p99 latency and the winning plan of each query in each phase.
+#
+# Usage: python benchmarks/bench_indexes.py [--mongo mongodb://localhost:27017/] [--docs 1000000] [--requests 10]
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import timedelta
+
+import numpy as np
+import pymongo
+
+from bench_query import CODE, seed
+
+# Query name: query parameters (relative to the last hour / last day of the collection)
+QUERIES = {
+    'last_hour': {'from': '{hour}'},
+    'outliers_day': {'query': json.dumps({'outliers': 'yes'}), 'from': '{day}'},
+    'buckets_day': {'from': '{day}', 'maxDataPoints': '1000'},
+    'lttb_hour': {'from': '{hour}', 'mode': 'lttb', 'maxDataPoints': '500', 'fields': 'col1'},
+}
+
+
+# Function to send each query `requests` times; returns {query: (p50 ms, p99 ms, documents, winning plan)}.
+# The recorded shapes are cleared before each query, so the advisor report then holds that query only.
+def run_queries(client, query_shapes, parameters, requests):
+    results = {}
+    for name, query_parameters in parameters.items():
+        query_shapes.shapes.clear()
+        latencies = []
+        for _ in range(requests):
+            begin = time.perf_counter()
+            response = client.get('/query', query_string=query_parameters)
+            documents = len(json.loads(response.get_data()))
+            latencies.append(time.perf_counter() - begin)
+            if response.status_code != 200:
+                raise RuntimeError(f"{name}: {response.get_data(as_text=True)}")
+        report = json.loads(client.get('/advisor', query_string={'slowMs': 0}).get_data())
+        plan = report[0]['explain'].get('plan', report[0]['explain'].get('error')) if report else '?'
+        results[name] = (np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000, documents, plan)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Dashboard query latency with and without indexes.')
+    parser.add_argument('--mongo', default='mongodb://localhost:27017/', help='local mongod used for the test data')
+    parser.add_argument('--database', default='multiflow_bench')
+    parser.add_argument('--collection', default='bench_indexes')
+    parser.add_argument('--docs', type=int, default=1000000)
+    parser.add_argument('--requests', type=int, default=10, help='requests per query and phase')
+    parser.add_argument('--reuse', action='store_true', help='keep the collection when it already has --docs documents')
+    args = parser.parse_args()
+
+    collection = pymongo.MongoClient(args.mongo)[args.database][args.collection]
+    if not (args.reuse and collection.estimated_document_count() == args.docs):
+        begin = time.perf_counter()
+        seed(collection, args.docs)
+        print(f"Inserted {args.docs} documents in {time.perf_counter() - begin:.1f}s")
+    collection.drop_indexes()
+    hour = collection.find_one(sort=[('timestamp', pymongo.DESCENDING)])['timestamp'] - timedelta(hours=1)
+    day = hour - timedelta(hours=23)
+
+    os.environ['MONGODB_URL'] = args.mongo
+    os.environ['AutoIndexTimeField'] = 'false'  # Phase 1 runs without any index
+    sys.path.insert(0, CODE)
+    import app as bridge
+    import indexing
+
+    client = bridge.create_app().test_client()
+    parameters = {name: {'database': args.database, 'collection': args.collection,
+                         **{key: value.replace('{hour}', hour.strftime('%Y-%m-%dT%H:%M:%SZ')).replace('{day}', day.strftime('%Y-%m-%dT%H:%M:%SZ'))
+                            for key, value in query.items()}}
+                  for name, query in QUERIES.items()}
+
+    phases = {'no index': run_queries(client, bridge.query_shapes, parameters, args.requests)}
+
+    indexing.AutoIndexTimeField = True
+    indexing.ensure_time_index(collection, 'timestamp')
+    phases['time index'] = run_queries(client, bridge.query_shapes, parameters, args.requests)
+
+    # Every query once more, so that the advisor sees all the shapes
+    for query_parameters in parameters.values():
+        client.get('/query', query_string=query_parameters)
+    created = json.loads(client.post('/advisor', query_string={'slowMs': 0}).get_data())
+    print(f"Indexes created by the advisor: {[item['created_index'] for item in created if 'created_index' in item]}")
+    phases['advisor'] = run_queries(client, bridge.query_shapes, parameters, args.requests)
+
+    print(f"{args.docs} documents, {args.requests} requests per query")
+    print(f"{'query':>13} {'phase':>11} {'p50 ms':>9} {'p99 ms':>9} {'docs':>6}  plan")
+    for name in QUERIES:
+        for phase, results in phases.items():
+            p50, p99, documents, plan = results[name]
+            print(f"{name:>13} {phase:>11} {p50:9.1f} {p99:9.1f} {documents:6d}  {plan}")
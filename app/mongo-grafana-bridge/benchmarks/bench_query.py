@@ -0,0 +1,139 @@
+# Load test of the /query route of the mongo-grafana-bridge against a local mongod.
+# The collection is filled with --docs documents shaped like the detector results (a timestamp, numeric columns and a
+# label), then --clients concurrent clients send --requests queries each, as Grafana panels refreshing together would.
+# Unless --url is given, the bridge runs in this process on a threaded server, next to the previous implementation
+# (a new MongoClient per request, the whole result listed and serialised at once) for comparison.
+# It reports requests/s, p50/p99 latency and response size for each query (buckets_1000 and lttb_1000 are the
+# downsampled series a Grafana panel of 1000 points asks for; compare them with full).
+#
+# Usage: python benchmarks/bench_query.py [--mongo mongodb://localhost:27017/] [--docs 20000] [--clients 8] [--requests 20]
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import pymongo
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+CODE = os.path.join(BENCHMARKS, '..', 'code')
+
+# Query name: extra query parameters
+QUERIES = {
+    'full': {},
+    'last_hour': {'query': json.dumps({'timestamp': {'$gte': {'$date': '{since}'}}})},
+    'page_500': {'limit': '500', 'skip': '1000'},
+    'projection': {'projection': 'timestamp,col1'},
+    'buckets_1000': {'maxDataPoints': '1000'},
+    'lttb_1000': {'mode': 'lttb', 'maxDataPoints': '1000', 'fields': 'col1'},
+}
+
+
+# Function to fill the benchmark collection (dropped first)
+def seed(collection, docs):
+    collection.drop()
+    start = datetime(2024, 1, 1)
+    rng = np.random.default_rng(42)
+    values = rng.normal(50, 10, size=(docs, 5))
+    batch = []
+    for i in range(docs):
+        document = {'timestamp': start + timedelta(seconds=i), 'outliers': 'yes' if i % 50 == 0 else 'no'}
+        document.update({f'col{j + 1}': float(values[i, j]) for j in range(5)})
+        batch.append(document)
+        if len(batch) == 5000:
+            collection.insert_many(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch)
+    return start + timedelta(seconds=docs - 3600)
+
+
+# Function to add the previous /query implementation to a Flask app, as /legacy_query
+def add_legacy_route(app, mongo_url):
+    from flask import request, jsonify
+    from bson import json_util
+
+    @app.route('/legacy_query', methods=['GET'])
+    def legacy_query():
+        try:
+            client = pymongo.MongoClient(mongo_url)
+            collection = client[request.args.get('database')][request.args.get('collection')]
+            query = request.args.get('query')
+            result = list(collection.find(json_util.loads(query) if query else {}, projection={'_id': False}))
+            for item in result:
+                if isinstance(item.get('timestamp'), datetime):
+                    item['timestamp'] = item['timestamp'].strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            return json_util.dumps(result), 200, {'Content-Type': 'application/json'}
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+
+# Function to start the bridge in this process on a threaded server; returns its base URL
+def serve(mongo_url, port):
+    os.environ['MONGODB_URL'] = mongo_url
+    sys.path.insert(0, CODE)
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    import app as bridge
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    app = bridge.create_app()
+    add_legacy_route(app, mongo_url)
+    server = make_server('127.0.0.1', port, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+# Function to send `requests` requests from each of `clients` threads; returns (latencies in s, bytes, seconds)
+def load(url, clients, requests):
+    def client(_):
+        latencies, size = [], 0
+        for _ in range(requests):
+            begin = time.perf_counter()
+            with urllib.request.urlopen(url, timeout=300) as response:
+                size = len(response.read())
+            latencies.append(time.perf_counter() - begin)
+        return latencies, size
+
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        results = list(executor.map(client, range(clients)))
+    return np.concatenate([latencies for latencies, _ in results]), results[0][1], time.perf_counter() - begin
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test of the mongo-grafana-bridge /query route.')
+    parser.add_argument('--mongo', default='mongodb://localhost:27017/', help='local mongod used for the test data')
+    parser.add_argument('--url', help='running bridge to test (default: start one in this process, with the legacy route)')
+    parser.add_argument('--database', default='multiflow_bench')
+    parser.add_argument('--collection', default='bench_query')
+    parser.add_argument('--docs', type=int, default=20000)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=20, help='requests per client')
+    parser.add_argument('--queries', default=','.join(QUERIES), help=f"comma-separated queries ({','.join(QUERIES)})")
+    parser.add_argument('--port', type=int, default=0)
+    args = parser.parse_args()
+
+    since = seed(pymongo.MongoClient(args.mongo)[args.database][args.collection], args.docs)
+    base = args.url.rstrip('/') if args.url else serve(args.mongo, args.port)
+    routes = ['query'] if args.url else ['legacy_query', 'query']
+
+    print(f"{args.docs} documents, {args.clients} clients x {args.requests} requests")
+    print(f"{'query':>11} {'route':>13} {'req/s':>7} {'p50 ms':>8} {'p99 ms':>8} {'KB':>8}")
+    for name in args.queries.split(','):
+        parameters = {'database': args.database, 'collection': args.collection}
+        parameters.update({key: value.replace('{since}', since.strftime('%Y-%m-%dT%H:%M:%SZ')) for key, value in QUERIES[name].items()})
+        for route in routes:
+            if route == 'legacy_query' and set(parameters) - {'database', 'collection', 'query'}:
+                continue  # Not supported by the previous implementation
+            latencies, size, seconds = load(f"{base}/{route}?{urllib.parse.urlencode(parameters)}", args.clients, args.requests)
+            print(f"{name:>11} {route:>13} {len(latencies) / seconds:7.1f} {np.percentile(latencies, 50) * 1000:8.1f} "
+                  f"{np.percentile(latencies, 99) * 1000:8.1f} {size / 1024:8.0f}")
@@ -1,29 +1,159 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 import pymongo
 import json
+import os
+import threading
+import time
 from bson import json_util
 from datetime import datetime
 
-def create_app():
-    app = Flask(__name__)
+from downsampling import parse_time, parse_interval, bucket_milliseconds, bucket_pipeline, lttb_documents, numeric_fields
+from indexing import QueryShapes, ensure_time_index, suggest_index, index_exists, explain_query
+
+# MongoDB connection: one pooled client per process (MongoPoolSize connections at most), shared by all requests
+mongodb_url = os.getenv('MONGODB_URL', 'mongodb://mongodb_server:27017/')
+MongoPoolSize = int(os.getenv('MongoPoolSize', '50'))
+
+# Query limits: documents per response when no `limit` is given (0 for no limit), and documents fetched per
+# round trip and serialised per chunk of the streamed response
+QueryDefaultLimit = int(os.getenv('QueryDefaultLimit', '0'))
+QueryBatchSize = int(os.getenv('QueryBatchSize', '1000'))
+
+_client = None
+_client_lock = threading.Lock()
+
+# Shapes and latencies of the queries served by this process (see indexing.py and the /advisor route)
+query_shapes = QueryShapes()
+
+
+# Function to get the MongoDB client of this process (created on first use, so every server worker process has its own)
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = pymongo.MongoClient(mongodb_url, maxPoolSize=MongoPoolSize, connect=False)
+    return _client
+
+
+# Function to read an optional non-negative integer query parameter
+def int_argument(name, default):
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    value = int(value)
+    if value < 0:
+        raise ValueError(f"'{name}' must not be negative")
+    return value
+
+
+# Function to read the projection parameter: a JSON projection ({"field": 1, ...}) or a comma-separated field list
+def projection_argument():
+    projection = request.args.get('projection')
+    if not projection:
+        return {'_id': False}
+    if projection.lstrip().startswith('{'):
+        projection = json.loads(projection)
+    else:
+        projection = {field.strip(): True for field in projection.split(',') if field.strip()}
+    return {'_id': False, **projection}
+
+
+# Function to read the `fields` parameter (comma-separated fields to downsample), None when not given
+def fields_argument():
+    fields = request.args.get('fields')
+    return [field.strip() for field in fields.split(',') if field.strip()] if fields else None
+
+
+# Function to add the time range (`from`/`to`, epoch milliseconds or ISO 8601) on the time field to a filter
+def time_range_filter(query, time_field):
+    time_range = {}
+    if request.args.get('from'):
+        time_range['$gte'] = parse_time(request.args.get('from'))
+    if request.args.get('to'):
+        time_range['$lte'] = parse_time(request.args.get('to'))
+    if not time_range:
+        return query
+    return {'$and': [query, {time_field: time_range}]} if query else {time_field: time_range}
 
-    # Function to connect to MongoDB based on the provided information
-    def connect_to_mongodb(database_name, collection_name):
-        try:
-            client = pymongo.MongoClient("mongodb://mongodb_server:27017/")
-            db = client[database_name]
-            collection = db[collection_name]
-            return collection
-        except Exception as e:
-            raise Exception(f"Error connecting to MongoDB: {str(e)}")
 
-    def format_timestamp(result):
-        for item in result:
-            if "timestamp" in item:
-                timestamp = item["timestamp"]
-                if isinstance(timestamp, datetime):
-                    item["timestamp"] = timestamp.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+# Function to find the first and last time of the matching documents (used when the request gives no time range)
+def time_bounds(collection, match, time_field):
+    first = collection.find_one(match, projection={'_id': False, time_field: True}, sort=[(time_field, pymongo.ASCENDING)])
+    last = collection.find_one(match, projection={'_id': False, time_field: True}, sort=[(time_field, pymongo.DESCENDING)])
+    if not first or not isinstance(first.get(time_field), datetime):
+        return None, None
+    return first[time_field], last[time_field]
 
+
+# Function to answer an aggregated query: MongoDB groups the matching documents into at most maxDataPoints time
+# buckets (or buckets of `interval`) with the count and the mean, min and max of each numeric field
+def aggregated_response(collection, match, time_field, fields, max_points, interval_ms):
+    start, end = (parse_time(request.args['from']) if request.args.get('from') else None,
+                  parse_time(request.args['to']) if request.args.get('to') else None)
+    if start is None or end is None:
+        first, last = time_bounds(collection, match, time_field)
+        if first is None:
+            return '[]', 200, {'Content-Type': 'application/json'}
+        start, end = start or first, end or last
+    if fields is None:
+        fields = numeric_fields(collection.find_one(match, projection={'_id': False}), time_field)
+
+    size_ms = bucket_milliseconds(start, end, max_points, interval_ms)
+    cursor = collection.aggregate(bucket_pipeline(match, time_field, fields, size_ms), batchSize=QueryBatchSize, allowDiskUse=True)
+    first = next(cursor, None)
+    if first is None:
+        return '[]', 200, {'Content-Type': 'application/json'}
+    return Response(stream_documents(first, cursor, time_field), content_type='application/json')
+
+
+# Function to answer a raw query downsampled with LTTB to about maxDataPoints documents per field
+def lttb_response(collection, match, time_field, fields, projection, max_points):
+    if len(projection) > 1 and not any(value is False or value == 0 for field, value in projection.items() if field != '_id'):
+        projection = {**projection, time_field: True}  # The time field is needed to downsample
+    cursor = collection.find(match, projection=projection, sort=[(time_field, pymongo.ASCENDING)], batch_size=QueryBatchSize)
+    try:
+        documents = list(cursor)
+    finally:
+        cursor.close()
+    if fields is None:
+        fields = numeric_fields(documents[0] if documents else None, time_field)
+    documents = lttb_documents(documents, time_field, fields, max_points)
+    body = '[' + ','.join(json_util.dumps(format_timestamp(document, time_field)) for document in documents) + ']'
+    return body, 200, {'Content-Type': 'application/json'}
+
+
+def format_timestamp(item, time_field="timestamp"):
+    timestamp = item.get(time_field)
+    if isinstance(timestamp, datetime):
+        item[time_field] = timestamp.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    return item
+
+
+# Function to stream the documents of a cursor as one JSON array, QueryBatchSize documents per chunk
+# (the cursor is closed when the client goes away before the end)
+def stream_documents(first, cursor, time_field="timestamp"):
+    try:
+        chunk = ['[', json_util.dumps(format_timestamp(first, time_field))]
+        for count, document in enumerate(cursor, 1):
+            chunk.append(',')
+            chunk.append(json_util.dumps(format_timestamp(document, time_field)))
+            if count % QueryBatchSize == 0:
+                yield ''.join(chunk)
+                chunk = []
+        chunk.append(']')
+        yield ''.join(chunk)
+    finally:
+        cursor.close()
+
+
+def create_app():
+    app = Flask(__name__)
+
+    # Query parameters: database, collection, query (JSON filter), projection, limit and skip (pagination).
+    # Time series parameters: timeField (default timestamp), from and to (time range), maxDataPoints and interval
+    # (Grafana's $__interval, or intervalMs), mode (aggregate, the default when maxDataPoints or interval is given;
+    # lttb, raw documents downsampled to maxDataPoints; raw) and fields (fields to downsample, default: numeric ones)
     @app.route('/query', methods=['GET'])
     def run_query():
         try:
@@ -34,23 +164,82 @@ def create_app():
             if not database_name or not collection_name:
                 return jsonify({'error': 'Insufficient data'}), 400
 
-            collection = connect_to_mongodb(database_name, collection_name)
+            try:
+                query = json_util.loads(query) if query else {}  # Extended JSON, e.g. {"timestamp": {"$gte": {"$date": ...}}}
+                projection = projection_argument()
+                limit = int_argument('limit', QueryDefaultLimit)
+                skip = int_argument('skip', 0)
+                time_field = request.args.get('timeField') or 'timestamp'
+                query = time_range_filter(query, time_field)
+                max_points = int_argument('maxDataPoints', 0)
+                interval = request.args.get('interval') or request.args.get('intervalMs')
+                interval_ms = parse_interval(interval) if interval else 0
+                mode = request.args.get('mode') or ('aggregate' if max_points or interval_ms else 'raw')
+                if mode not in ('aggregate', 'lttb', 'raw'):
+                    raise ValueError(f"unknown mode '{mode}'")
+                if mode == 'lttb' and not max_points:
+                    raise ValueError("mode 'lttb' needs 'maxDataPoints'")
+                if mode == 'aggregate' and not (max_points or interval_ms):
+                    raise ValueError("mode 'aggregate' needs 'maxDataPoints' or 'interval'")
+                fields = fields_argument()
+            except ValueError as e:
+                return jsonify({'error': f"Invalid parameter: {e}"}), 400
 
-            if query:
-                query = json.loads(query)  # Convert the query string to a dictionary
-            else:
-                query = {}  # Create an empty dictionary if the query is missing
+            collection = get_client()[database_name][collection_name]
+            try:
+                ensure_time_index(collection, time_field)
+            except pymongo.errors.PyMongoError as e:
+                print(f"Could not index {database_name}.{collection_name} on {time_field}: {e}")
 
-            # Execute the query in MongoDB
-            result = list(collection.find(query, projection={'_id': False}))
+            # The latency recorded for the query shape is the time to the first batch of results
+            begin = time.perf_counter()
+            if mode == 'aggregate':
+                response = aggregated_response(collection, query, time_field, fields, max_points, interval_ms)
+                query_shapes.record(database_name, collection_name, query, time.perf_counter() - begin, mode=mode)
+                return response
+            if mode == 'lttb':
+                response = lttb_response(collection, query, time_field, fields, projection, max_points)
+                query_shapes.record(database_name, collection_name, query, time.perf_counter() - begin, time_field, mode)
+                return response
 
-            # Format the "timestamp" field in the documents
-            format_timestamp(result)
+            # Execute the query in MongoDB; the first batch is fetched here, so query errors are still reported as errors
+            cursor = collection.find(query, projection=projection, skip=skip, limit=limit, batch_size=QueryBatchSize)
+            first = next(cursor, None)
+            query_shapes.record(database_name, collection_name, query, time.perf_counter() - begin)
+            if first is None:
+                return '[]', 200, {'Content-Type': 'application/json'}
 
-            # Convert the result to JSON using json_util
-            result_json = json_util.dumps(result)
+            # The rest is serialised while it is read from the cursor, without holding the whole result in memory
+            return Response(stream_documents(first, cursor), content_type='application/json')
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    # Index advisor: the recorded query shapes (of database/collection when given) whose mean latency is at least
+    # slowMs (default SlowQueryMs), slowest first, each with the explain() summary of its last query and the compound
+    # index suggested for it. POST creates the suggested indexes that do not exist yet.
+    @app.route('/advisor', methods=['GET', 'POST'])
+    def advisor():
+        try:
+            try:
+                slow_ms = float(request.args['slowMs']) if request.args.get('slowMs') else None
+            except ValueError as e:
+                return jsonify({'error': f"Invalid parameter: {e}"}), 400
 
-            return result_json, 200, {'Content-Type': 'application/json'}
+            report = []
+            for item in query_shapes.slow(request.args.get('database'), request.args.get('collection'), slow_ms):
+                collection = get_client()[item['database']][item['collection']]
+                keys = suggest_index(item['query'], item['sort'])
+                item['suggested_index'] = [field for field, _ in keys]
+                item['index_exists'] = not keys or index_exists(collection, keys)
+                if request.method == 'POST' and not item['index_exists']:
+                    item['created_index'] = collection.create_index(keys)
+                    item['index_exists'] = True
+                try:
+                    item['explain'] = explain_query(collection, item['query'], item['sort'])
+                except pymongo.errors.PyMongoError as e:
+                    item['explain'] = {'error': str(e)}
+                report.append(item)
+            return json_util.dumps(report), 200, {'Content-Type': 'application/json'}
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
@@ -58,4 +247,4 @@ def create_app():
 
 if __name__ == '__main__':
     app = create_app()
-    app.run(debug=True, host='0.0.0.0', port=8081)
+    app.run(debug=True, host='0.0.0.0', port=8081, threaded=True)
@@ -0,0 +1,105 @@
+import re
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Downsampling of time series for Grafana panels: a panel can only draw about `maxDataPoints` points, so long time
+# ranges are either aggregated by MongoDB into that many time buckets (mean/min/max/count of every numeric field)
+# or, for raw points, reduced with LTTB (Largest-Triangle-Three-Buckets), which keeps the points that shape the line.
+
+EPOCH = datetime(1970, 1, 1)
+INTERVAL_UNITS = {'ms': 1, 's': 1000, 'm': 60000, 'h': 3600000, 'd': 86400000, 'w': 604800000}
+
+
+# Function to parse a time given as epoch milliseconds (Grafana's ${__from}) or ISO 8601; returns a naive UTC datetime
+def parse_time(value):
+    if re.fullmatch(r'-?\d+', value.strip()):
+        return datetime.fromtimestamp(int(value) / 1000.0, timezone.utc).replace(tzinfo=None)
+    parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+# Function to parse an interval ('500ms', '30s', '5m', '1h', '1d', '1w' or plain milliseconds) into milliseconds
+def parse_interval(value):
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*(ms|s|m|h|d|w)?\s*', value)
+    if not match:
+        raise ValueError(f"Invalid interval '{value}'")
+    milliseconds = int(float(match.group(1)) * INTERVAL_UNITS[match.group(2) or 'ms'])
+    if milliseconds <= 0:
+        raise ValueError(f"Invalid interval '{value}'")
+    return milliseconds
+
+
+# Function to pick the bucket size in milliseconds: the interval when given, widened when needed so that the time range
+# never spans more than max_points buckets (buckets are aligned to the epoch, so that they stay the same between
+# refreshes, and a range of `span` milliseconds touches at most ceil(span / size) + 1 of them)
+def bucket_milliseconds(start, end, max_points=None, interval_ms=None):
+    span = max(0, int((end - start).total_seconds() * 1000))
+    size = interval_ms or 1
+    if max_points:
+        size = max(size, -(-span // max(1, max_points - 1)))
+    return size
+
+
+# Function to build the aggregation pipeline that groups the matching documents into time buckets of `size_ms`
+# (aligned to the epoch), with the count and the mean, min and max of each field; buckets without documents are omitted.
+# Date arithmetic (date - date and date - milliseconds) keeps it usable before MongoDB 5's $dateTrunc.
+def bucket_pipeline(match, time_field, fields, size_ms):
+    epoch_ms = {'$subtract': [f'${time_field}', EPOCH]}
+    group = {'_id': {'$subtract': [f'${time_field}', {'$mod': [epoch_ms, size_ms]}]}, 'count': {'$sum': 1}}  # Bucket start
+    project = {'_id': False, time_field: '$_id', 'count': True}
+    for field in fields:
+        for statistic in ('avg', 'min', 'max'):
+            name = f"{field}_{'mean' if statistic == 'avg' else statistic}"
+            group[name] = {f'${statistic}': f'${field}'}
+            project[name] = True
+    return [{'$match': match}, {'$group': group}, {'$sort': {'_id': 1}}, {'$project': project}]
+
+
+# Function to select `threshold` points of a series with LTTB; returns the indices of the kept points (sorted).
+# The first and last points are always kept; every bucket in between keeps the point forming the largest triangle
+# with the point kept in the previous bucket and the average of the next bucket.
+def lttb_indices(x, y, threshold):
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n) if threshold >= n else np.array([0, n - 1][:max(threshold, 0)], dtype=np.int64)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)  # Buckets of the points between first and last
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        next_start, next_stop = stop, edges[bucket + 2] if bucket + 2 < len(edges) else n
+        average_x = x[next_start:next_stop].mean()
+        average_y = y[next_start:next_stop].mean()
+        # Twice the triangle areas (the constant factor does not change the argmax)
+        areas = np.abs((x[previous] - average_x) * (y[start:stop] - y[previous]) - (x[previous] - x[start:stop]) * (average_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return kept
+
+
+# Function to downsample time-sorted documents to about `threshold` points per field with LTTB:
+# the documents kept are those selected for any of the fields (missing values are skipped)
+def lttb_documents(documents, time_field, fields, threshold):
+    if len(documents) <= threshold:
+        return documents
+    times = np.array([document[time_field].timestamp() if isinstance(document.get(time_field), datetime) else np.nan
+                      for document in documents])
+    kept = set()
+    for field in fields:
+        values = np.array([document.get(field) if isinstance(document.get(field), (int, float)) else np.nan
+                           for document in documents], dtype=np.float64)
+        valid = np.flatnonzero(~np.isnan(values) & ~np.isnan(times))
+        kept.update(valid[lttb_indices(times[valid], values[valid], threshold)].tolist())
+    return [documents[i] for i in sorted(kept)]
+
+
+# Function to list the numeric fields of a document (the fields aggregated when none are given)
+def numeric_fields(document, time_field):
+    return [field for field, value in (document or {}).items()
+            if field not in (time_field, '_id') and isinstance(value, (int, float)) and not isinstance(value, bool)]
@@ -0,0 +1,147 @@
+import json
+import os
+import threading
+
+import pymongo
+
+# Indexes of the served collections: the detector Apps write their results without secondary indexes, so every
+# dashboard refresh would scan the whole collection. The bridge makes sure the time field of every collection it
+# serves is indexed, records the shape of each query (its filter with the values left out) with its latency, and
+# the /advisor route explains the slow shapes and suggests (or creates) compound indexes for them.
+AutoIndexTimeField = os.getenv('AutoIndexTimeField', 'true').lower() in ('1', 'true', 'yes')
+QueryShapeLimit = int(os.getenv('QueryShapeLimit', '1000'))  # Shapes kept per process (the least used are dropped)
+SlowQueryMs = float(os.getenv('SlowQueryMs', '100'))  # Default mean latency above which /advisor reports a shape
+
+_indexed = set()
+_indexed_lock = threading.Lock()
+
+
+# Function to make sure the time field of a collection is indexed (once per process and collection; collections that
+# do not exist yet are not created, and are checked again on the next query)
+def ensure_time_index(collection, time_field):
+    if not AutoIndexTimeField:
+        return
+    key = (collection.database.name, collection.name, time_field)
+    if key in _indexed:
+        return
+    with _indexed_lock:
+        if key in _indexed:
+            return
+        if collection.name not in collection.database.list_collection_names(filter={'name': collection.name}):
+            return
+        collection.create_index([(time_field, pymongo.ASCENDING)])  # No-op when it already exists
+        _indexed.add(key)
+
+
+# Function to get the shape of a filter: its fields and operators, with the values replaced by their kind
+# ('eq' for equality, 'range' for comparisons, 'in' for lists...), e.g. {"outliers": "eq", "timestamp": {"$gte": "range"}}
+def query_shape(query):
+    if isinstance(query, dict):
+        shape = {}
+        for field, value in query.items():
+            if field in ('$and', '$or', '$nor') and isinstance(value, list):
+                shape[field] = [query_shape(item) for item in value]
+            elif field.startswith('$'):
+                shape[field] = 'range' if field in ('$gt', '$gte', '$lt', '$lte') else ('in' if field in ('$in', '$nin') else 'value')
+            elif isinstance(value, dict) and any(name.startswith('$') for name in value):
+                shape[field] = query_shape(value)
+            else:
+                shape[field] = 'eq'
+        return shape
+    return 'value'
+
+
+# Function to split the fields of a filter into equality and range fields (top level and inside $and; $or is ignored)
+def _filter_fields(query, equality, ranges):
+    for field, value in query.items():
+        if field == '$and' and isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict):
+                    _filter_fields(item, equality, ranges)
+        elif field.startswith('$'):
+            continue
+        elif isinstance(value, dict) and any(name.startswith('$') for name in value):
+            operators = set(value)
+            if operators & {'$gt', '$gte', '$lt', '$lte', '$ne', '$nin', '$exists', '$regex'}:
+                ranges.append(field)
+            else:
+                equality.append(field)  # $eq, $in
+        else:
+            equality.append(field)
+
+
+# Function to suggest a compound index for a filter and sort field following the equality-sort-range rule:
+# equality fields first, then the sort field, then the range fields
+def suggest_index(query, sort_field=None):
+    equality, ranges = [], []
+    _filter_fields(query or {}, equality, ranges)
+    fields = []
+    for field in equality + ([sort_field] if sort_field else []) + ranges:
+        if field not in fields:
+            fields.append(field)
+    return [(field, pymongo.ASCENDING) for field in fields]
+
+
+# Function to tell whether an existing index serves a suggested one (the suggestion is a prefix of its key)
+def index_exists(collection, keys):
+    for index in collection.index_information().values():
+        if [field for field, _ in index['key']][:len(keys)] == [field for field, _ in keys]:
+            return True
+    return False
+
+
+# Function to summarise the explain() output of a query: the winning plan stages and the documents examined
+def explain_query(collection, query, sort_field=None):
+    cursor = collection.find(query)
+    if sort_field:
+        cursor = cursor.sort(sort_field, pymongo.ASCENDING)
+    explanation = cursor.explain()
+    stages, plan = [], explanation.get('queryPlanner', {}).get('winningPlan', {})
+    plan = plan.get('queryPlan', plan)  # Plans of the slot-based engine (MongoDB 5.0+) are one level down
+    while plan:
+        stages.append(plan.get('stage', '?') + (f"({plan['indexName']})" if plan.get('indexName') else ''))
+        plan = plan.get('inputStage')
+    statistics = explanation.get('executionStats', {})
+    return {'plan': ' <- '.join(stages), 'docs_examined': statistics.get('totalDocsExamined'),
+            'keys_examined': statistics.get('totalKeysExamined'), 'returned': statistics.get('nReturned'),
+            'explain_ms': statistics.get('executionTimeMillis')}
+
+
+class QueryShapes:
+    """Query shapes seen by this process, per collection, with their count and latency and the last filter of each
+    (used by /advisor to explain the shape). At most QueryShapeLimit shapes are kept."""
+
+    def __init__(self, limit=None):
+        self.limit = limit or QueryShapeLimit
+        self.shapes = {}
+        self._lock = threading.Lock()
+
+    def record(self, database, collection, query, seconds, sort_field=None, mode='raw'):
+        shape = json.dumps(query_shape(query), sort_keys=True)
+        key = (database, collection, shape, sort_field, mode)
+        with self._lock:
+            entry = self.shapes.get(key)
+            if entry is None:
+                if len(self.shapes) >= self.limit:
+                    del self.shapes[min(self.shapes, key=lambda k: self.shapes[k]['count'])]
+                entry = self.shapes[key] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+            entry['count'] += 1
+            entry['total_ms'] += seconds * 1000
+            entry['max_ms'] = max(entry['max_ms'], seconds * 1000)
+            entry['query'] = query
+
+    # Function to list the shapes (of one collection when given) whose mean latency is at least slow_ms, slowest first
+    def slow(self, database=None, collection=None, slow_ms=None):
+        slow_ms = SlowQueryMs if slow_ms is None else slow_ms
+        with self._lock:
+            items = [(key, dict(entry)) for key, entry in self.shapes.items()]
+        result = []
+        for (db, coll, shape, sort_field, mode), entry in items:
+            if (database and db != database) or (collection and coll != collection):
+                continue
+            mean_ms = entry['total_ms'] / entry['count']
+            if mean_ms >= slow_ms:
+                result.append({'database': db, 'collection': coll, 'shape': json.loads(shape), 'sort': sort_field,
+                               'mode': mode, 'count': entry['count'], 'mean_ms': mean_ms, 'max_ms': entry['max_ms'],
+                               'query': entry['query']})
+        return sorted(result, key=lambda item: item['mean_ms'] * item['count'], reverse=True)